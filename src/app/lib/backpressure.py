@@ -0,0 +1,74 @@
+######## BACKPRESSURE #########
+
+# Pauses the inputs while the internal backlog is above a high watermark, until it gets
+# back below a low watermark, so an overload turns into latency instead of memory growth.
+# The gap between both watermarks avoids pausing & resuming on every message.
+import logging
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class Backpressure:
+    """Polls `backlog()` every `interval` seconds, calling `pause` once it exceeds `high`
+    and `resume` once it gets back to `low` or below."""
+
+    def __init__(self, backlog: Callable[[], int], high: int, low: int, pause: Callable[[], None], resume: Callable[[], None],
+                 interval: float = 0.02):
+        if not 0 <= low < high:
+            raise ValueError(f"Low watermark {low} must be below high watermark {high}")
+        self.backlog = backlog
+        self.high = high
+        self.low = low
+        self.pause = pause
+        self.resume = resume
+        self.interval = interval
+        self.paused = False
+        self.pauses = 0
+        self.paused_seconds = 0.0
+        self._paused_since = 0.0
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def check(self) -> bool:
+        """Compare the backlog to the watermarks, pausing or resuming inputs. Return whether inputs are paused."""
+        backlog = self.backlog()
+        if not self.paused and backlog > self.high:
+            logger.warning(f"Backlog of {backlog} items above {self.high}, pausing inputs")
+            self.paused = True
+            self.pauses += 1
+            self._paused_since = time.monotonic()
+            self.pause()
+        elif self.paused and backlog <= self.low:
+            paused_for = time.monotonic() - self._paused_since
+            logger.warning(f"Backlog back to {backlog} items after {paused_for:.1f}s, resuming inputs")
+            self.paused = False
+            self.paused_seconds += paused_for
+            self.resume()
+        return self.paused
+
+    def _watch(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.exception(f"Backpressure check failed: {e}")
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch, name="backpressure", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching, inputs are left as they are."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        paused_seconds = self.paused_seconds + (time.monotonic() - self._paused_since if self.paused else 0)
+        return {"paused": self.paused, "pauses": self.pauses, "paused_seconds": round(paused_seconds, 3),
+                "backlog": self.backlog(), "high_watermark": self.high, "low_watermark": self.low}
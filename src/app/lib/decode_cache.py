@@ -0,0 +1,58 @@
+######## DECODE CACHE #########
+
+# Bounded LRU of decoded frames, keyed by a hash of the reassembled payload & fPort,
+# so identical frames (static configuration, unchanged readings) skip the JS decoder.
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class DecodeCache:
+    """LRU of at most `max_size` decoded frames, each kept at most `ttl` seconds (forever if None).
+
+    Cached dicts are shared between every frame hitting them : they must not be modified.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float | None = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[bytes, tuple[float, dict]] = OrderedDict() # key -> (insertion time, decoded)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(raw: bytes, fPort: int) -> bytes:
+        return hashlib.blake2b(raw, digest_size=16, salt=fPort.to_bytes(2, "big")).digest()
+
+    def get(self, raw: bytes, fPort: int) -> dict | None:
+        key = self.key(raw, fPort)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, raw: bytes, fPort: int, decoded: dict) -> None:
+        key = self.key(raw, fPort)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), decoded)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "expirations": self.expirations}
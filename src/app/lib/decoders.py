@@ -0,0 +1,84 @@
+######## DECODERS #########
+
+# Decoder backends. Every backend decodes a batch of reassembled frames with
+# `decode_batch(raws, fPort)`, giving for each frame a dict, an Exception, or None when
+# the backend does not handle this kind of frame and leaves it to the next backend.
+# The JS worker pool handles every frame, in-process Python decoders only the data
+# formats they know, without any inter-process round-trip.
+import logging
+import threading
+from typing import Callable
+
+from .te_decoder import decode_multipoint
+
+logger = logging.getLogger(__name__)
+
+JS_BACKEND = "js" # Name forcing the JS worker pool for a device
+
+# Returns the decoded frame, or None if the decoder does not handle this frame
+NativeDecoder = Callable[[bytes, int], dict | None]
+
+registry: dict[str, NativeDecoder] = {}
+
+
+def register(name: str, decoder: NativeDecoder) -> None:
+    """Make a Python decoder available under `name` in the decoder.native config."""
+    registry[name] = decoder
+
+register("te-multipoint", decode_multipoint)
+
+
+class PythonBackend:
+    """In-process decoders, tried in order until one handles the frame.
+
+    `devices` maps a DevEUI to the only decoder name to use for it, or to JS_BACKEND
+    so its frames always go to the JS worker pool.
+    """
+
+    name = "python"
+
+    def __init__(self, names: list[str] | None = None, devices: dict[str, str] | None = None):
+        names = list(registry) if names is None else names
+        unknown = [name for name in names + list((devices or {}).values()) if name not in registry and name != JS_BACKEND]
+        if unknown:
+            raise ValueError(f"Unknown decoders {unknown}, available : {list(registry)}")
+        self.decoders = [(name, registry[name]) for name in names]
+        self.devices = devices or {}
+        self.decoded = 0
+        self.passed = 0 # Frames left to the next backend
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def _decoders_for(self, devEUI: str | None) -> list[tuple[str, NativeDecoder]]:
+        forced = self.devices.get(devEUI) if devEUI is not None else None
+        if forced is None:
+            return self.decoders
+        if forced == JS_BACKEND:
+            return []
+        return [(forced, registry[forced])]
+
+    def decode(self, raw: bytes, fPort: int, devEUI: str | None = None) -> dict | None:
+        for name, decoder in self._decoders_for(devEUI):
+            try:
+                decoded = decoder(raw, fPort)
+            except Exception as e:
+                # Left to the next backend, that will decode it or report the error
+                logger.warning(f"Python decoder {name} failed on frame from {devEUI}: {e}")
+                with self._lock:
+                    self.failed += 1
+                continue
+            if decoded is not None:
+                with self._lock:
+                    self.decoded += 1
+                return decoded
+
+        with self._lock:
+            self.passed += 1
+        return None
+
+    def decode_batch(self, raws: list[bytes], fPort: int, devEUIs: list[str] | None = None) -> list[dict | None]:
+        devEUIs = devEUIs or [None] * len(raws) # type: ignore
+        return [self.decode(raw, fPort, devEUI) for raw, devEUI in zip(raws, devEUIs)] # type: ignore
+
+    def stats(self) -> dict:
+        return {"decoders": [name for name, _ in self.decoders], "decoded": self.decoded, "passed": self.passed, "failed": self.failed}
@@ -0,0 +1,89 @@
+######## ENCODING #########
+
+# Serialization of decoded frames for the outputs : JSON as json.dumps() writes it, compact JSON
+# (no whitespace), MessagePack or CBOR, the last two needing their package (msgpack, cbor2).
+# Payloads over `compress_above` bytes can be compressed with zlib, or zstd (zstandard package).
+# Consumers can tell compressed payloads by their first bytes : 78 for zlib, 28 B5 2F FD for zstd.
+import json
+import threading
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENCODINGS = ("json", "json_compact", "msgpack", "cbor")
+COMPRESSIONS = ("zlib", "zstd")
+CONTENT_TYPES = {"json": "application/json", "json_compact": "application/json", "msgpack": "application/msgpack", "cbor": "application/cbor"}
+CONTENT_ENCODINGS = {"zlib": "deflate", "zstd": "zstd"} # HTTP names, deflate being the zlib format
+OPTIONAL_PACKAGES = {"msgpack": ("msgpack", msgpack), "cbor": ("cbor2", cbor2), "zstd": ("zstandard", zstandard)} # option -> package, module
+
+
+class Encoder:
+    """Serialize decoded frames as `encoding`, compressed with `compression` when over `compress_above` bytes."""
+
+    def __init__(self, encoding: str = "json", compression: str | None = None, compress_above: int = 1024):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding {encoding}, valid options : {ENCODINGS}")
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}, valid options : {COMPRESSIONS}")
+        for option in (encoding, compression):
+            package, module = OPTIONAL_PACKAGES.get(option, (None, True)) # type: ignore
+            if module is None:
+                raise ValueError(f"{option} needs the {package} package, which is not installed")
+        self.encoding = encoding
+        self.compression = compression
+        self.compress_above = compress_above
+        self.content_type = CONTENT_TYPES[encoding]
+        self.content_encoding = CONTENT_ENCODINGS.get(compression) # type: ignore
+
+        if encoding == "json":
+            self._serialize = lambda obj: json.dumps(obj).encode()
+        elif encoding == "json_compact":
+            self._serialize = lambda obj: json.dumps(obj, separators=(",", ":")).encode()
+        elif encoding == "msgpack":
+            self._serialize = msgpack.packb # type: ignore
+        else:
+            self._serialize = cbor2.dumps # type: ignore
+        self._zstd = threading.local() # Compressors can't be shared between threads
+
+        self._lock = threading.Lock()
+        self.encoded = 0
+        self.compressed = 0
+        self.raw_bytes = 0 # serialized, before compression
+        self.wire_bytes = 0
+
+    def _compress(self, payload: bytes) -> bytes:
+        if self.compression == "zlib":
+            return zlib.compress(payload)
+        compressor = getattr(self._zstd, "compressor", None)
+        if compressor is None:
+            compressor = self._zstd.compressor = zstandard.ZstdCompressor() # type: ignore
+        return compressor.compress(payload)
+
+    def encode(self, obj: dict | list) -> tuple[bytes, str | None]:
+        """Payload of `obj`, and its HTTP content encoding if it was compressed."""
+        payload = self._serialize(obj)
+        raw_bytes = len(payload)
+        compressed = self.compression is not None and raw_bytes > self.compress_above
+        if compressed:
+            payload = self._compress(payload)
+        with self._lock:
+            self.encoded += 1
+            self.compressed += compressed
+            self.raw_bytes += raw_bytes
+            self.wire_bytes += len(payload)
+        return payload, self.content_encoding if compressed else None
+
+    def stats(self) -> dict:
+        return {"encoding": self.encoding, "compression": self.compression, "encoded": self.encoded, "compressed": self.compressed,
+                "raw_bytes": self.raw_bytes, "wire_bytes": self.wire_bytes}
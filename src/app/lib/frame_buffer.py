@@ -0,0 +1,311 @@
+######## FRAME BUFFER #########
+
+# Pending fragments storage, split in independently locked shards so that
+# devices hashing to different shards never wait on each other.
+import heapq
+import itertools
+import logging
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Callable, Iterator
+
+from .schemas import Frame, FrameLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD_COUNT = 64
+EVICTION_LOG_INTERVAL = 10 # second, min delay between two eviction warnings
+
+
+class PendingFrame:
+    """Fragments received so far from one device, stored back to back in a single buffer."""
+
+    __slots__ = ("data", "offsets", "last_time")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("I") # End offset of each fragment in data
+        self.last_time = 0.0 # Reception time of the last fragment
+
+    def add(self, raw: bytes, received_time: float) -> int:
+        """Append a fragment, return the number of fragments pending."""
+        self.data += raw
+        self.offsets.append(len(self.data))
+        self.last_time = received_time
+        return len(self.offsets)
+
+    def payload(self) -> memoryview:
+        """Whole reassembled frame, without copying the fragments."""
+        return memoryview(self.data)
+
+    def fragments(self) -> list[bytes]:
+        start, result = 0, []
+        for end in self.offsets:
+            result.append(bytes(self.data[start:end]))
+            start = end
+        return result
+
+    def copy(self) -> "PendingFrame":
+        pending = PendingFrame()
+        pending.data, pending.offsets, pending.last_time = bytearray(self.data), array("I", self.offsets), self.last_time
+        return pending
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+
+class _Shard:
+    __slots__ = ("lock", "frames", "deadlines", "bytes", "fragments", "recent")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames: dict[str, PendingFrame] = {}
+        # Min-heap of (last fragment time, DevEUI). Entries are not removed when a
+        # device gets a new fragment or is reassembled, they are skipped once popped.
+        self.deadlines: list[tuple[float, str]] = []
+        self.bytes = 0
+        self.fragments = 0
+        # DevEUI -> update sequence number, least recently updated first. Only kept under a budget
+        self.recent: OrderedDict[str, int] = OrderedDict()
+
+    def track(self, devEUI: str, pending: PendingFrame) -> None:
+        """Record the last fragment time of a device. Shard lock must be held."""
+        heapq.heappush(self.deadlines, (pending.last_time, devEUI))
+
+        # Rebuild the heap once stale entries outnumber live ones
+        if len(self.deadlines) > 2 * len(self.frames) + 64:
+            self.deadlines = [(other.last_time, other_devEUI) for other_devEUI, other in self.frames.items()]
+            heapq.heapify(self.deadlines)
+
+    def is_current(self, last_time: float, devEUI: str) -> bool:
+        pending = self.frames.get(devEUI)
+        return pending is not None and pending.last_time == last_time
+
+
+class FrameBuffer(MutableMapping):
+    """DevEUI -> PendingFrame mapping, striped over `shard_count` locks.
+
+    Every operation only locks the shard owning the DevEUI. Whole-buffer
+    operations (sweep, expire, snapshot) visit the shards one after the other, so
+    they never hold more than one lock at a time.
+
+    Total pending bytes and fragments can be capped with `max_bytes` / `max_fragments`.
+    Once over budget, the devices with the least recent fragment are evicted. Usage is
+    counted per shard, and the recency order only kept when a budget is set.
+    """
+
+    def __init__(self, shard_count: int = DEFAULT_SHARD_COUNT, max_bytes: int | None = None, max_fragments: int | None = None):
+        self._shards = [_Shard() for _ in range(shard_count)]
+        # Called with the DevEUI, under its shard lock, each time its pending fragments change
+        self.on_change: Callable[[str], None] | None = None
+
+        self.max_bytes = max_bytes
+        self.max_fragments = max_fragments
+        self._sequence = itertools.count() # Orders updates across shards, without a shared lock
+        self._eviction_lock = threading.Lock()
+        self.evicted = 0
+        self._evicted_reported = 0
+        self._last_eviction_log = 0.0
+
+    def _changed(self, devEUI: str) -> None:
+        if self.on_change is not None:
+            self.on_change(devEUI)
+
+    @property
+    def budgeted(self) -> bool:
+        return self.max_bytes is not None or self.max_fragments is not None
+
+    @property
+    def pending_bytes(self) -> int:
+        return sum(shard.bytes for shard in self._shards)
+
+    @property
+    def pending_fragments(self) -> int:
+        return sum(shard.fragments for shard in self._shards)
+
+    def _added(self, shard: _Shard, devEUI: str, added_bytes: int, added_fragments: int) -> None:
+        """Account for new fragments. Shard lock must be held."""
+        shard.bytes += added_bytes
+        shard.fragments += added_fragments
+        if self.budgeted:
+            shard.recent[devEUI] = next(self._sequence)
+            shard.recent.move_to_end(devEUI)
+        self._changed(devEUI)
+
+    def _removed(self, shard: _Shard, devEUI: str, pending: PendingFrame) -> None:
+        """Account for a deleted device. Shard lock must be held."""
+        shard.bytes -= len(pending.data)
+        shard.fragments -= len(pending)
+        shard.recent.pop(devEUI, None)
+        self._changed(devEUI)
+
+    def _least_recent(self) -> str | None:
+        """Least recently updated device across shards, None if none is tracked."""
+        oldest = None
+        for shard in self._shards:
+            with shard.lock:
+                if shard.recent:
+                    devEUI, sequence = next(iter(shard.recent.items()))
+                    if oldest is None or sequence < oldest[0]:
+                        oldest = (sequence, devEUI)
+        return oldest[1] if oldest is not None else None
+
+    def _over_budget(self) -> bool:
+        return (self.max_bytes is not None and self.pending_bytes > self.max_bytes) or \
+               (self.max_fragments is not None and self.pending_fragments > self.max_fragments)
+
+    def _evict(self) -> None:
+        """Evict least recently updated devices until back under budget. No lock must be held."""
+        if not self.budgeted:
+            return
+        evicted = 0
+        while self._over_budget():
+            devEUI = self._least_recent()
+            if devEUI is None:
+                break
+            if self.pop(devEUI) is not None:
+                evicted += 1
+
+        if evicted:
+            with self._eviction_lock:
+                self.evicted += evicted
+                if time.monotonic() - self._last_eviction_log < EVICTION_LOG_INTERVAL:
+                    return
+                self._last_eviction_log = time.monotonic()
+                since_last_report, self._evicted_reported = self.evicted - self._evicted_reported, self.evicted
+            logger.warning(f"Pending fragments budget exceeded, evicted {since_last_report} devices since last report ({self.evicted} in total)")
+
+    def _shard(self, devEUI: str) -> _Shard:
+        return self._shards[hash(devEUI) % len(self._shards)]
+
+    def lock(self, devEUI: str) -> threading.Lock:
+        """Lock guarding the shard of this DevEUI."""
+        return self._shard(devEUI).lock
+
+    def append(self, frame: Frame, max_chunks: int | None = None, max_frame_bytes: int | None = None) -> int:
+        """Store a fragment, return the number of fragments pending for its DevEUI.
+
+        If the fragment would make the device go over `max_chunks` fragments or
+        `max_frame_bytes` reassembled bytes, it is rejected and every fragment pending
+        for the device is dropped, then FrameLimitExceeded is raised.
+        """
+        shard = self._shard(frame["devEUI"])
+        with shard.lock:
+            pending = shard.frames.get(frame["devEUI"])
+            if pending is not None and (
+                (max_chunks is not None and len(pending) + 1 > max_chunks) or
+                (max_frame_bytes is not None and len(pending.data) + len(frame["raw"]) > max_frame_bytes)
+            ):
+                self._removed(shard, frame["devEUI"], shard.frames.pop(frame["devEUI"]))
+                raise FrameLimitExceeded
+            if max_frame_bytes is not None and len(frame["raw"]) > max_frame_bytes:
+                raise FrameLimitExceeded
+
+            if pending is None:
+                pending = shard.frames[frame["devEUI"]] = PendingFrame()
+            count = pending.add(frame["raw"], frame["received_time"])
+            shard.track(frame["devEUI"], pending)
+            self._added(shard, frame["devEUI"], len(frame["raw"]), 1)
+        self._evict()
+        return count
+
+    def pop(self, devEUI: str, default=None) -> PendingFrame | None:
+        """Atomically remove and return every fragment pending for this DevEUI."""
+        shard = self._shard(devEUI)
+        with shard.lock:
+            pending = shard.frames.pop(devEUI, None)
+            if pending is None:
+                return default
+            self._removed(shard, devEUI, pending)
+            return pending
+
+    def copy_of(self, devEUI: str) -> PendingFrame | None:
+        """Copy of the fragments pending for this DevEUI, None if there are none."""
+        shard = self._shard(devEUI)
+        with shard.lock:
+            pending = shard.frames.get(devEUI)
+            return pending.copy() if pending is not None else None
+
+    def sweep(self, should_delete: Callable[[str, PendingFrame], bool]) -> list[str]:
+        """Delete every DevEUI for which `should_delete` is true, shard by shard."""
+        deleted = []
+        for shard in self._shards:
+            with shard.lock:
+                to_be_deleted = [devEUI for devEUI, pending in shard.frames.items() if should_delete(devEUI, pending)]
+                for devEUI in to_be_deleted:
+                    self._removed(shard, devEUI, shard.frames.pop(devEUI))
+            deleted.extend(to_be_deleted)
+        return deleted
+
+    def expire(self, older_than: float) -> list[str]:
+        """Delete every DevEUI whose last fragment was received before `older_than`.
+
+        Only devices actually due are visited, thanks to the per-shard heaps.
+        """
+        deleted = []
+        for shard in self._shards:
+            with shard.lock:
+                while shard.deadlines and shard.deadlines[0][0] < older_than:
+                    last_time, devEUI = heapq.heappop(shard.deadlines)
+                    if shard.is_current(last_time, devEUI):
+                        self._removed(shard, devEUI, shard.frames.pop(devEUI))
+                        deleted.append(devEUI)
+        return deleted
+
+    def oldest_fragment_time(self) -> float | None:
+        """Last fragment time of the least recently updated device, None if buffer is empty.
+
+        Can be earlier than the real value because of stale heap entries, never later.
+        """
+        candidates = [shard.deadlines[0][0] for shard in self._shards if shard.deadlines]
+        return min(candidates) if candidates else None
+
+    def snapshot(self) -> dict[str, PendingFrame]:
+        """Copy of the buffer content, safe to be read while fragments keep coming."""
+        result = {}
+        for shard in self._shards:
+            with shard.lock:
+                for devEUI, pending in shard.frames.items():
+                    result[devEUI] = pending.copy()
+        return result
+
+    # Mapping interface
+
+    def __getitem__(self, devEUI: str) -> PendingFrame:
+        return self._shard(devEUI).frames[devEUI]
+
+    def __setitem__(self, devEUI: str, pending: PendingFrame) -> None:
+        shard = self._shard(devEUI)
+        with shard.lock:
+            previous = shard.frames.get(devEUI)
+            if previous is not None:
+                self._removed(shard, devEUI, previous)
+            shard.frames[devEUI] = pending
+            shard.track(devEUI, pending)
+            self._added(shard, devEUI, len(pending.data), len(pending))
+        self._evict()
+
+    def __delitem__(self, devEUI: str) -> None:
+        shard = self._shard(devEUI)
+        with shard.lock:
+            self._removed(shard, devEUI, shard.frames.pop(devEUI))
+
+    def __contains__(self, devEUI: object) -> bool:
+        return devEUI in self._shard(devEUI).frames # type: ignore
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.snapshot())
+
+    def __len__(self) -> int:
+        return sum(len(shard.frames) for shard in self._shards)
+
+    def clear(self) -> None:
+        for shard in self._shards:
+            with shard.lock:
+                for devEUI, pending in shard.frames.items():
+                    self._removed(shard, devEUI, pending)
+                shard.frames.clear()
+                shard.deadlines.clear()
@@ -0,0 +1,114 @@
+######## FRAME STORE #########
+
+# Optional on-disk copy of the frame buffer, so pending fragments survive a restart.
+# SQLite in WAL mode, one row per pending device. Changes are written behind :
+# devices are only marked dirty on the ingest path, and a background thread writes
+# their latest state in a single fsynced transaction every `sync_interval`.
+import logging
+import sqlite3
+import threading
+from array import array
+
+from .frame_buffer import FrameBuffer, PendingFrame
+
+logger = logging.getLogger(__name__)
+
+
+class FrameStore:
+    def __init__(self, path: str, sync_interval: float = 1.0):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.buffer: FrameBuffer | None = None
+        self._dirty: set[str] = set()
+        self._dirty_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL") # One fsync per flush
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            "devEUI TEXT PRIMARY KEY, data BLOB NOT NULL, offsets BLOB NOT NULL, last_time REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._db.commit()
+
+    def attach(self, buffer: FrameBuffer, max_chunks: int | None = None) -> int:
+        """Load the stored devices into `buffer`, then follow its changes. Return the number of devices recovered.
+
+        Devices over `max_chunks` fragments, or evicted by the buffer budget while loading, are deleted from the store.
+        """
+        with self._db_lock:
+            stored = []
+            for devEUI, data, offsets, last_time in self._db.execute("SELECT devEUI, data, offsets, last_time FROM pending"):
+                pending = PendingFrame()
+                pending.data = bytearray(data)
+                pending.offsets = array("I")
+                pending.offsets.frombytes(offsets)
+                pending.last_time = last_time
+                stored.append(devEUI)
+                if max_chunks is None or len(pending) <= max_chunks:
+                    buffer[devEUI] = pending
+
+            dropped = [(devEUI,) for devEUI in stored if devEUI not in buffer]
+            if dropped:
+                with self._db:
+                    self._db.executemany("DELETE FROM pending WHERE devEUI = ?", dropped)
+                logger.warning(f"{len(dropped)} stored devices over max_chunks or the pending fragments budget were not recovered")
+
+        self.buffer = buffer
+        buffer.on_change = self.mark
+        return len(stored) - len(dropped)
+
+    def mark(self, devEUI: str) -> None:
+        with self._dirty_lock:
+            self._dirty.add(devEUI)
+
+    def flush(self) -> int:
+        """Write the current state of every dirty device. Return the number of devices written."""
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty or self.buffer is None:
+            return 0
+
+        upserts, deletes = [], []
+        for devEUI in dirty:
+            pending = self.buffer.copy_of(devEUI)
+            if pending is None:
+                deletes.append((devEUI,))
+            else:
+                upserts.append((devEUI, bytes(pending.data), pending.offsets.tobytes(), pending.last_time))
+
+        try:
+            with self._db_lock:
+                with self._db: # Single transaction
+                    self._db.executemany("DELETE FROM pending WHERE devEUI = ?", deletes)
+                    self._db.executemany("INSERT OR REPLACE INTO pending VALUES (?, ?, ?, ?)", upserts)
+        except Exception:
+            # Written again next time, with the state of that moment
+            with self._dirty_lock:
+                self._dirty |= dirty
+            raise
+        return len(dirty)
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write pending fragments to {self.path}: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="frame-store", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the background writer, write what is left and close the database."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._db_lock:
+            self._db.close()
@@ -0,0 +1,194 @@
+######## HTTP OUTPUT #########
+
+# Decoded frames POSTed to the configured URL by a pool of `concurrency` threads, sharing
+# one keep-alive session so connections (and TLS handshakes) are reused between frames.
+# Frames are queued without waiting for the endpoint, a full queue blocks the caller.
+# Failed requests are retried with exponential backoff. Frames can be sent by batches,
+# one request holding up to `batch_size` frames, gathered for at most `batch_linger_ms`.
+# With an outbox, frames still failing after their retries are stored on disk, and so are
+# the next ones until the endpoint is back, then sent again by a drainer thread.
+# Bodies are serialized once per request, whatever the retries, by the configured encoding.
+import logging
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .encoding import Encoder
+from .outbox import Drainer, Outbox, encode_frame
+from .pipeline import Stage
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = {429, 500, 502, 503, 504} # Worth retrying, other errors would fail the same way
+
+
+class HttpOutput:
+    """POST `{"frame": decoded}` to `url`, at most `concurrency` requests at a time.
+    With `batch_size`, POST a JSON array of `{"devEUI": ..., "frame": decoded}` instead.
+
+    A request is tried `retries + 1` times, waiting `backoff` seconds before the first retry,
+    doubled for each next one up to `max_backoff`, with some jitter.
+    With an `outbox`, frames failing with a retryable error are stored instead of given up,
+    and sent again at most `drain_rate` frames/s.
+    Bodies are JSON by default, see `Encoder` for the other `encoding` and `compression` options.
+    """
+
+    def __init__(self, url: str, concurrency: int = 4, depth: int = 1000, connect_timeout: float = 3, read_timeout: float = 10,
+                 retries: int = 3, backoff: float = 0.5, max_backoff: float = 30, batch_size: int | None = None, batch_linger_ms: float = 50,
+                 outbox: Outbox | None = None, drain_rate: float = 100,
+                 encoding: str = "json", compression: str | None = None, compress_above: int = 1024):
+        self.url = url
+        self.encoder = Encoder(encoding, compression, compress_above)
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        # One connection per thread is enough, they are kept alive between requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.stage = Stage("http_output", self._send, depth=depth, workers=concurrency, batch_size=batch_size, batch_linger_ms=batch_linger_ms)
+        self._stop_event = threading.Event()
+        self._counter_lock = threading.Lock()
+        self.sent = 0 # frames
+        self.failed = 0 # frames
+        self.retried = 0 # requests
+        self.requests = 0
+
+        self.outbox = outbox
+        self.drainer: Drainer | None = None
+        if outbox is not None:
+            self.drainer = Drainer(outbox, self._drain, rate=drain_rate, batch_size=batch_size or 10)
+        self.down = False # Endpoint unreachable, new frames go straight to the outbox
+        self.stored = 0 # frames
+
+    def start(self):
+        self._stop_event.clear()
+        self.stage.start()
+        if self.drainer is not None:
+            self.drainer.start()
+
+    def stop(self, timeout: float | None = None):
+        """Send what is already queued, then close the connections. Pending retries are given up,
+        or stored in the outbox."""
+        self._stop_event.set()
+        self.stage.stop(timeout)
+        if self.drainer is not None and self.outbox is not None:
+            self.drainer.stop()
+            self.outbox.close()
+        self.session.close()
+
+    def submit(self, devEUI: str, frame: dict) -> bool:
+        if self.down and self.outbox is not None:
+            return self._store([(devEUI, frame)]) == 1
+        return self.stage.submit((devEUI, frame))
+
+    def _store(self, items: list[tuple[str, dict]]) -> int:
+        """Append frames to the outbox. Return how many were kept, the others being dropped."""
+        assert self.outbox is not None
+        stored = sum(self.outbox.append(encode_frame(devEUI, frame)) for devEUI, frame in items)
+        with self._counter_lock:
+            self.stored += stored
+            self.failed += len(items) - stored
+        return stored
+
+    def qsize(self) -> int:
+        return self.stage.qsize()
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before retry number `attempt` (from 1)."""
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return delay * random.uniform(0.5, 1) # Spread retries of frames that failed together
+
+    def _post(self, body: tuple[bytes, dict]) -> tuple[str | None, bool]:
+        """Send an encoded body once. Return why it failed (None on success) and whether it is worth retrying."""
+        payload, headers = body
+        try:
+            response = self.session.post(self.url, data=payload, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            return f"{type(e).__name__}: {e}", True
+        if response.status_code >= 400:
+            return f"HTTP {response.status_code}", response.status_code in RETRY_STATUS
+        return None, False
+
+    def _body(self, items: list[tuple[str, dict]]) -> tuple[bytes, dict]:
+        """Encoded body of a request, and its headers."""
+        if self.stage.batch_size is not None:
+            body: dict | list = [{"devEUI": devEUI, "frame": frame} for devEUI, frame in items]
+        else:
+            body = {"frame": items[0][1]}
+        payload, content_encoding = self.encoder.encode(body)
+        headers = {"Content-Type": self.encoder.content_type}
+        if content_encoding is not None:
+            headers["Content-Encoding"] = content_encoding
+        return payload, headers
+
+    def _send(self, item: tuple[str, dict] | list[tuple[str, dict]]) -> None:
+        items = item if isinstance(item, list) else [item] # Batch or single frame
+        body, count = self._body(items), len(items)
+        what = f"a batch of {count} decoded frames" if isinstance(item, list) else f"decoded frame of {items[0][0]}"
+
+        attempts = 0
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                if self._stop_event.wait(self.delay(attempt)):
+                    break
+                with self._counter_lock:
+                    self.retried += 1
+
+            attempts += 1
+            error, retry = self._post(body)
+            with self._counter_lock:
+                self.requests += 1
+                self.sent += count if error is None else 0
+            if error is None:
+                return
+            if not retry:
+                break
+
+        if retry and self.outbox is not None:
+            if not self.down:
+                logger.warning(f"{self.url} unreachable ({error}), storing decoded frames in outbox {self.outbox.path}")
+            self.down = True
+            self._store(items)
+            return
+        with self._counter_lock:
+            self.failed += count
+        logger.error(f"Failed to send {what} to {self.url} after {attempts} attempts: {error}")
+
+    def _drain(self, items: list[tuple[str, dict]]) -> int:
+        """Send frames from the outbox, once each. Return how many are done with, from the first one."""
+        requests_items = [items] if self.stage.batch_size is not None else [[item] for item in items]
+        done = 0
+        for request_items in requests_items:
+            error, retry = self._post(self._body(request_items))
+            with self._counter_lock:
+                self.requests += 1
+                if error is None:
+                    self.sent += len(request_items)
+                elif not retry: # Would fail the same way forever
+                    self.failed += len(request_items)
+            if error is not None and retry:
+                break
+            if error is not None:
+                logger.error(f"Failed to send {len(request_items)} decoded frames from the outbox to {self.url}: {error}")
+            done += len(request_items)
+
+        if done and self.down:
+            self.down = False
+            logger.warning(f"{self.url} reachable again, sending the {self.outbox.pending if self.outbox else 0} frames of the outbox")
+        return done
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "failed": self.failed, "requests": self.requests, "retried": self.retried, "queued": self.qsize(),
+                "concurrency": self.stage.workers, "batch_size": self.stage.batch_size, "encoding": self.encoder.stats(), "outbox": self.outbox_stats()}
+
+    def outbox_stats(self) -> dict | None:
+        if self.outbox is None or self.drainer is None:
+            return None
+        return {**self.outbox.stats(), "down": self.down, "stored": self.stored, "drained": self.drainer.drained}
@@ -1,28 +1,49 @@
-import ast
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from multiprocessing import Queue, Process
 import pythonmonkey as pm
 import signal
 
+from .latency import LatencyHistogram
+from .schemas import JSWorkerFail
+
+logger = logging.getLogger(__name__)
+
 def js_worker(task_queue, result_queue):
-    """Process that listens for tasks and executes JS functions."""
+    """Process that listens for tasks and executes JS functions.
+
+    Tasks are (request_id, func_name, [args, ...]) : the function is called once per
+    args tuple, and the whole batch is answered by a single (request_id, [result, ...]).
+    Bytes arguments are handed to JS as arrays of numbers. Each result is either
+    (True, JSON text of the returned value) or (False, error message)."""
     decoder = pm.require("../../submodules/ttn-decoder/TnnJsDecoder/TE_TtnDecoder.js")
+    to_json = pm.eval("JSON.stringify")
 
     signal.signal(signal.SIGINT, signal.SIG_IGN)
     while True:
         task = task_queue.get()  # Wait for task
         if task == "STOP":
             break  # Stop process
-        
-        try:
-            func_name, args = task  # Extract function name and arguments
-            if hasattr(decoder, func_name):
-                result = getattr(decoder, func_name)(*args)
-                result_queue.put(str(result))
-            else:
-                result_queue.put(f"Error: {func_name} not found in JS module")
 
-        except Exception as e:
-            result_queue.put(f"Error: {e}")
+        request_id, func_name, args_list = task  # Extract function name and arguments
+        results = []
+        for args in args_list:
+            try:
+                if hasattr(decoder, func_name):
+                    args = [list(arg) if isinstance(arg, (bytes, bytearray)) else arg for arg in args]
+                    result = getattr(decoder, func_name)(*args)
+                    results.append((True, to_json(result)))
+                else:
+                    results.append((False, f"{func_name} not found in JS module"))
+
+            except Exception as e:
+                results.append((False, str(e)))
+        result_queue.put((request_id, results))
 
 
 
@@ -33,23 +54,280 @@ def start_js_worker():
     """Start the JS worker process and return the queues and process."""
     task_queue = Queue()
     result_queue = Queue()
-    
+
     worker_process = Process(target=js_worker, args=(task_queue, result_queue))
     worker_process.start()
 
     return worker_process, task_queue, result_queue
 
-def stop_js_worker(task_queue: Queue, process: Process):
-    # Stop the fetcher process
+def stop_js_worker(task_queue: Queue, process: Process, timeout: float = 5):
+    # Stop the fetcher process, killing it if it does not stop by itself
     task_queue.put("STOP")
-    process.join()
+    process.join(timeout)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+def parse_result(result: tuple[bool, str]) -> dict:
+    ok, payload = result
+    if not ok:
+        raise JSWorkerFail(payload)
+    return json.loads(payload)
+
+
+
+####### Worker pool #######
+
+DEFAULT_TIMEOUT = 5 # second, max time a worker may go without answering while calls are pending
+DEFAULT_MAX_WORKERS = 2 # Each worker is a process with its own SpiderMonkey engine, see README sizing
+PREWARM_FRAME = bytes.fromhex("152f") + bytes(16) # Smallest multipoint vibration frame
+
+
+def default_size() -> int:
+    """Worker count when not configured : CPUs this process may run on, at most DEFAULT_MAX_WORKERS.
+    os.cpu_count() would give the host cores, whatever the container limits."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    return max(1, min(cpus, DEFAULT_MAX_WORKERS))
+
+
+class _Request:
+    __slots__ = ("future", "single", "func_name", "args_list", "sent", "attempts")
+
+    def __init__(self, future: Future, single: bool, func_name: str, args_list: list[tuple]):
+        self.future = future
+        self.single = single
+        self.func_name = func_name
+        self.args_list = args_list
+        self.sent = 0.0
+        self.attempts = 0
+
+
+class JSWorker:
+    """One decoder process, with its own queues.
+
+    Every call is tagged with a request id, and a collector thread hands each result
+    to the Future of the matching call, so any number of calls can be in flight.
+    A batch of calls travels as a single message each way.
+
+    The process can be replaced with `restart`, calls in flight being sent again to the
+    new process or failed.
+    """
+
+    def __init__(self, latency: LatencyHistogram | None = None):
+        self.latency = latency
+        self._ids = itertools.count()
+        self._pending: dict[int, _Request] = {} # request id -> call waiting for its result
+        self._pending_lock = threading.Lock()
+        self.restarts = 0
+        self._spawn()
+
+    def _spawn(self):
+        self.process, self.task_queue, self.result_queue = start_js_worker()
+        self.last_progress = time.monotonic() # Last time a result came back, or the worker got busy
+        self._collector = threading.Thread(target=self._collect, args=(self.result_queue,), name="js-collector", daemon=True)
+        self._collector.start()
+
+    @property
+    def outstanding(self) -> int:
+        """Calls sent to this worker and not answered yet"""
+        return len(self._pending)
+
+    def is_stuck(self, timeout: float) -> bool:
+        """True if calls are pending and no result came back for `timeout` seconds."""
+        return bool(self._pending) and time.monotonic() - self.last_progress > timeout
+
+    def call(self, func_name: str, *args) -> Future:
+        """Send a JS function call request, the Future resolves to its raw result."""
+        return self._send(_Request(Future(), True, func_name, [args]))
+
+    def call_batch(self, func_name: str, args_list: list[tuple]) -> Future:
+        """Send one request calling the function for each args tuple, the Future resolves to the list of raw results."""
+        return self._send(_Request(Future(), False, func_name, args_list))
+
+    def _send(self, request: _Request) -> Future:
+        with self._pending_lock:
+            request_id = next(self._ids)
+            request.sent = time.monotonic()
+            request.attempts += 1
+            if not self._pending:
+                self.last_progress = request.sent
+            self._pending[request_id] = request
+            self.task_queue.put((request_id, request.func_name, request.args_list))
+        return request.future
+
+    def _collect(self, result_queue: Queue):
+        while True:
+            try:
+                message = result_queue.get()
+            except Exception: # Queue broken by a killed process
+                break
+            if message is None:
+                break
+            request_id, results = message
+            with self._pending_lock:
+                request = self._pending.pop(request_id, None)
+                if request is not None:
+                    self.last_progress = time.monotonic()
+            if request is not None:
+                if self.latency is not None:
+                    self.latency.record(self.last_progress - request.sent)
+                request.future.set_result(results[0] if request.single else results)
+
+    def restart(self, max_attempts: int) -> tuple[int, int]:
+        """Kill the process and start a new one.
+
+        Calls in flight that were sent less than `max_attempts` times are sent to the new
+        process, the others fail with JSWorkerFail. Return (retried, failed) call counts.
+        """
+        with self._pending_lock:
+            old_process, old_result_queue = self.process, self.result_queue
+            in_flight, self._pending = list(self._pending.values()), {}
+            self._spawn()
+        old_process.kill()
+        old_process.join()
+        old_result_queue.put(None) # Stop the old collector
+        self.restarts += 1
+
+        retried = failed = 0
+        for request in in_flight:
+            if request.attempts < max_attempts:
+                self._send(request)
+                retried += 1
+            else:
+                request.future.set_exception(JSWorkerFail(f"JS worker restarted, call to {request.func_name} failed after {request.attempts} attempts"))
+                failed += 1
+        return retried, failed
+
+    def stop(self):
+        stop_js_worker(self.task_queue, self.process)
+        self.result_queue.put(None) # Stop the collector
+        self._collector.join()
+
+
+class JSWorkerPool:
+    """Pool of decoder processes, so decoding is spread over several cores.
+
+    Dispatch is either "least-outstanding" (worker with the fewest pending calls)
+    or "affinity" (same key, typically the DevEUI, always goes to the same worker).
+
+    A watchdog restarts any worker that died, or that has calls pending and answered
+    none of them for `timeout` seconds. Its calls in flight are retried `retries` times,
+    then fail with JSWorkerFail, so every decode ends within about `timeout * (retries + 1)`.
+    """
+
+    name = "js" # Decoder backend name, see lib/decoders.py
+
+    def __init__(self, size: int | None = None, dispatch: str = "least-outstanding",
+                 timeout: float = DEFAULT_TIMEOUT, retries: int = 1, slo_ms: float = 100):
+        self.size = size or default_size()
+        self.dispatch = dispatch
+        self.timeout = timeout
+        self.retries = retries
+        # Callers give up on their own past this, should the watchdog be late
+        self.deadline = timeout * (retries + 2)
+        self.latency = LatencyHistogram(slo_ms)
+        self.workers = [JSWorker(self.latency) for _ in range(self.size)]
+
+        self.crashes = 0
+        self.timeouts = 0
+        self.retried = 0
+        self.failed = 0
+        self._stop = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, name="js-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def _watch(self):
+        while not self._stop.wait(min(self.timeout / 2, 1)):
+            for worker in self.workers:
+                self.check(worker)
+
+    def check(self, worker: JSWorker) -> bool:
+        """Restart the worker if it is dead or stuck. Return True if it was restarted."""
+        if not worker.process.is_alive():
+            self.crashes += 1
+            logger.error(f"JS worker {worker.process.pid} died (exit code {worker.process.exitcode}), restarting it...")
+        elif worker.is_stuck(self.timeout):
+            self.timeouts += 1
+            logger.error(f"JS worker {worker.process.pid} did not answer for {self.timeout}s, restarting it...")
+        else:
+            return False
+
+        retried, failed = worker.restart(self.retries + 1)
+        self.retried += retried
+        self.failed += failed
+        if failed:
+            logger.warning(f"{failed} decode calls failed after {self.retries + 1} attempts")
+        return True
+
+    def _pick(self, key=None) -> JSWorker:
+        if self.dispatch == "affinity" and key is not None:
+            return self.workers[hash(key) % len(self.workers)]
+        return min(self.workers, key=lambda worker: worker.outstanding)
+
+    def _wait(self, future: Future):
+        try:
+            return future.result(timeout=self.deadline)
+        except FutureTimeoutError:
+            raise JSWorkerFail(f"No answer from JS worker after {self.deadline}s")
+
+    def prewarm(self) -> float:
+        """Decode a synthetic frame on every worker and wait for all of them. Return the seconds it took."""
+        started = time.monotonic()
+        futures = [worker.call("te_decoder", PREWARM_FRAME, 10) for worker in self.workers]
+        for future in futures:
+            parse_result(self._wait(future))
+        return time.monotonic() - started
+
+    def submit(self, raw: bytes, fPort: int, key=None) -> Future:
+        """Queue a decode without waiting for it. The Future resolves to the raw JS result."""
+        return self._pick(key).call("te_decoder", bytes(raw), 10)
+
+    def decode(self, raw: bytes, fPort: int, key=None) -> dict:
+        return parse_result(self._wait(self.submit(raw, fPort, key)))
+
+    def submit_batch(self, raws: list[bytes], fPort: int, key=None) -> Future:
+        """Queue the decode of several frames as a single request to one worker."""
+        return self._pick(key).call_batch("te_decoder", [(bytes(raw), 10) for raw in raws])
+
+    def decode_batch(self, raws: list[bytes], fPort: int, devEUIs: list[str] | None = None) -> list[dict | Exception]:
+        """Decode several frames in one round-trip per worker. A frame that fails gives its exception instead of a dict.
+
+        With "affinity" dispatch and `devEUIs`, the batch is split so each frame goes to the worker of its device.
+        """
+        groups: dict[int, list[int]] = {} # worker index -> frame indexes
+        if self.dispatch == "affinity" and devEUIs is not None:
+            for i, devEUI in enumerate(devEUIs):
+                groups.setdefault(self.workers.index(self._pick(devEUI)), []).append(i)
+        else:
+            groups[self.workers.index(self._pick())] = list(range(len(raws)))
+
+        futures = [(indexes, self.workers[worker].call_batch("te_decoder", [(bytes(raws[i]), 10) for i in indexes]))
+                   for worker, indexes in groups.items()]
+        decoded: list[dict | Exception] = [None] * len(raws) # type: ignore
+        for indexes, future in futures:
+            try:
+                results = self._wait(future)
+            except JSWorkerFail as e:
+                results = [e] * len(indexes)
+            for i, result in zip(indexes, results):
+                try:
+                    decoded[i] = result if isinstance(result, Exception) else parse_result(result)
+                except Exception as e:
+                    decoded[i] = e
+        return decoded
 
-def call_js_function(task_queue, result_queue, func_name, *args):
-    """Send a JS function call request and get the result."""
-    task_queue.put((func_name, args))  # Send function and args
-    return result_queue.get()  # Receive result
+    def stats(self) -> dict:
+        return {
+            "workers": self.size,
+            "outstanding": sum(worker.outstanding for worker in self.workers),
+            "crashes": self.crashes, "timeouts": self.timeouts,
+            "restarts": sum(worker.restarts for worker in self.workers),
+            "retried": self.retried, "failed": self.failed,
+            "latency": self.latency.stats(),
+        }
 
-def decode(task_queue, result_queue, raw: bytes, fPort: int) -> dict:
-    result = call_js_function(task_queue, result_queue, "te_decoder", list(raw),10)
-    decoded = ast.literal_eval(node_or_string=str(result))
-    return decoded
\ No newline at end of file
+    def stop(self):
+        self._stop.set()
+        self._watchdog.join()
+        for worker in self.workers:
+            worker.stop()
@@ -0,0 +1,45 @@
+######## LATENCY #########
+
+# Latency histogram with fixed buckets, shared by the JS decoder pool (decode calls) and the
+# MQTT output (publish -> ack). Percentiles are the upper bound of their bucket.
+import bisect
+import threading
+
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class LatencyHistogram:
+    """Counters of call latencies against a latency objective of `slo_ms`."""
+
+    def __init__(self, slo_ms: float = 100):
+        self.slo_ms = slo_ms
+        self.count = 0
+        self.over_slo = 0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1) # Last one counts everything above the last bound
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        ms = seconds * 1000
+        with self._lock:
+            self.count += 1
+            self.over_slo += ms > self.slo_ms
+            self.max_ms = max(self.max_ms, ms)
+            self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+
+    def percentile(self, fraction: float) -> float | None:
+        """Upper bound of the bucket holding this fraction of the calls, in ms."""
+        if self.count == 0:
+            return None
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= fraction * self.count:
+                return bound
+        return self.max_ms
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count, "slo_ms": self.slo_ms, "over_slo": self.over_slo,
+            "p50_ms": self.percentile(0.5), "p99_ms": self.percentile(0.99), "max_ms": round(self.max_ms, 3),
+        }
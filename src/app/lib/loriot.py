@@ -4,6 +4,10 @@ from . import schemas
 
 logger = logging.getLogger(__name__)
 
+# Keys read by the prefilter, before the uplink is parsed
+FPORT_KEY = b"port"
+DEVEUI_KEY = b"EUI"
+
 
 # Reference : https://docs.loriot.io/space/NMS/6032848/Uplink+Data+Message
 def parse_loriot(chunk: dict) -> schemas.Frame | None: # type: ignore
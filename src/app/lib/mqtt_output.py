@@ -0,0 +1,198 @@
+######## MQTT OUTPUT #########
+
+# Publisher of decoded frames running its own paho network thread, which handles acks,
+# keepalives and reconnections. At most `max_inflight` QoS 1/2 messages wait for their ack,
+# the next ones are queued by paho and sent as acks come back, or after a reconnection.
+# Frames can be grouped by batches, one message holding up to `batch_size` frames gathered
+# for at most `batch_linger_ms`.
+# With an outbox, frames submitted while disconnected are stored on disk instead of kept by
+# paho, and published again by a drainer thread once reconnected.
+# Payloads are JSON by default, or any other encoding of `Encoder`, compressed or not.
+import logging
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.enums import CallbackAPIVersion
+
+from .encoding import Encoder
+from .latency import LatencyHistogram
+from .outbox import Drainer, Outbox, encode_frame
+from .pipeline import Stage
+
+logger = logging.getLogger(__name__)
+
+QUEUE_FULL_WAIT = 0.01 # second, between two tries when paho queue is full
+
+
+class MqttOutput:
+    """Publish decoded frames on `<topic>/<DevEUI>`. With `batch_size`, publish JSON arrays of
+    `{"devEUI": ..., "frame": decoded}` on `<topic>` instead.
+
+    QoS 1/2 messages published while disconnected are kept by paho (at most `max_queued`
+    with those waiting for their ack) and sent once reconnected. A full queue blocks the caller.
+    QoS 0 messages are dropped while disconnected.
+    With an `outbox`, frames are stored there while disconnected whatever the QoS, and published
+    again at most `drain_rate` frames/s.
+    Payloads are JSON by default, see `Encoder` for the other `encoding` and `compression` options.
+    """
+
+    def __init__(self, host: str, port: int, topic: str, qos: int = 1, max_inflight: int = 100, max_queued: int = 10000,
+                 reconnect_min_delay: float = 1, reconnect_max_delay: float = 60, batch_size: int | None = None, batch_linger_ms: float = 50,
+                 outbox: Outbox | None = None, drain_rate: float = 100,
+                 encoding: str = "json", compression: str | None = None, compress_above: int = 1024):
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.qos = qos
+        self.encoder = Encoder(encoding, compression, compress_above)
+        self.client = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION2)
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.max_queued_messages_set(max_queued)
+        self.client.reconnect_delay_set(reconnect_min_delay, reconnect_max_delay)
+        self.client.on_publish = self._on_publish
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+
+        self.latency = LatencyHistogram() # publish -> ack (QoS 1/2) or written to the socket (QoS 0)
+        self._published: dict[int, float] = {} # mid -> publish time
+        self._early_acks: dict[int, float] = {} # mid -> ack time, for acks handled before publish() returned
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.published = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self._connected_once = False
+
+        self.batches: Stage | None = None
+        if batch_size is not None:
+            self.batches = Stage("mqtt_output", self._publish_batch, batch_size=batch_size, batch_linger_ms=batch_linger_ms)
+
+        self.outbox = outbox
+        self.drainer: Drainer | None = None
+        if outbox is not None:
+            self.drainer = Drainer(outbox, self._drain, rate=drain_rate, batch_size=batch_size or 10)
+        self.stored = 0 # frames
+
+    def connect(self) -> None:
+        """Connect, raising if the broker can't be reached, then start the network thread."""
+        status_code = self.client.connect(self.host, self.port)
+        if status_code != mqtt.MQTT_ERR_SUCCESS:
+            raise ConnectionError(mqtt.error_string(status_code))
+        self.client.loop_start()
+        if self.batches is not None:
+            self.batches.start()
+        if self.drainer is not None:
+            self.drainer.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """Publish pending batches and wait for the acks of what was published, then disconnect."""
+        deadline = time.monotonic() + timeout
+        if self.batches is not None:
+            self.batches.stop(timeout)
+        if self.drainer is not None and self.outbox is not None:
+            self.drainer.stop()
+            self.outbox.close()
+        while self.pending() and self.client.is_connected() and time.monotonic() < deadline:
+            time.sleep(QUEUE_FULL_WAIT)
+        self._stop_event.set()
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if self._connected_once:
+            self.reconnects += 1
+            logger.warning(f"MQTT output reconnected to {self.host}:{self.port}, sending {self.pending()} queued messages")
+        self._connected_once = True
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        if not self._stop_event.is_set():
+            logger.warning(f"MQTT output disconnected from {self.host}:{self.port} ({reason_code}), reconnecting...")
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        # Called under paho's own lock, publish() must not hold self._lock while calling paho
+        acked = time.monotonic()
+        with self._lock:
+            published = self._published.pop(mid, None)
+            if published is None:
+                self._early_acks[mid] = acked
+        if published is not None:
+            self.latency.record(acked - published)
+
+    def submit(self, devEUI: str, frame: dict) -> bool:
+        """Publish a decoded frame, or add it to the next batch. Return False if it was dropped."""
+        if self.batches is not None:
+            return self.batches.submit((devEUI, frame))
+        if self.outbox is not None and not self.client.is_connected():
+            return self._store([(devEUI, frame)]) == 1
+        return self.publish(f"{self.topic}/{devEUI}", self.encoder.encode(frame)[0])
+
+    def _publish_batch(self, batch: list[tuple[str, dict]]) -> None:
+        if self.outbox is not None and not self.client.is_connected():
+            self._store(batch)
+            return
+        self.publish(self.topic, self._payload(batch))
+
+    def _payload(self, batch: list[tuple[str, dict]]) -> bytes:
+        return self.encoder.encode([{"devEUI": devEUI, "frame": frame} for devEUI, frame in batch])[0]
+
+    def _store(self, items: list[tuple[str, dict]]) -> int:
+        """Append frames to the outbox. Return how many were kept, the others being dropped."""
+        assert self.outbox is not None
+        stored = sum(self.outbox.append(encode_frame(devEUI, frame)) for devEUI, frame in items)
+        with self._lock:
+            self.stored += stored
+            self.dropped += len(items) - stored
+        return stored
+
+    def _drain(self, items: list[tuple[str, dict]]) -> int:
+        """Publish frames from the outbox once connected. Return how many were accepted by paho."""
+        if not self.client.is_connected():
+            return 0
+        if self.batches is not None:
+            return len(items) if self.publish(self.topic, self._payload(items)) else 0
+        for done, (devEUI, frame) in enumerate(items):
+            if not self.publish(f"{self.topic}/{devEUI}", self.encoder.encode(frame)[0]):
+                return done
+        return len(items)
+
+    def publish(self, topic: str, payload: str | bytes) -> bool:
+        """Queue a message. Return False if it was dropped."""
+        while True:
+            published = time.monotonic()
+            info = self.client.publish(topic, payload, qos=self.qos)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS or (info.rc == mqtt.MQTT_ERR_NO_CONN and self.qos > 0):
+                with self._lock:
+                    self.published += 1
+                    acked = self._early_acks.pop(info.mid, None)
+                    if acked is None:
+                        self._published[info.mid] = published
+                if acked is not None:
+                    self.latency.record(acked - published)
+                return True
+            if info.rc != mqtt.MQTT_ERR_QUEUE_SIZE or self._stop_event.wait(QUEUE_FULL_WAIT):
+                break
+
+        with self._lock:
+            self.dropped += 1
+        logger.error(f"Failed to publish MQTT message: {mqtt.error_string(info.rc)}")
+        return False
+
+    def qsize(self) -> int:
+        """Frames waiting for their batch to be published."""
+        return self.batches.qsize() if self.batches is not None else 0
+
+    def pending(self) -> int:
+        """Messages published but not acked yet."""
+        return len(self._published)
+
+    def stats(self) -> dict:
+        return {"connected": self.client.is_connected(), "qos": self.qos, "published": self.published, "pending": self.pending(),
+                "dropped": self.dropped, "reconnects": self.reconnects, "ack_latency": self.latency.stats(),
+                "batch_size": self.batches.batch_size if self.batches is not None else None, "queued": self.qsize(), "encoding": self.encoder.stats(),
+                "outbox": self.outbox_stats()}
+
+    def outbox_stats(self) -> dict | None:
+        if self.outbox is None or self.drainer is None:
+            return None
+        return {**self.outbox.stats(), "stored": self.stored, "drained": self.drainer.drained}
@@ -0,0 +1,274 @@
+######## OUTBOX #########
+
+# Store & forward of decoded frames while an output is down. Frames are appended to
+# segment files, each record being its length, its crc32 & its bytes, and consumed from a
+# read cursor saved next to them. Segments are deleted once fully read, and when the disk
+# budget is exceeded the drop policy either deletes the oldest segment or rejects new frames.
+# Appends are flushed to the OS on every frame, fsynced when a segment is completed.
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct(">II") # length, crc32
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+DROP_POLICIES = ("oldest", "newest")
+
+
+def encode_frame(devEUI: str, frame: dict) -> bytes:
+    return json.dumps([devEUI, frame], separators=(",", ":")).encode()
+
+def decode_frame(record: bytes) -> tuple[str, dict]:
+    devEUI, frame = json.loads(record)
+    return devEUI, frame
+
+
+class Outbox:
+    """Append-only queue of records in `path`, at most `max_bytes` on disk."""
+
+    def __init__(self, path: str, max_bytes: int = 1 << 30, segment_bytes: int = 16 << 20, drop_policy: str = "oldest"):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy {drop_policy}, valid options : {DROP_POLICIES}")
+        if max_bytes < 2 * segment_bytes:
+            raise ValueError(f"max_bytes {max_bytes} must hold at least 2 segments of {segment_bytes} bytes")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self.appended = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        # Segment index -> [record count, size in bytes], oldest first
+        self._segments: dict[int, list[int]] = {}
+        for name in sorted(os.listdir(path)):
+            if name.endswith(SEGMENT_SUFFIX):
+                index = int(name[:-len(SEGMENT_SUFFIX)])
+                self._segments[index] = self._scan(index)
+
+        # Cursor : next record to read, as (segment, offset, records read in that segment)
+        self._cursor = self._load_cursor()
+        for index in [index for index in self._segments if index < self._cursor[0]]: # Read before a crash
+            self._delete_segment(index)
+        self._read_from = self._cursor
+        if not self._segments:
+            self._segments[0] = [0, 0]
+        self._writer_index = max(self._segments)
+        self._writer = open(self._segment_path(self._writer_index), "ab")
+        self.pending = sum(count for count, _ in self._segments.values()) - self._cursor[2]
+
+    def _segment_path(self, index: int) -> str:
+        return os.path.join(self.path, f"{index:020d}{SEGMENT_SUFFIX}")
+
+    def _records(self, file, offset: int = 0):
+        """Yield (record, offset after it) from `offset` up to the first incomplete or corrupted record."""
+        file.seek(offset)
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            length, crc = RECORD_HEADER.unpack(header)
+            record = file.read(length)
+            if len(record) < length or zlib.crc32(record) != crc:
+                return
+            offset += RECORD_HEADER.size + length
+            yield record, offset
+
+    def _scan(self, index: int) -> list[int]:
+        """Count the records of a segment, cutting what follows a torn or corrupted write."""
+        count, end = 0, 0
+        with open(self._segment_path(index), "r+b") as file:
+            for _, end in self._records(file):
+                count += 1
+            if file.seek(0, os.SEEK_END) > end:
+                logger.warning(f"Outbox segment {self._segment_path(index)} truncated at {end} bytes after an incomplete write")
+                file.truncate(end)
+        return [count, end]
+
+    def _load_cursor(self) -> tuple[int, int, int]:
+        first = min(self._segments, default=0)
+        try:
+            with open(os.path.join(self.path, CURSOR_FILE)) as file:
+                index, offset = (int(value) for value in file.read().split())
+        except (OSError, ValueError):
+            return (first, 0, 0)
+        if index not in self._segments:
+            return (first, 0, 0)
+
+        # Records already read in the cursor segment
+        read = 0
+        with open(self._segment_path(index), "rb") as file:
+            for _, end in self._records(file):
+                if end > offset:
+                    break
+                read += 1
+        return (index, offset, read)
+
+    def _save_cursor(self) -> None:
+        temporary = os.path.join(self.path, CURSOR_FILE + ".tmp")
+        with open(temporary, "w") as file:
+            file.write(f"{self._cursor[0]} {self._cursor[1]}")
+        os.replace(temporary, os.path.join(self.path, CURSOR_FILE))
+
+    @property
+    def disk_bytes(self) -> int:
+        return sum(size for _, size in self._segments.values())
+
+    def _roll(self) -> None:
+        os.fsync(self._writer.fileno())
+        self._writer.close()
+        self._writer_index += 1
+        self._segments[self._writer_index] = [0, 0]
+        self._writer = open(self._segment_path(self._writer_index), "ab")
+
+    def _delete_segment(self, index: int) -> None:
+        del self._segments[index]
+        os.remove(self._segment_path(index))
+
+    def _drop_oldest(self) -> bool:
+        """Delete the oldest segment, that is not being written. Return False if there is none."""
+        index = min(self._segments)
+        if index == self._writer_index:
+            return False
+        count = self._segments[index][0]
+        if self._cursor[0] == index:
+            count -= self._cursor[2]
+            self._cursor = (index + 1, 0, 0)
+            self._save_cursor()
+        self.pending -= count
+        self.dropped += count
+        self._delete_segment(index)
+        logger.warning(f"Outbox {self.path} over {self.max_bytes} bytes, dropped {count} oldest frames")
+        return True
+
+    def append(self, record: bytes) -> bool:
+        """Add a record. Return False if it was dropped, the outbox being full."""
+        size = RECORD_HEADER.size + len(record)
+        with self._lock:
+            while self.disk_bytes + size > self.max_bytes:
+                if self.drop_policy == "newest" or not self._drop_oldest():
+                    self.dropped += 1
+                    return False
+
+            if self._segments[self._writer_index][1] > 0 and self._segments[self._writer_index][1] + size > self.segment_bytes:
+                self._roll()
+            self._writer.write(RECORD_HEADER.pack(len(record), zlib.crc32(record)) + record)
+            self._writer.flush()
+            self._segments[self._writer_index][0] += 1
+            self._segments[self._writer_index][1] += size
+            self.pending += 1
+            self.appended += 1
+            return True
+
+    def read(self, count: int) -> list[bytes]:
+        """Up to `count` records from the cursor, left in the outbox until committed."""
+        with self._lock:
+            records = []
+            self._read_from = self._cursor
+            index, offset, _ = self._cursor
+            while len(records) < count and index <= self._writer_index:
+                if index in self._segments:
+                    with open(self._segment_path(index), "rb") as file:
+                        for record, offset in self._records(file, offset):
+                            records.append(record)
+                            if len(records) == count:
+                                break
+                index, offset = index + 1, 0
+            return records
+
+    def commit(self, count: int) -> None:
+        """Move the cursor past `count` records, deleting the segments fully read."""
+        with self._lock:
+            if self._cursor != self._read_from:
+                return # Records read were dropped meanwhile, the next ones will be read again
+            index, offset, read = self._cursor
+            while count > 0 and self.pending > 0:
+                segment_count = self._segments[index][0]
+                if read + count < segment_count or index == self._writer_index:
+                    # Cursor stops in this segment
+                    with open(self._segment_path(index), "rb") as file:
+                        for _, offset in self._records(file, offset):
+                            read += 1
+                            count -= 1
+                            self.pending -= 1
+                            if count == 0:
+                                break
+                    break
+                # Whole segment read
+                done = segment_count - read
+                count -= done
+                self.pending -= done
+                self._delete_segment(index)
+                index, offset, read = index + 1, 0, 0
+            self._cursor = (index, offset, read)
+            self._save_cursor()
+
+    def close(self) -> None:
+        with self._lock:
+            os.fsync(self._writer.fileno())
+            self._writer.close()
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "disk_bytes": self.disk_bytes, "segments": len(self._segments), "appended": self.appended,
+                "dropped": self.dropped, "drop_policy": self.drop_policy}
+
+
+class Drainer:
+    """Thread sending frames back from an outbox at most `rate` frames/s.
+
+    `send` receives a list of (devEUI, frame) and returns how many of them, from the first one,
+    were delivered. While it delivers none, the output is considered down and tried again
+    every `retry_interval` seconds.
+    """
+
+    def __init__(self, outbox: Outbox, send: Callable[[list[tuple[str, dict]]], int], rate: float = 100, batch_size: int = 10,
+                 retry_interval: float = 5, idle_interval: float = 0.5):
+        self.outbox = outbox
+        self.send = send
+        self.rate = rate
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.idle_interval = idle_interval
+        self.drained = 0
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def drain_once(self) -> float:
+        """Send the next records. Return the seconds to wait before the next call."""
+        records = self.outbox.read(self.batch_size)
+        if not records:
+            return self.idle_interval
+        delivered = self.send([decode_frame(record) for record in records])
+        if delivered > 0:
+            self.outbox.commit(delivered)
+            self.drained += delivered
+        if delivered < len(records):
+            return self.retry_interval
+        return delivered / self.rate
+
+    def _run(self):
+        wait = 0.0
+        while not self._stop_event.wait(wait):
+            try:
+                wait = self.drain_once()
+            except Exception as e:
+                logger.exception(f"Failed to drain outbox {self.outbox.path}: {e}")
+                wait = self.retry_interval
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-drain", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
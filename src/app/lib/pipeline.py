@@ -0,0 +1,108 @@
+######## PIPELINE #########
+
+# Bounded queues consumed by worker threads, chained to decouple
+# ingest -> reassembly -> decoding -> output.
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Stage:
+    """Bounded queue(s) consumed by a pool of `workers` threads running `handler`.
+
+    When `key` is given, each worker gets its own queue and items are routed by
+    `hash(key(item))`, so items sharing a key are handled in order by the same worker.
+    Otherwise all workers share one queue.
+
+    When `batch_size` is given, the handler receives lists of up to `batch_size` items,
+    gathered for at most `batch_linger_ms` after the first one.
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], Any], depth: int = 1000, workers: int = 1, key: Callable[[Any], Hashable] | None = None,
+                 batch_size: int | None = None, batch_linger_ms: float = 5):
+        self.name = name
+        self.handler = handler
+        self.depth = depth
+        self.workers = workers
+        self.key = key
+        self.batch_size = batch_size
+        self.batch_linger = batch_linger_ms / 1000
+        queue_count = workers if key is not None else 1
+        self._queues: list[queue.Queue] = [queue.Queue(maxsize=depth) for _ in range(queue_count)]
+        self._threads: list[threading.Thread] = []
+        self._counter_lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+
+    def _queue_for(self, item) -> queue.Queue:
+        if self.key is None:
+            return self._queues[0]
+        return self._queues[hash(self.key(item)) % len(self._queues)]
+
+    def submit(self, item, block: bool = True, timeout: float | None = None) -> bool:
+        """Queue an item. Return False if the queue stayed full (only when not blocking forever)."""
+        try:
+            self._queue_for(item).put(item, block=block, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def _next_batch(self, q: queue.Queue, first) -> tuple[list, bool]:
+        """Gather items following `first`. Return them and whether the stop signal was met."""
+        batch = [first]
+        deadline = time.monotonic() + self.batch_linger
+        while len(batch) < self.batch_size: # type: ignore
+            try:
+                item = q.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self, q: queue.Queue):
+        stop = False
+        while not stop:
+            item = q.get()
+            if item is _STOP:
+                break
+            count = 1
+            if self.batch_size is not None:
+                item, stop = self._next_batch(q, item)
+                count = len(item)
+            try:
+                self.handler(item)
+                with self._counter_lock:
+                    self.processed += count
+            except Exception as e:
+                with self._counter_lock:
+                    self.failed += count
+                logger.exception(f"Stage {self.name} failed to process an item: {e}")
+
+    def start(self):
+        for i in range(self.workers):
+            q = self._queues[i % len(self._queues)]
+            t = threading.Thread(target=self._run, args=[q], name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float | None = None):
+        """Let workers finish what is already queued, then stop them."""
+        for i in range(len(self._threads)):
+            self._queues[i % len(self._queues)].put(_STOP)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads.clear()
+
+    def qsize(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self) -> dict:
+        return {"depth": self.qsize(), "capacity": self.depth * len(self._queues), "workers": self.workers, "processed": self.processed, "failed": self.failed}
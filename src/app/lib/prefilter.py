@@ -0,0 +1,30 @@
+######## UPLINK PREFILTER #########
+
+# Looks for the fPort & DevEUI keys straight in the raw JSON of an uplink, so uplinks that
+# will be discarded anyway skip json.loads of the whole message (TTN rx_metadata...).
+# It is only trusted when conclusive : a key missing or found with different values sends
+# the uplink through the full parsing, which then takes the decision.
+import re
+
+
+def key_pattern(key: bytes, value: bytes) -> re.Pattern[bytes]:
+    return re.compile(rb'"' + re.escape(key) + rb'"\s*:\s*' + value)
+
+
+class UplinkPrefilter:
+    """Prefilter for one LNS, keeping uplinks whose fPort is in `fports`."""
+
+    def __init__(self, fport_key: bytes, deveui_key: bytes, fports: set[int]):
+        self._fport = key_pattern(fport_key, rb"(\d+)")
+        self._deveui = key_pattern(deveui_key, rb'"([0-9A-Fa-f]{16})"')
+        self.fports = fports
+
+    def wanted(self, payload: bytes) -> bool:
+        """False only if every fPort found in the payload is one we don't care about."""
+        found = self._fport.findall(payload)
+        return not found or any(int(fport) in self.fports for fport in found)
+
+    def devEUI(self, payload: bytes) -> str | None:
+        """DevEUI of the uplink, None if not found once with a single value."""
+        found = set(self._deveui.findall(payload))
+        return found.pop().decode() if len(found) == 1 else None
@@ -15,4 +15,7 @@ class InvalidFrame(Exception):
     pass
 
 class JSWorkerFail(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class FrameLimitExceeded(Exception):
+    pass
@@ -3,10 +3,15 @@
 # Run mosquitto as a subprocess
 import logging
 import os
+import socket
 import subprocess
+import time
 
 logger = logging.getLogger(__name__)
 
+BROKER_PORT = 1883 # Listener of mosquitto.conf
+READY_POLL_INTERVAL = 0.02 # second
+
 
 def start_mosquitto() -> subprocess.Popen[bytes] | None:
     try:
@@ -29,6 +34,20 @@ def start_mosquitto() -> subprocess.Popen[bytes] | None:
         return None
 
 
+def wait_ready(process: subprocess.Popen[bytes], timeout: float = 5) -> bool:
+    """Wait until the broker accepts connections. False if it exited or is still not listening after `timeout`."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(("127.0.0.1", BROKER_PORT), timeout=READY_POLL_INTERVAL * 10):
+                return process.poll() is None
+        except OSError:
+            time.sleep(READY_POLL_INTERVAL)
+    return False
+
+
 # Stop mosquitto (kill the process)
 def stop_mosquitto(process: subprocess.Popen[bytes]) -> int:
     if process:
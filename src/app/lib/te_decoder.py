@@ -0,0 +1,199 @@
+######## TE DECODER #########
+
+# Python port of the multipoint vibration part of TE_TtnDecoder.js (fPort 10, frame
+# formats 0, 1 & 2), giving the same output as the JS decoder. MAGNITUDES_RMS is copied
+# from the JS decoder's own values, pinned by test_magnitudes_rms_js_parity.
+# Frames it does not fully understand give None and are left to the JS decoder.
+
+MULTIPOINT_DEVTYPES = {0x1121, 0x1521, 0x152f, 0x112f}
+
+# bw_mode -> frequency of one spectrum bin
+BW_MODE_RESOLUTION = {
+    0x00: 0.125, 0x01: 0.25, 0x02: 0.5, 0x03: 1, 0x04: 2, 0x05: 3, 0x06: 4, 0x07: 5,
+    0x08: 6, 0x09: 7, 0x0A: 8, 0x0B: 9, 0x0C: 10, 0x0D: 11, 0x0E: 12, 0x0F: 13,
+}
+
+DEVSTAT = {7: "SnsErr", 6: "CfgErr", 5: "CommErr", 4: "Condition", 3: "PrelPhase", 2: "Reserved", 1: "Reserved", 0: "BattErr"}
+PLATFORMS = {0: "Error", 1: "Platform_21"}
+SENSORS = {0: "Error", 1: "Vibration 1-axis", 2: "Temperature", 3: "Pressure", 4: "Humidity", 5: "Vibration 3-axis"}
+UNITS = {0: "Error", 1: "g", 2: "°C", 3: "Bar", 4: "%", 5: "g"}
+WIRELESS = {0: "Error", 1: "BLE", 2: "BLE/LoRaWAN"}
+OUTPUTS = {0: "Error", 1: "Float", 2: "Integer", 15: "N/A"}
+
+AXIS_SIZE = 6 # bytes per axis in frame format 0
+WINDOW_SIZE = 14 # bytes per window in frame format 1
+WINDOWS_OFFSET = 17
+PEAK_BITS = 19 # 11 bits bin index + 8 bits compressed magnitude, in frame format 2
+PEAKS_OFFSET = 18
+
+
+def js_number(value: float) -> int | float:
+    """Number as JSON.stringify would write it : integral values without decimal part."""
+    return int(value) if value == int(value) else value
+
+def js_string(value: float) -> str:
+    """Number as Number.toString() would write it."""
+    return repr(js_number(value))
+
+def uint16(raw: bytes, offset: int) -> int:
+    return (raw[offset] << 8) | raw[offset + 1]
+
+def int16(raw: bytes, offset: int) -> int:
+    value = uint16(raw, offset)
+    return value - 0x10000 if value > 0x8000 else value # Same bound as the JS arrayConverter
+
+# Compressed magnitude -> rms, as dBDecompression of the JS decoder gives it. Python 10 ** x differs
+# from JS Math.pow in the last digit for some values, so the table is not computed here.
+MAGNITUDES_RMS = [
+    0, 0.003666553531028508, 0.003801947013932985, 0.0039423401225235155,
+    0.004087917476151517, 0.004238870511539764, 0.004395397734524962, 0.004557704981096335,
+    0.0047260056880735046, 0.004900521173779546, 0.005081480929078426, 0.005269122919159404,
+    0.005463693896465354, 0.005665449725176495, 0.005874655717676129, 0.006091586983441061,
+    0.006316528790815221, 0.006549776942142498, 0.006791638162751863, 0.007042430504306465,
+    0.007302483763047064, 0.007572139913479699, 0.007851753558078116, 0.008141692393592026,
+    0.008442337694574751, 0.008754084814765745, 0.00907734370698758, 0.009412539462240977,
+    0.009760112868706738, 0.010120520991389841, 0.010494237773167672, 0.010881754658033222,
+    0.011283581237352215, 0.011700245919984626, 0.012132296627151389, 0.012580301512960192,
+    0.013044849711537937, 0.013526552111752226, 0.014026042160540736, 0.01454397669590478,
+    0.01508103681066268, 0.015637928748098415, 0.01621538483068374, 0.01681416442309484,
+    0.017435054930789895, 0.018078872835460818, 0.01874646476872072, 0.019438708625439012,
+    0.020156514718188245, 0.0209008269743209, 0.021672624177249883, 0.02247292125356573,
+    0.023302770607682443, 0.024163263505767384, 0.025055531510775036, 0.025980747970471767,
+    0.02694012956040833, 0.027934937883869086, 0.02896648113090206, 0.030036115798611266,
+    0.031145248474973835, 0.03229533768852726, 0.03348789582635963, 0.0347244911229245,
+    0.03600674972229632, 0.03733635781657772, 0.03871506386327122, 0.04014468088453078,
+    0.04162708885131718, 0.0431642371555922, 0.04475814717380246, 0.04641091492502429,
+    0.048124713827264735, 0.04990179755554377, 0.05174450300551549, 0.053655253366526275,
+    0.05563656130815026, 0.05769103228439317, 0.05982136795990904, 0.06203036976273575,
+    0.06432094256822093, 0.0666960985189831, 0.06915896098593098, 0.07171276867554995,
+    0.0743608798888567, 0.07710677693762275, 0.07995407072367451, 0.08290650548729099,
+    0.08596796373094441, 0.08914247132485739, 0.09243420280109184, 0.09584748684313013,
+    0.09938681197816847, 0.10305683247960712, 0.10686237448750015, 0.11080844235501246,
+    0.11490022522923027, 0.11914310387497881, 0.12354265775062033, 0.12810467234513803,
+    0.13283514678615352, 0.1377403017288826, 0.14282658753640387, 0.1481006927619972,
+    0.15356955294470623, 0.15924035972969133, 0.1651205703253668, 0.17121791730975808,
+    0.17754041879897448, 0.1840963889911702, 0.19089444909985773, 0.19794353869095166,
+    0.20525292743845144, 0.21283222731422252, 0.22069140522790406, 0.2288407961335669,
+    0.23729111662035576, 0.24605347900498747, 0.25513940594463985, 0.2645608455894429,
+    0.2743301872945021, 0.2844602779121132, 0.2949644386855939, 0.3058564827669481,
+    0.31715073338139793, 0.3288620426626706, 0.34100581118381107, 0.3535980082091992,
+    0.36665519269440716, 0.38019453506151113, 0.3942338397784908, 0.4087915687724115,
+    0.42388686570717554, 0.4395395811577693, 0.45577029871410973, 0.4726003620488208,
+    0.4900519029845285, 0.5081478705975887, 0.5269120613965166, 0.5463691506148054,
+    0.5665447246592813, 0.5874653147566702, 0.6091584318426139, 0.631652602739027,
+    0.654977407667356, 0.6791635191470798, 0.7042427423305995, 0.7302480568275611,
+    0.7572136600736092, 0.7851750123006026, 0.8141688831674294, 0.8442334001127381,
+    0.8754080984931791, 0.907733973573075, 0.9412535344338995, 0.9760108598744498,
+    1.012051656375225, 1.0494233182032338, 1.0881749897362711, 1.1283576300886162,
+    1.1700240801231496, 1.2132291319379929, 1.2580296009190595, 1.304484400453265,
+    1.3526546194006441, 1.4026036024272501, 1.454397033304482, 1.5081030212843718,
+    1.5637921906644197, 1.6215377736597645, 1.681415706704802, 1.7435047303109021,
+    1.8078864926115361, 1.8746456567309746, 1.9438700121177521, 2.0156505899893027,
+    2.0900817830395697, 2.1672614695670296, 2.2472911421863317, 2.330276041292835,
+    2.416325293455532, 2.5055520549203676, 2.598073660412647, 2.6940117774342154,
+    2.7934925662583177, 2.8966468458325174, 3.0036102658078767, 3.114523484920568,
+    3.2295323559605342, 3.3487881175704164, 3.4724475931269634, 3.600673396966477,
+    3.7336341482254505, 3.8715046925776435, 4.014466332159129, 4.162707063983744,
+    4.31642182716238, 4.475812759251266, 4.6410894620663345, 4.812469277313207,
+    4.9901775723952815, 5.17444803677574, 5.365522989283194, 5.56365369676514,
+    5.76910070450816, 5.98213417885947, 6.203034262500276, 6.432091442838282,
+    6.669606934003541, 6.915893072950301, 7.171273730185388, 7.436084735663563,
+    7.710674320409618, 7.995403574448237, 8.290646921643509, 8.596792612072775,
+    8.914243232582207, 9.243416236195333, 9.58474449107104, 9.938676849732547,
+    10.3056787393163, 10.686232773616528, 11.080839387730817, 11.490017496140762,
+    11.914305175093453, 12.354260370181061, 12.810461630048753, 13.283508867196279,
+    13.774024146873023, 14.282652505104691, 14.810062796926623, 15.356948575939787,
+    15.92402900634558, 16.512049808659143, 17.121784240344788, 17.754034112662616,
+    18.409630845064356, 19.08943655852404, 19.794345209242067, 20.525283764212837,
+    21.283213420202316, 22.069130867738473, 22.88406960177617, 23.729101280761068,
+    24.605337135878695, 25.513929432342763, 26.456072984643463, 27.43300672774943,
+    28.446015346328142, 29.49643096412855, 30.58563489574677, 31.71505946307833,
+    32.8861898788463, 34.10056619968128, 35.35978535132274, 36.665503228603356,
+]
+
+def get_devstat(devstat: int) -> list[str]:
+    return [DEVSTAT[bit] for bit in range(7, -1, -1) if devstat >> bit & 1]
+
+def get_devtype(devtype: int) -> dict:
+    # Unknown values are left out, like undefined values by JSON.stringify
+    fields = (
+        ("Platform", PLATFORMS, devtype >> 12 & 0x0F),
+        ("Sensor", SENSORS, devtype >> 8 & 0x0F),
+        ("Wireless", WIRELESS, devtype >> 4 & 0x0F),
+        ("Output", OUTPUTS, devtype & 0x0F),
+        ("Unit", UNITS, devtype >> 8 & 0x0F),
+    )
+    return {name: table[value] for name, table, value in fields if value in table}
+
+
+def decode_multipoint(raw: bytes, fPort: int) -> dict | None:
+    """Decode a multipoint vibration frame, None if the frame is not one or needs the JS decoder."""
+    raw = bytes(raw)
+    if fPort != 10 or len(raw) < WINDOWS_OFFSET or uint16(raw, 0) not in MULTIPOINT_DEVTYPES:
+        return None
+
+    info = raw[8]
+    frame_format = info >> 6
+    axis = [name for name, bit in (("x", 2), ("y", 1), ("z", 0)) if info >> bit & 1]
+    bw_mode = raw[10]
+    devstat = get_devstat(raw[4])
+    if bw_mode > 0x0F or "SnsErr" in devstat:
+        return None # JS decoder reports an error and tries other frame types
+
+    decode = {
+        "size": len(raw),
+        "devtype": get_devtype(uint16(raw, 0)),
+        "cnt": uint16(raw, 2),
+        "devstat": devstat,
+        "bat": raw[5],
+        "temp": js_string(int16(raw, 6) / 100.0),
+        "vibration_information": {"frame_format": frame_format, "rotating_mode": info >> 3 & 1, "axis": axis},
+        "preset_id": raw[9],
+        "bw_mode": bw_mode,
+    }
+    resolution = BW_MODE_RESOLUTION[bw_mode]
+
+    if frame_format == 0:
+        if len(raw) < 11 + AXIS_SIZE * len(axis):
+            return None
+        data = {}
+        for index, name in enumerate(axis):
+            offset = 11 + index * AXIS_SIZE
+            data[name] = {"time_rms": uint16(raw, offset), "time_p2p": uint16(raw, offset + 2), "freq_rms": uint16(raw, offset + 4)}
+
+    elif frame_format == 1:
+        data = {"spectrum_rms": uint16(raw, 11), "time_p2p": uint16(raw, 13), "velocity": uint16(raw, 15), "windows": []}
+        for index in range((len(raw) - WINDOWS_OFFSET) // WINDOW_SIZE):
+            offset = WINDOWS_OFFSET + index * WINDOW_SIZE
+            window = {"rms_window": uint16(raw, offset)}
+            for peak in (1, 2, 3):
+                peak_bin = uint16(raw, offset + 4 * peak - 2)
+                if peak_bin != 0xFFFF:
+                    window[f"peak{peak}_bin"] = peak_bin
+                    window[f"peak{peak}_frequency"] = js_number(peak_bin * resolution)
+                    window[f"peak{peak}_rms"] = uint16(raw, offset + 4 * peak)
+            data["windows"].append(window)
+
+    elif frame_format == 2:
+        if len(raw) < PEAKS_OFFSET:
+            return None
+        peak_cnt = raw[17]
+        data = {"spectrum_rms": uint16(raw, 11), "time_p2p": uint16(raw, 13), "velocity": uint16(raw, 15), "peak_cnt": peak_cnt, "peaks": []}
+        # Same slice as the JS decoder, whose end is not relative to PEAKS_OFFSET
+        peaks = raw[PEAKS_OFFSET:PEAK_BITS * peak_cnt]
+        bits, bit_count = int.from_bytes(peaks, "big"), 8 * len(peaks)
+        for index in range(min(peak_cnt, bit_count // PEAK_BITS)):
+            shift = bit_count - (index + 1) * PEAK_BITS
+            bin_index, magnitude = bits >> (shift + 8) & 0x7FF, bits >> shift & 0xFF
+            data["peaks"].append({
+                "bin_index": bin_index,
+                "frequency": js_number(bin_index * resolution),
+                "magnitude_compressed": magnitude,
+                "magnitude_rms": MAGNITUDES_RMS[magnitude],
+            })
+
+    else:
+        data = {}
+
+    decode["vibration_data"] = data
+    return {"data": decode, "errors": []}
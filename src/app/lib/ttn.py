@@ -4,6 +4,10 @@ from . import schemas
 
 logger = logging.getLogger(__name__)
 
+# Keys read by the prefilter, before the uplink is parsed
+FPORT_KEY = b"f_port"
+DEVEUI_KEY = b"dev_eui"
+
 def parse_ttn(chunk: dict) -> schemas.Frame | None:
     try:
         fport = chunk["uplink_message"]["f_port"]
@@ -2,6 +2,13 @@ import os
 from cerberus import Validator
 import yaml
 
+# Used when the optional "pipeline" section of config.yaml omits a stage
+PIPELINE_DEFAULTS = {
+    "ingest": {"depth": 10000, "workers": 4},
+    "decode": {"depth": 1000, "workers": 8, "batch_size": 64, "batch_linger_ms": 5},
+    "output": {"depth": 1000, "workers": 2},
+}
+
 schema = {
     "input": {
         "type": "dict",
@@ -13,6 +20,17 @@ schema = {
                     "host": {"type": "string"},  # Host must have a port
                     "port": {"type": "integer", "min": 1, "max": 65535},
                     "topic": {"type": "string"},
+                    "qos": {"type": "integer", "allowed": [0, 1], "required": False},
+                    "connections": {"type": "integer", "min": 1, "required": False},
+                    "shared_group": {"type": "string", "regex": "[^/+#]+", "required": False},
+                    "partition": {
+                        "type": "dict",
+                        "required": False,  # Optional
+                        "schema": {
+                            "count": {"type": "integer", "min": 1, "required": True},
+                            "index": {"type": "integer", "min": 0, "required": True},
+                        },
+                    },
                     "auth": {
                         "type": "dict",
                         "required": False,  # Optional
@@ -29,6 +47,7 @@ schema = {
                     "enable": {"type": "boolean", "required": True},
                     "host": {"type": "string"},
                     "port": {"type": "integer", "min": 1, "max": 65535},
+                    "max_uplinks": {"type": "integer", "min": 1},
                 },
             },
         },
@@ -43,6 +62,16 @@ schema = {
                     "host": {"type": "string"},
                     "port": {"type": "integer", "min": 1, "max": 65535},
                     "topic": {"type": "string"},
+                    "qos": {"type": "integer", "allowed": [0, 1, 2]},
+                    "max_inflight": {"type": "integer", "min": 0},
+                    "max_queued": {"type": "integer", "min": 0},
+                    "reconnect_min_delay": {"type": "number", "min": 0},
+                    "reconnect_max_delay": {"type": "number", "min": 0},
+                    "batch_size": {"type": "integer", "min": 1, "nullable": True},
+                    "batch_linger_ms": {"type": "number", "min": 0},
+                    "encoding": {"type": "string", "allowed": ["json", "json_compact", "msgpack", "cbor"]},
+                    "compression": {"type": "string", "allowed": ["zlib", "zstd"], "nullable": True},
+                    "compress_above": {"type": "integer", "min": 0},
                 },
             },
             "http": {
@@ -50,6 +79,18 @@ schema = {
                 "schema": {
                     "enable": {"type": "boolean", "required": True},
                     "url": {"type": "string"},
+                    "concurrency": {"type": "integer", "min": 1},
+                    "depth": {"type": "integer", "min": 1},
+                    "connect_timeout": {"type": "number", "min": 0},
+                    "read_timeout": {"type": "number", "min": 0},
+                    "retries": {"type": "integer", "min": 0},
+                    "backoff": {"type": "number", "min": 0},
+                    "max_backoff": {"type": "number", "min": 0},
+                    "batch_size": {"type": "integer", "min": 1, "nullable": True},
+                    "batch_linger_ms": {"type": "number", "min": 0},
+                    "encoding": {"type": "string", "allowed": ["json", "json_compact", "msgpack", "cbor"]},
+                    "compression": {"type": "string", "allowed": ["zlib", "zstd"], "nullable": True},
+                    "compress_above": {"type": "integer", "min": 0},
                 },
             },
         },
@@ -64,8 +105,98 @@ schema = {
         "type": "dict",
         "schema": {
             "max_chunks": {"type": "integer", "min": 1, "required": True},
+            "max_frame_bytes": {"type": "integer", "min": 1, "required": False},
             "timeout": {"type": "float", "min": 0.005, "required": True}, # min is 20s
             "lns": {"type": "string", "allowed": ["ttn", "loriot"], "required": True},
+            "prefilter": {"type": "boolean", "required": False},
+            "max_pending_bytes": {"type": "integer", "min": 1, "required": False},
+            "max_pending_fragments": {"type": "integer", "min": 1, "required": False},
+            "persistence": {
+                "type": "dict",
+                "required": False,
+                "schema": {
+                    "enable": {"type": "boolean", "required": True},
+                    "path": {"type": "string"},
+                    "sync_interval": {"type": "number", "min": 0.01},
+                },
+            },
+        },
+    },
+    "decoder": {
+        "type": "dict",
+        "required": False,
+        "schema": {
+            "workers": {"type": "integer", "min": 1}, # Default to the CPUs this process may use, at most DEFAULT_MAX_WORKERS (2)
+            "dispatch": {"type": "string", "allowed": ["least-outstanding", "affinity"]},
+            "timeout": {"type": "number", "min": 0.1},
+            "retries": {"type": "integer", "min": 0},
+            "slo_ms": {"type": "number", "min": 0},
+            "cache": {
+                "type": "dict",
+                "schema": {
+                    "enable": {"type": "boolean", "required": True},
+                    "size": {"type": "integer", "min": 1},
+                    "ttl": {"type": "number", "min": 0, "nullable": True},
+                },
+            },
+            "native": {
+                "type": "dict",
+                "schema": {
+                    "enable": {"type": "boolean", "required": True},
+                    "decoders": {"type": "list", "schema": {"type": "string"}}, # Default to every registered decoder
+                    "devices": {"type": "dict", "keysrules": {"type": "string"}, "valuesrules": {"type": "string"}},
+                },
+            },
+        },
+    },
+    "pipeline": {
+        "type": "dict",
+        "required": False, # Optional, defaults are used for missing stages
+        "schema": {
+            "ingest": {  # Handler takes one message at a time, no batching
+                "type": "dict",
+                "schema": {
+                    "depth": {"type": "integer", "min": 1},
+                    "workers": {"type": "integer", "min": 1},
+                },
+            },
+            "decode": {
+                "type": "dict",
+                "schema": {
+                    "depth": {"type": "integer", "min": 1},
+                    "workers": {"type": "integer", "min": 1},
+                    "batch_size": {"type": "integer", "min": 1, "required": True},  # Handler always takes a list of frames
+                    "batch_linger_ms": {"type": "number", "min": 0},
+                },
+            },
+            "output": {  # Handler takes one frame at a time, sinks batch on their own (output.*.batch_size)
+                "type": "dict",
+                "schema": {
+                    "depth": {"type": "integer", "min": 1},
+                    "workers": {"type": "integer", "min": 1},
+                },
+            },
+        },
+    },
+    "backpressure": {
+        "type": "dict",
+        "required": False,  # Optional
+        "schema": {
+            "enable": {"type": "boolean", "required": True},
+            "high_watermark": {"type": "integer", "min": 1, "required": True},
+            "low_watermark": {"type": "integer", "min": 0, "required": True},
+        },
+    },
+    "outbox": {
+        "type": "dict",
+        "required": False,  # Optional
+        "schema": {
+            "enable": {"type": "boolean", "required": True},
+            "path": {"type": "string", "required": True},
+            "max_bytes": {"type": "integer", "min": 1, "required": False},
+            "segment_bytes": {"type": "integer", "min": 1, "required": False},
+            "drop_policy": {"type": "string", "allowed": ["oldest", "newest"], "required": False},
+            "drain_rate": {"type": "number", "min": 1, "required": False},
         },
     },
     "log": {
@@ -85,6 +216,41 @@ def check_input_enabled(config):
     return mqtt_enabled or http_enabled
 
 
+# Additional check: Several MQTT input connections need a shared subscription, else each one receives every uplink
+def check_mqtt_input_scaling(config):
+    mqtt_input = config.get("input", {}).get("mqtt", {})
+    if mqtt_input.get("connections", 1) > 1 and "shared_group" not in mqtt_input:
+        print("❌ Config validation failed! input.mqtt.connections above 1 needs input.mqtt.shared_group.")
+        return False
+
+    partition = mqtt_input.get("partition")
+    if partition is not None and partition["index"] >= partition["count"]:
+        print("❌ Config validation failed! input.mqtt.partition index must be lower than its count.")
+        return False
+    return True
+
+
+# Additional check: Inputs must resume below the level they were paused at
+def check_backpressure_watermarks(config):
+    backpressure = config.get("backpressure")
+    if backpressure is not None and backpressure["low_watermark"] >= backpressure["high_watermark"]:
+        print("❌ Config validation failed! backpressure low_watermark must be lower than high_watermark.")
+        return False
+    # Each ingest worker queue holds `depth` messages, input must be paused before one is full
+    ingest_depth = config.get("pipeline", {}).get("ingest", {}).get("depth", PIPELINE_DEFAULTS["ingest"]["depth"])
+    if backpressure is not None and backpressure["high_watermark"] >= ingest_depth:
+        print("❌ Config validation failed! backpressure high_watermark must be lower than pipeline.ingest.depth.")
+        return False
+    return True
+
+def check_outbox_budget(config):
+    outbox = config.get("outbox")
+    if outbox is not None and outbox.get("max_bytes", 1 << 30) < 2 * outbox.get("segment_bytes", 16 << 20):
+        print("❌ Config validation failed! outbox max_bytes must hold at least 2 segments of segment_bytes.")
+        return False
+    return True
+
+
 # Load YAML
 def load_yaml_config(filename):
     with open(filename, "r") as file:
@@ -104,6 +270,14 @@ def validate_config(config):
         print("❌ Config validation failed! At least one input (MQTT or HTTP) must be enabled.")
         return False
 
+    if not check_mqtt_input_scaling(config):
+        return False
+
+    if not check_backpressure_watermarks(config):
+        return False
+    if not check_outbox_budget(config):
+        return False
+
     print("✅ Config is valid!")
     return True
 
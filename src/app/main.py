@@ -3,23 +3,41 @@ import datetime
 import os
 import paho.mqtt.client as mqtt
 from paho.mqtt.enums import CallbackAPIVersion
-import requests
 import threading
 import time
 import logging
-
-from flask import Flask, abort, render_template, jsonify
-from asgiref.wsgi import WsgiToAsgi
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
 import uvicorn
 import json
-import copy
 
 # Project import
+import lib.ttn as ttn
+import lib.loriot as loriot
 from lib.ttn import parse_ttn
 from lib.loriot import parse_loriot
-from lib.schemas import Frame, InvalidFrame, InvalidJSON, JSWorkerFail
-from lib.validate_config import export_config
+from lib.prefilter import UplinkPrefilter
+from lib.backpressure import Backpressure
+from lib.http_output import HttpOutput
+from lib.mqtt_output import MqttOutput
+from lib.outbox import Outbox
+from lib.schemas import Frame, FrameLimitExceeded, InvalidFrame, InvalidJSON, JSWorkerFail
+from lib.frame_buffer import FrameBuffer
+from lib.frame_store import FrameStore
+from lib.pipeline import Stage
+from lib.validate_config import PIPELINE_DEFAULTS, export_config
 import lib.js_fetcher as js_fetcher  # Import the fetcher script
+from lib.decode_cache import DecodeCache
+from lib.decoders import PythonBackend
 import lib.self_broker as self_broker
 
 
@@ -27,21 +45,36 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 config = {} # Will be loaded after
-js_worker_process, task_queue, result_queue = None, None, None
-flask_thread = None
+js_pool: js_fetcher.JSWorkerPool | None = None
+decode_cache: DecodeCache | None = None # Optional, in front of js_pool
+native_decoders: PythonBackend | None = None # Optional, in front of js_pool
+http_thread = None
 http_server: uvicorn.Server
 
-client_mqtt_output = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION2)
+mqtt_output: MqttOutput | None = None
+http_output: HttpOutput | None = None
 
 
 
 
 # Global var
 
-# Holding DevEUI - list Frame mapping
-frame_buffer: dict[str,list[Frame]] = {}
-frame_lock = threading.Lock()
+# Holding DevEUI - PendingFrame mapping, each shard having its own lock
+frame_buffer = FrameBuffer()
+frame_store: FrameStore | None = None # Optional on-disk copy of frame_buffer
 exit_event = threading.Event()
+ready_event = threading.Event() # Set once every service is started, until shutdown
+mqtt_input_clients: list[mqtt.Client] = []
+partition_skipped = 0 # MQTT uplinks of devices handled by another instance
+prefiltered = 0 # MQTT uplinks discarded before being parsed
+ingest_dropped = 0 # MQTT uplinks dropped, their ingest queue being full
+lns_parser: Callable[[dict], Frame | None] # Resolved from config by init_lns()
+lns_scanner: UplinkPrefilter | None = None # Finds fPort & DevEUI in raw uplinks, resolved by init_lns()
+lns_prefilter: UplinkPrefilter | None = None # lns_scanner, when discarding uplinks before parsing is enabled
+backpressure: Backpressure | None = None # Optional, pauses MQTT input while the pipeline backlog is too high
+deferred_acks: list[tuple[mqtt.Client, int, int]] = [] # (client, mid, qos) of QoS 1 messages received while paused
+deferred_acks_lock = threading.Lock()
+timeout_thread: threading.Thread | None = None
 
 
 # CONST
@@ -51,11 +84,8 @@ FRAGMENT_FPORT = 138
 LAST_FRAGMENT_FPORT = 202
 DATA_FPORT = 10 # port used to trigger decoder to look like the frame is whole
 
-TIMEOUT_CHECK_INTERVAL = 10 #second
-
-# Map MQTT error name with enum value
-MQTT_ERROR_NAMES = {v: k for k, v in vars(mqtt).items() if k.startswith("MQTT_ERR_")}
-
+TIMEOUT_CHECK_INTERVAL = 10 #second, max delay between two expiry checks
+MAX_HTTP_UPLINKS = 10000 # Default max number of uplinks in one /input request
 
 
 def get_timeout():
@@ -64,64 +94,120 @@ def get_timeout():
 def get_max_chunk():
     return config["frame"]["max_chunks"]
 
+def get_max_http_uplinks() -> int:
+    return config["input"]["http"].get("max_uplinks", MAX_HTTP_UPLINKS)
+
+def get_max_frame_bytes() -> int | None:
+    return config["frame"].get("max_frame_bytes")
+
+def get_input_topic() -> str:
+    """ Topic to subscribe, as a shared subscription when a group is configured """
+    mqtt_config = config["input"]["mqtt"]
+    group = mqtt_config.get("shared_group")
+    return f"$share/{group}/{mqtt_config['topic']}" if group else mqtt_config["topic"]
+
+def in_partition(devEUI: str) -> bool:
+    """ Whether this instance handles the device, the same DevEUI always giving the same partition """
+    partition = config["input"]["mqtt"].get("partition")
+    if partition is None:
+        return True
+    return zlib.crc32(devEUI.lower().encode()) % partition["count"] == partition["index"]
+
+def get_input_qos() -> int:
+    return config["input"]["mqtt"].get("qos", 0)
+
+def get_backlog() -> int:
+    """ Items queued in the pipeline, waiting to be ingested, decoded or published """
+    backlog = sum(stage.qsize() for stage in (ingest_stage, decode_stage, output_stage))
+    return backlog + sum(sink.qsize() for sink in (http_output, mqtt_output) if sink is not None)
+
+def get_stage_config(name: str) -> dict:
+    return {**PIPELINE_DEFAULTS[name], **config.get("pipeline", {}).get(name, {})}
+
 
 
 ######## FRAME PROCESSING #########
     
 # Reassemble frames
-def reassemble_frame(devEUI: str) -> bytes | None:
-    global frame_buffer
-    if devEUI in frame_buffer:
-        reconstructed_frame = b''.join([frame["raw"] for frame in frame_buffer[devEUI]])
-        del frame_buffer[devEUI]
-        return reconstructed_frame
+def reassemble_frame(devEUI: str) -> memoryview | None:
+    pending = frame_buffer.pop(devEUI)
+    if pending is not None:
+        return pending.payload()
     return None
 
 
 
 def process_frame(devEUI: str):
+    """ Reassemble pending fragments and hand the frame over to the decode stage """
     reconstructed_frame = reassemble_frame(devEUI)
 
     if reconstructed_frame:
         logger.debug(f"Raw frame reassembled for DevEUI {devEUI}: {reconstructed_frame.hex()}")
-
-        decoded = js_fetcher.decode(task_queue,result_queue,reconstructed_frame,10)
-
-        logger.info(f"Frame reassembled and decoded for DevEUI {devEUI}: {decoded}")
-
-        if config["output"]["mqtt"]["enable"] == True:
-            send_mqtt_message(devEUI, decoded)
-        if config["output"]["http"]["enable"] == True:
-            send_http_request(decoded)
-        
-        return decoded
+        decode_stage.submit((devEUI, reconstructed_frame))
+        return reconstructed_frame
     
     else:
         logger.debug("Tried to process a devEUI that didn't have any frame...")
         return -1
 
-def frame_timeout_checker():
-    """ Threaded function checking that a frame is fresh, and number of chunk is not too high  """
-    while not exit_event.is_set():
-        time.sleep(TIMEOUT_CHECK_INTERVAL)
-        with frame_lock:
-            logger.debug(f"Frame buffer content : {frame_buffer}")
-            to_be_deleted = []
-            for devEUI, frame_list in frame_buffer.items():
 
-                # Check if we don't have too many fragments pending
-                if len(frame_list) > config["frame"]["max_chunks"]:
-                    logger.warning(f"Received more than configured {get_max_chunk()} chunk from {devEUI}, flushing all its pending fragments...")
-                    to_be_deleted.append(devEUI)
+def decode_frames(items: list[tuple[str, memoryview]]) -> list[dict | Exception]:
+    """ Decode stage handler, frames ready at the same time and not handled in-process are decoded in a single JS worker round-trip """
+    results: list[dict | Exception | None] = [None] * len(items)
+    if decode_cache is not None:
+        results = [decode_cache.get(reconstructed_frame, 10) for _, reconstructed_frame in items]
+
+    # Only frames not found in cache go to the decoders, in-process ones first
+    misses = [i for i, decoded in enumerate(results) if decoded is None]
+    if misses and native_decoders is not None:
+        for i in misses:
+            results[i] = native_decoders.decode(items[i][1], 10, items[i][0])
+            if results[i] is not None and decode_cache is not None:
+                decode_cache.put(items[i][1], 10, results[i]) # type: ignore
+        misses = [i for i in misses if results[i] is None]
+
+    if misses:
+        decoded_misses = js_pool.decode_batch([items[i][1] for i in misses], 10, [items[i][0] for i in misses]) # type: ignore
+        for i, decoded in zip(misses, decoded_misses):
+            results[i] = decoded
+            if decode_cache is not None and not isinstance(decoded, Exception):
+                decode_cache.put(items[i][1], 10, decoded)
+
+    for (devEUI, _), decoded in zip(items, results):
+        if isinstance(decoded, Exception):
+            logger.error(f"Failed to decode frame for DevEUI {devEUI}: {decoded}")
+            continue
+        logger.info(f"Frame reassembled and decoded for DevEUI {devEUI}: {decoded}")
+        output_stage.submit((devEUI, decoded))
+    return results # type: ignore
+
+
+def publish_frame(item: tuple[str, dict]) -> None:
+    """ Output stage handler """
+    devEUI, decoded = item
+
+    if config["output"]["mqtt"]["enable"] == True:
+        send_mqtt_message(devEUI, decoded)
+    if http_output is not None:
+        http_output.submit(devEUI, decoded)
 
-                # Check if last frame received is still fresh enough
-                elif frame_list and (time.time() - frame_list[-1]["received_time"] > (get_timeout() * 3600)):
-                    to_be_deleted.append(devEUI)
-                    logger.warning(f"Didn't received any new chunk from DevEUI {devEUI} for {get_timeout()} hours, flushing all its pending fragment...")
 
-            # Delete afterwards, as dict cannot be deleted while iterating
-            for devEUI in to_be_deleted:
-                del frame_buffer[devEUI]
+def next_timeout_check() -> float:
+    """ Seconds to wait until the next pending device is due, at most TIMEOUT_CHECK_INTERVAL """
+    oldest = frame_buffer.oldest_fragment_time()
+    if oldest is None:
+        return TIMEOUT_CHECK_INTERVAL
+    return min(max(oldest + get_timeout() * 3600 - time.time(), 0), TIMEOUT_CHECK_INTERVAL)
+
+
+def frame_timeout_checker():
+    """ Threaded function flushing devices whose last fragment is older than the configured timeout """
+    while not exit_event.is_set():
+        exit_event.wait(next_timeout_check()) # Returns early on shutdown
+
+        # Only devices actually due are visited, each shard being locked in turn
+        for devEUI in frame_buffer.expire(time.time() - get_timeout() * 3600):
+            logger.warning(f"Didn't received any new chunk from DevEUI {devEUI} for {get_timeout()} hours, flushing all its pending fragment...")
 
 
 ######### INPUT #########
@@ -133,29 +219,110 @@ def frame_timeout_checker():
 # TTN : Need to subscribe to v3/{application id}@{tenant id}/devices/{device id}/up
 
 
-# MQTT : On message callback
+# MQTT : On message callback, runs on the paho network thread so only queue the message
 def on_mqtt_message(client, userdata, message: mqtt.MQTTMessage) -> None:
-    logger.debug(f"Received MQTT msg on topic: {message.topic}, payload :" + str(message.payload))
-    
+    global ingest_dropped
+    # Blocking would stall paho network thread, missing keepalives until the broker disconnects.
+    # Backpressure pauses input before the total backlog fills the ingest queues, but a single
+    # device can still fill the queue of its worker
+    if not ingest_stage.submit(message, block=False):
+        ingest_dropped += 1
+        if ingest_dropped % 1000 == 1:
+            logger.warning(f"Ingest queue full, {ingest_dropped} MQTT uplinks dropped so far. Raise pipeline.ingest.depth, or enable backpressure if it is off")
+
+    # QoS 1 messages are acked manually : while paused, holding the acks makes the broker
+    # stop delivering once its inflight window is full
+    if message.qos > 0:
+        with deferred_acks_lock:
+            if backpressure is not None and backpressure.paused:
+                deferred_acks.append((client, message.mid, message.qos))
+                return
+        client.ack(message.mid, message.qos)
+
+
+def pause_mqtt_input() -> None:
+    # QoS 1 acks are held by on_mqtt_message, QoS 0 can only be stopped at the subscription
+    if get_input_qos() == 0:
+        for client in mqtt_input_clients:
+            client.unsubscribe(get_input_topic())
+
+
+def resume_mqtt_input() -> None:
+    if get_input_qos() == 0:
+        for client in mqtt_input_clients:
+            client.subscribe(get_input_topic(), qos=0)
+    flush_deferred_acks()
+
+
+def flush_deferred_acks() -> None:
+    with deferred_acks_lock:
+        acks = deferred_acks[:]
+        deferred_acks.clear()
+    for client, mid, qos in acks:
+        client.ack(mid, qos)
+
+
+def ingest_key(message: mqtt.MQTTMessage) -> str:
+    """ Ingest worker of a message : by DevEUI found without parsing, else by topic.
+    Loriot publishes every device on one topic, DevEUI spreads them while keeping each device in order """
+    devEUI = lns_scanner.devEUI(message.payload) if lns_scanner is not None else None
+    return devEUI.upper() if devEUI is not None else message.topic
+
+
+# Ingest stage handler
+def ingest_mqtt_message(message: mqtt.MQTTMessage) -> None:
+    global partition_skipped, prefiltered
+    logger.debug("Received MQTT msg on topic: %s, payload : %s", message.topic, message.payload)
+
+    # Most uplinks are not fragments, drop them before parsing the whole message
+    if lns_prefilter is not None:
+        if not lns_prefilter.wanted(message.payload):
+            prefiltered += 1
+            return None
+        if config["input"]["mqtt"].get("partition") is not None:
+            devEUI = lns_prefilter.devEUI(message.payload)
+            if devEUI is not None and not in_partition(devEUI):
+                partition_skipped += 1
+                return None
+
     try:
         frame = parse_mqtt(message)
     except:
         return None
 
-    # We don't care about non fragmented frames
-    if frame["fPort"] in {FRAGMENT_FPORT, LAST_FRAGMENT_FPORT}:
-        with frame_lock:
+    # Fragments of a device must all reach the same instance, others are left to it
+    if not in_partition(frame["devEUI"]):
+        partition_skipped += 1
+        return None
+
+    ingest_frame(frame)
+
 
-            if frame["devEUI"] in frame_buffer:
-                frame_buffer[frame["devEUI"]].append(frame)
-                logger.info(f"Received fragment from {frame['devEUI']}")
-            else:
-                frame_buffer[frame["devEUI"]] = [frame]
+def ingest_frame(frame: Frame) -> str:
+    """ Store a parsed uplink, whatever its input. Return what happened to it :
+    fragment (stored, waiting for the next ones), complete (last fragment, frame queued for decoding),
+    ignored (not a fragmented frame) or rejected (device over its limits, its fragments are flushed) """
 
-            if frame["fPort"] == LAST_FRAGMENT_FPORT:
-                process_frame(frame["devEUI"])
+    # We don't care about non fragmented frames
+    if frame["fPort"] in {FRAGMENT_FPORT, LAST_FRAGMENT_FPORT}:
+        # Limits are checked against the device running counters before storing the fragment
+        try:
+            pending = frame_buffer.append(frame, max_chunks=get_max_chunk(), max_frame_bytes=get_max_frame_bytes())
+        except FrameLimitExceeded:
+            logger.warning(f"Received more than configured {get_max_chunk()} chunk or {get_max_frame_bytes()} bytes from {frame['devEUI']}, flushing all its pending fragments...")
+            return "rejected"
+
+        if pending > 1:
+            logger.info(f"Received fragment from {frame['devEUI']}")
+
+        # Decoding & publishing happen in the next stages, outside of any buffer lock
+        if frame["fPort"] == LAST_FRAGMENT_FPORT:
+            process_frame(frame["devEUI"])
+            return "complete"
+        return "fragment"
     else:
-        logger.debug("Received MQTT frame with non-interesting fPort")
+        logger.debug("Received frame with non-interesting fPort")
+        return "ignored"
 
 
 def parse_mqtt(message: mqtt.MQTTMessage):
@@ -165,61 +332,139 @@ def parse_mqtt(message: mqtt.MQTTMessage):
         logger.error(f"Received an invalid message (not json) from topic {message.topic}: {message.payload}")
         raise InvalidJSON
 
-    match config["frame"]["lns"]:
-        case "ttn":
-            frame = parse_ttn(chunk)
-        case "loriot":
-            frame = parse_loriot(chunk)
-        case _:
-            logger.critical("This LNS is not supported, check config.yaml, exiting...")
-            exit(1)
+    return parse_uplink(chunk)
 
+
+def parse_uplink(chunk: dict) -> Frame:
+    """ LNS uplink, already loaded from JSON, to Frame. Raise InvalidFrame if it is not a valid uplink """
+    frame = lns_parser(chunk)
     if not frame:
-        logger.debug("Could not decode the MQTT received. Check that LNS is the right one in config.yaml.")
+        logger.debug("Could not decode the uplink received. Check that LNS is the right one in config.yaml.")
         raise InvalidFrame
     
     return frame
 
 
-#### HTTP ####
+#### PIPELINE ####
+
+# Stages are rebuilt from config by init_pipeline(), these are the defaults
+ingest_stage = Stage("ingest", ingest_mqtt_message, key=lambda message: message.topic)
+decode_stage = Stage("decode", decode_frames, batch_size=64)
+output_stage = Stage("output", publish_frame)
 
-flask_app = Flask(__name__)
 
+#### HTTP ####
+
+# Native ASGI app : requests are served on the uvicorn event loop, and anything that
+# may block (parsing, reassembly, buffer snapshot) is handed to a worker thread
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+templates = Jinja2Templates(directory=os.path.join(APP_DIR, "templates"))
 
 
-def start_flask(http_server):
+def start_http_server(http_server):
     try:
         http_server.run()
     except:
         logger.error("Failed to start HTTP server")
         exit_event.set()
 
-@flask_app.route("/input", methods=["POST"])
-def receive_http_chunk():
+async def receive_http_chunk(request: Request) -> Response:
+    """ LNS uplink pushed over HTTP (TTN webhook, Loriot HTTP push), or a JSON array of uplinks.
+    Answer with the status of each uplink, in the same order """
     if config["input"]["http"]["enable"] == False:
-        abort(404)
+        return JSONResponse({"error": "HTTP input is disabled"}, 404)
 
-    # chunk = request.json.get("chunk", "")
-    # with frame_lock:
-    #     frame_buffer.append(chunk)
-    #     if len(frame_buffer) >= config["frame"]["max_chunks"]:
-    #         process_frame("AA")
-    return jsonify({"status": "received"}), 200
+    body = await request.body()
+    # A full decode stage blocks ingestion, it must not block the event loop
+    content, status_code = await run_in_threadpool(ingest_http_body, body)
+    return JSONResponse(content, status_code)
 
 
-@flask_app.route("/monitor", methods=["GET"])
-def monitor_buffer():
-    table_data = copy.deepcopy(frame_buffer)
+def ingest_http_body(body: bytes) -> tuple[dict, int]:
+    try:
+        uplinks = json.loads(body)
+    except ValueError:
+        uplinks = None
+    if not isinstance(uplinks, (dict, list)):
+        return {"error": "Body should be an uplink or an array of uplinks, in JSON"}, 400
 
+    uplinks = uplinks if isinstance(uplinks, list) else [uplinks]
+    if len(uplinks) > get_max_http_uplinks():
+        return {"error": f"At most {get_max_http_uplinks()} uplinks per request"}, 413
 
-    for frame_list in table_data.values():
-        for frame in frame_list:
-            frame["received_time_str"] = datetime.datetime.fromtimestamp(frame["received_time"]).strftime("%Y-%m-%d %H:%M:%S") # type: ignore
-            frame["raw_hex"] =  frame["raw"].hex() # type: ignore
+    results = [ingest_http_uplink(uplink) for uplink in uplinks]
+    return {"received": len(uplinks), "results": results}, 200
 
 
-    result = render_template("monitor.html",data=table_data, timeout=get_timeout(), max_chunk=get_max_chunk())
-    return result, 200
+def ingest_http_uplink(uplink) -> dict:
+    try:
+        frame = parse_uplink(uplink)
+    except Exception:
+        return {"status": "invalid", "error": f"Not a valid {config['frame']['lns']} uplink"}
+    return {"status": ingest_frame(frame), "devEUI": frame["devEUI"]}
+
+
+async def monitor_buffer(request: Request) -> Response:
+    table_data = await run_in_threadpool(monitor_table)
+    return templates.TemplateResponse(request, "monitor.html", {"data": table_data, "timeout": get_timeout(), "max_chunk": get_max_chunk(), "stages": get_stats()["pipeline"]})
+
+
+def monitor_table() -> dict:
+    table_data = {}
+
+    for devEUI, pending in frame_buffer.snapshot().items():
+        table_data[devEUI] = {
+            "count": len(pending),
+            "last_time_str": datetime.datetime.fromtimestamp(pending.last_time).strftime("%Y-%m-%d %H:%M:%S"),
+            "raw_hex": [raw.hex() for raw in pending.fragments()],
+        }
+    return table_data
+
+
+def get_stats() -> dict:
+    return {
+        "frame_buffer": {
+            "pending_devices": len(frame_buffer),
+            "pending_bytes": frame_buffer.pending_bytes,
+            "pending_fragments": frame_buffer.pending_fragments,
+            "evicted": frame_buffer.evicted,
+        },
+        "decoder": js_pool.stats() if js_pool is not None else None,
+        "native_decoders": native_decoders.stats() if native_decoders is not None else None,
+        "decode_cache": decode_cache.stats() if decode_cache is not None else None,
+        "pipeline": {stage.name: stage.stats() for stage in (ingest_stage, decode_stage, output_stage)},
+        "mqtt_input": {
+            "connected": sum(client.is_connected() for client in mqtt_input_clients),
+            "connections": len(mqtt_input_clients),
+            "partition_skipped": partition_skipped,
+            "prefiltered": prefiltered,
+            "dropped": ingest_dropped,
+            "deferred_acks": len(deferred_acks),
+        },
+        "backpressure": backpressure.stats() if backpressure is not None else None,
+        "http_output": http_output.stats() if http_output is not None else None,
+        "mqtt_output": mqtt_output.stats() if mqtt_output is not None else None,
+    }
+
+
+async def ready(request: Request) -> Response:
+    """ Readiness probe : 503 until every service is started, and again once shutting down """
+    if ready_event.is_set():
+        return JSONResponse({"ready": True}, 200)
+    return JSONResponse({"ready": False}, 503)
+
+
+async def stats(request: Request) -> Response:
+    return JSONResponse(get_stats(), 200)
+
+
+http_app = Starlette(routes=[
+    Route("/input", receive_http_chunk, methods=["POST"]),
+    Route("/monitor", monitor_buffer, methods=["GET"]),
+    Route("/ready", ready, methods=["GET"]),
+    Route("/stats", stats, methods=["GET"]),
+    Mount("/static", StaticFiles(directory=os.path.join(APP_DIR, "static")), name="static"),
+])
 
 ######### OUTPUT #########
 
@@ -227,23 +472,10 @@ def monitor_buffer():
 #### MQTT ####
 
 # MQTT : Publish
-def send_mqtt_message(devEUI: str, frame: dict):
-    topic = config["output"]["mqtt"]["topic"]+f"/{devEUI}"
-    logger.info(f"Publishing decoded frame for DevEUI {devEUI} to MQTT on topic {topic}")
-    res = client_mqtt_output.publish(topic, json.dumps(frame))
-    if res.rc == mqtt.MQTT_ERR_SUCCESS:
-        return True
-    else:
-        logger.error(f"Failed to publish MQTT message: {MQTT_ERROR_NAMES.get(res.rc)}")
-        return False
+def send_mqtt_message(devEUI: str, frame: dict) -> bool:
+    logger.info(f"Publishing decoded frame for DevEUI {devEUI} to MQTT on topic {mqtt_output.topic}") # type: ignore
+    return mqtt_output.submit(devEUI, frame) # type: ignore
     
-#### HTTP ####
-
-def send_http_request(frame):
-    requests.post(config["output"]["http"]["url"], json={"frame": frame})
-
-
-
 ###### INIT
 
 def load_config() -> dict:
@@ -267,21 +499,35 @@ def launch():
     ######## CONFIG
     load_config()
     init_logging()
-    init_javascript()
-    mosquitto_process = init_self_broker()
-    init_input()
-    init_http_server()
-    init_output()
+    init_lns()
+
+    # Decoder processes and local broker are the slow steps, they start while the rest is set up
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="init") as executor:
+        decoder_ready = executor.submit(init_javascript)
+        broker_ready = executor.submit(init_self_broker)
+
+        init_frame_buffer()
+        init_frame_store()
+        init_pipeline()
+        init_http_server()
+
+        # Inputs & outputs may use the local broker
+        mosquitto_process = broker_ready.result()
+        init_input()
+        init_output()
+        decoder_ready.result()
+    init_backpressure()
     init_timeout_checker()
-        
 
-    logger.info("Application started and waiting for input...")
+    ready_event.set()
+    logger.info(f"Application started in {time.monotonic() - started:.2f}s and waiting for input...")
     
 
     # Keep the main thread alive
     while not exit_event.is_set():
         try:
-            time.sleep(1)
+            exit_event.wait(1)
         except KeyboardInterrupt:
             break
 
@@ -291,68 +537,177 @@ def launch():
 
 def shutdown(mosquitto_process):
     logger.info("Shutting down...")
+    ready_event.clear()
     exit_event.set() 
 
+    # No new input while draining, messages already queued will be processed so they can be acked
+    if backpressure is not None:
+        backpressure.stop()
+    flush_deferred_acks()
+    for client in mqtt_input_clients:
+        client.disconnect()
+        client.loop_stop()
     http_server.should_exit = True
 
-    if js_worker_process is not None and task_queue is not None:
-        js_fetcher.stop_js_worker(task_queue, js_worker_process)
+    # Drain what is already queued before stopping the services it relies on
+    for stage in (ingest_stage, decode_stage, output_stage):
+        stage.stop(timeout=5)
+    if http_output is not None:
+        http_output.stop(timeout=5)
+    if mqtt_output is not None:
+        mqtt_output.stop(timeout=5)
+
+    if frame_store is not None:
+        frame_store.close()
+
+    if js_pool is not None:
+        js_pool.stop()
 
     if config["local-broker"]["enable"] == True:
         self_broker.stop_mosquitto(mosquitto_process) # type: ignore
 
-
-    time.sleep(2) # Allow time for all thread to end properly
+    # Wait for the remaining threads instead of a fixed delay
+    for thread in (http_thread, timeout_thread):
+        if thread is not None:
+            thread.join(timeout=5)
     exit(0)
 
+def init_lns():
+    global lns_parser, lns_scanner, lns_prefilter
+    match config["frame"]["lns"]:
+        case "ttn":
+            lns_parser, lns = parse_ttn, ttn
+        case "loriot":
+            lns_parser, lns = parse_loriot, loriot
+        case _:
+            logger.critical("This LNS is not supported, check config.yaml, exiting...")
+            exit(1)
+
+    lns_scanner = UplinkPrefilter(lns.FPORT_KEY, lns.DEVEUI_KEY, {FRAGMENT_FPORT, LAST_FRAGMENT_FPORT})
+    lns_prefilter = lns_scanner if config["frame"].get("prefilter", True) == True else None
+
+def init_frame_buffer():
+    # Global budget across all devices, on top of the per device max_chunks
+    frame_buffer.max_bytes = config["frame"].get("max_pending_bytes")
+    frame_buffer.max_fragments = config["frame"].get("max_pending_fragments")
+
+def init_frame_store():
+    global frame_store
+    persistence = config["frame"].get("persistence", {})
+    if persistence.get("enable", False) == True:
+        try:
+            frame_store = FrameStore(persistence["path"], persistence.get("sync_interval", 1))
+            recovered = frame_store.attach(frame_buffer, config["frame"]["max_chunks"])
+        except Exception as e:
+            logger.critical(f"Failed to open pending fragments store {persistence['path']}: {e}")
+            exit(1)
+        frame_store.start()
+        logger.info(f"Recovered pending fragments of {recovered} devices from {persistence['path']}")
+
+def init_pipeline():
+    global ingest_stage, decode_stage, output_stage
+
+    # Ingest is partitioned by device, keeping its fragments in order
+    ingest_stage = Stage("ingest", ingest_mqtt_message, key=ingest_key, **get_stage_config("ingest"))
+    decode_stage = Stage("decode", decode_frames, **get_stage_config("decode"))
+    output_stage = Stage("output", publish_frame, **get_stage_config("output"))
+
+    for stage in (output_stage, decode_stage, ingest_stage):
+        stage.start()
+    logger.info("Processing pipeline started...")
+
+def init_backpressure():
+    global backpressure
+    settings = config.get("backpressure", {})
+    if settings.get("enable", False) == True and config["input"]["mqtt"]["enable"] == True:
+        backpressure = Backpressure(get_backlog, settings["high_watermark"], settings["low_watermark"], pause_mqtt_input, resume_mqtt_input)
+        backpressure.start()
+        mode = "holding QoS 1 acks" if get_input_qos() > 0 else "unsubscribing"
+        logger.info(f"Backpressure on MQTT input by {mode} above {backpressure.high} queued items...")
+
 def init_timeout_checker():
+    global timeout_thread
     timeout_thread = threading.Thread(target=frame_timeout_checker, daemon=True) 
     timeout_thread.start()
 
+def get_outbox_settings(output: str) -> dict:
+    """Outbox of an output, in its own sub-directory, as settings of that output. Empty if disabled."""
+    settings = config.get("outbox", {})
+    if settings.get("enable", False) == False:
+        return {}
+    try:
+        outbox = Outbox(os.path.join(settings["path"], output), max_bytes=settings.get("max_bytes", 1 << 30),
+                        segment_bytes=settings.get("segment_bytes", 16 << 20), drop_policy=settings.get("drop_policy", "oldest"))
+    except (OSError, ValueError) as e:
+        logger.critical(f"Outbox of {output} output Failed : {e}")
+        exit(1)
+    logger.info(f"Outbox of {output} output in {outbox.path}, {outbox.pending} frames pending")
+    return {"outbox": outbox, "drain_rate": settings.get("drain_rate", 100)}
+
 def init_output():
-    global client_mqtt_output
+    global mqtt_output, http_output
     if config["output"]["mqtt"]["enable"] == True:
+        settings = {key: value for key, value in config["output"]["mqtt"].items() if key != "enable"}
+        settings.update(get_outbox_settings("mqtt"))
         try:
-            status_code = client_mqtt_output.connect(config["output"]["mqtt"]["host"], config["output"]["mqtt"]["port"])
-            client_mqtt_output.loop() #process network event
-            if status_code != mqtt.MQTT_ERR_SUCCESS:
-                logger.critical(f"MQTT Output Failed : Failed to connect to the MQTT Broker : {MQTT_ERROR_NAMES.get(status_code)}")
-                exit(1)
-            else:
-                logger.info("Output Connected to MQTT Broker !")
+            mqtt_output = MqttOutput(**settings)
+        except (TypeError, ValueError) as e:
+            logger.critical(f"MQTT Output Failed : invalid settings : {e}")
+            exit(1)
+        try:
+            mqtt_output.connect()
+            logger.info("Output Connected to MQTT Broker !")
         except Exception as e:
             logger.critical("MQTT Output Failed : Failed to connect to the MQTT Broker : " +  str(e))
             exit(1)
     if config["output"]["http"]["enable"] == True:
-        # TODO Implement HTTP
-        pass
+        settings = {key: value for key, value in config["output"]["http"].items() if key != "enable"}
+        settings.update(get_outbox_settings("http"))
+        try:
+            http_output = HttpOutput(**settings)
+        except (TypeError, ValueError) as e:
+            logger.critical(f"HTTP Output Failed : invalid settings : {e}")
+            exit(1)
+        http_output.start()
+        logger.info(f"Output HTTP to {http_output.url} with {http_output.stage.workers} connections !")
 
     if config["output"]["http"]["enable"] == False and config["output"]["mqtt"]["enable"] == False:
         logger.critical("At least one input should be selected. Please check config.")
         exit(1)
 
 def init_http_server():
-    global flask_thread, http_server
-
-    asgi_flask_app = WsgiToAsgi(flask_app)
-    http_server = uvicorn.Server(uvicorn.Config(asgi_flask_app, host=config["input"]["http"]["host"], port=config["input"]["http"]["port"]))
-    flask_thread = threading.Thread(target=start_flask,args=[http_server], daemon=True)
-    flask_thread.start()
+    global http_thread, http_server
+
+    # One access log line per request costs more than ingesting the uplink, only kept when debugging
+    http_server = uvicorn.Server(uvicorn.Config(
+        http_app, host=config["input"]["http"]["host"], port=config["input"]["http"]["port"],
+        access_log=config["log"]["level"] == "debug",
+    ))
+    http_thread = threading.Thread(target=start_http_server,args=[http_server], daemon=True)
+    http_thread.start()
     logger.info("HTTP Server started...")
 
 def init_input():
+    global mqtt_input_clients
     if config["input"]["mqtt"]["enable"] == True:
-        mqtt_client = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION2)
-        mqtt_client.on_message = on_mqtt_message
-        try:
-            mqtt_client.connect(config["input"]["mqtt"]["host"], config["input"]["mqtt"]["port"])
-            logger.info("Input Connected to MQTT Broker !")
-        except Exception as e:
-            logger.critical("MQTT Input Failed : Failed to connect to the MQTT Broker : " +  str(e))
-            exit(1)
-        mqtt_client.subscribe(config["input"]["mqtt"]["topic"])
-        mqtt_client.loop_start()
-        return mqtt_client
+        # Each connection has its own socket & network thread, the shared subscription
+        # makes the broker deliver every uplink to only one of them
+        topic = get_input_topic()
+        clients = []
+        for _ in range(config["input"]["mqtt"].get("connections", 1)):
+            mqtt_client = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION2, manual_ack=get_input_qos() > 0)
+            mqtt_client.on_message = on_mqtt_message
+            try:
+                mqtt_client.connect(config["input"]["mqtt"]["host"], config["input"]["mqtt"]["port"])
+            except Exception as e:
+                logger.critical("MQTT Input Failed : Failed to connect to the MQTT Broker : " +  str(e))
+                exit(1)
+            mqtt_client.subscribe(topic, qos=get_input_qos())
+            mqtt_client.loop_start()
+            clients.append(mqtt_client)
+        mqtt_input_clients = clients
+        logger.info(f"Input Connected to MQTT Broker with {len(clients)} connections on {topic} !")
+        return clients
 
     if config["input"]["http"]["enable"] == False and config["input"]["mqtt"]["enable"] == False:
         logger.critical("At least one input should be selected. Please check config.")
@@ -366,10 +721,11 @@ def init_self_broker():
             logger.error("Self hosted MQTT Broker could not be started : ")
             exit(1)
         
-        # Wait 1 sec and check if process is still alive
-        time.sleep(1)
-        if mosquitto_process.poll() is not None:
+        # Wait until it accepts connections, failing as soon as it exits
+        if not self_broker.wait_ready(mosquitto_process):
             logger.error("Self hosted MQTT Broker could not be started : ")
+            if mosquitto_process.poll() is None:
+                mosquitto_process.kill()
             stdout, stderr = mosquitto_process.communicate()
             logger.error(stderr)
             exit(1)
@@ -383,12 +739,37 @@ def quit():
 
 
 def init_javascript():
-    global js_worker_process, task_queue, result_queue
-    js_worker_process, task_queue, result_queue = js_fetcher.start_js_worker()
+    global js_pool, decode_cache, native_decoders
+    decoder = config.get("decoder", {})
+    try:
+        js_pool = js_fetcher.JSWorkerPool(
+            decoder.get("workers"), decoder.get("dispatch", "least-outstanding"),
+            timeout=decoder.get("timeout", js_fetcher.DEFAULT_TIMEOUT), retries=decoder.get("retries", 1), slo_ms=decoder.get("slo_ms", 100),
+        )
+    except Exception as e:
+        logger.error(f"Fail to initialize JS Worker : {e}")
+        exit(1)
 
-    if (js_worker_process, task_queue, result_queue) == (None, None, None):
-        logger.error("Fail to initialize JS Worker")
+    # First call loads & compiles the decoder script in every process, before real frames arrive
+    try:
+        elapsed = js_pool.prewarm()
+    except JSWorkerFail as e:
+        logger.critical(f"JS decoder failed to load : {e}")
         exit(1)
+    logger.info(f"{js_pool.size} JS Workers started and warmed up in {elapsed:.2f}s...")
+
+    cache = decoder.get("cache", {})
+    if cache.get("enable", False) == True:
+        decode_cache = DecodeCache(cache.get("size", 10000), cache.get("ttl"))
+
+    native = decoder.get("native", {})
+    if native.get("enable", False) == True:
+        try:
+            native_decoders = PythonBackend(native.get("decoders"), native.get("devices"))
+        except ValueError as e:
+            logger.critical(f"Invalid decoder.native configuration : {e}")
+            exit(1)
+        logger.info(f"In-process decoders enabled : {[name for name, _ in native_decoders.decoders]}")
 
 def init_logging():
     match config["log"]["level"]:
@@ -0,0 +1,114 @@
+# In-process benchmark of the JS decoder, no broker needed.
+# Run from the tests folder : python benchmark_decoder.py
+import ast
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src/app")))
+
+from lib.decoders import PythonBackend
+from lib.js_fetcher import JSWorkerPool
+from static import DATAFORMAT2_BYTES, DATAFORMAT2_DECODED
+
+
+FRAME_NUMBER = 2000
+
+
+def throughput(pool, thread_count: int) -> float:
+    """Decode FRAME_NUMBER DATAFORMAT2 frames from `thread_count` threads. Return decodes/s."""
+    def worker(thread_id):
+        for _ in range(thread_id, FRAME_NUMBER, thread_count):
+            pool.decode(DATAFORMAT2_BYTES, 10)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(thread_count)]
+    start = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return FRAME_NUMBER / (time.perf_counter() - start)
+
+
+def pool_scaling():
+    print("JS workers | decodes/s | speedup")
+    reference = None
+    for size in range(1, (os.cpu_count() or 1) + 1):
+        pool = JSWorkerPool(size)
+        for worker in pool.workers: # Warm up every worker
+            worker.call("te_decoder", DATAFORMAT2_BYTES, 10).result()
+        result = throughput(pool, 2 * size)
+        pool.stop()
+
+        reference = reference or result
+        print(f"{size:>10} | {result:>9.0f} | {result / reference:>6.2f}x")
+
+
+def batch_vs_single():
+    # Burst of frames completed at the same time, decoded on a single worker
+    pool = JSWorkerPool(1)
+    pool.decode(DATAFORMAT2_BYTES, 10)
+
+    start = time.perf_counter()
+    for _ in range(FRAME_NUMBER):
+        pool.decode(DATAFORMAT2_BYTES, 10)
+    single = FRAME_NUMBER / (time.perf_counter() - start)
+
+    print("Batch size | decodes/s")
+    print(f"{1:>10} | {single:>9.0f}")
+    for batch_size in (8, 64, 256):
+        start = time.perf_counter()
+        for _ in range(FRAME_NUMBER // batch_size):
+            pool.decode_batch([DATAFORMAT2_BYTES] * batch_size, 10)
+        result = (FRAME_NUMBER // batch_size) * batch_size / (time.perf_counter() - start)
+        print(f"{batch_size:>10} | {result:>9.0f}")
+    pool.stop()
+
+
+def transport():
+    # Serialization work of one decode, outside of the JS call itself
+    # Before : list of int per byte, str() of the JS object then ast.literal_eval
+    # After : bytes as is, JSON.stringify in the worker then json.loads
+    repr_result, json_result = str(DATAFORMAT2_DECODED), json.dumps(DATAFORMAT2_DECODED)
+    cases = {
+        "request, before": lambda: pickle.loads(pickle.dumps((0, "te_decoder", [(list(DATAFORMAT2_BYTES), 10)]))),
+        "request, after": lambda: pickle.loads(pickle.dumps((0, "te_decoder", [(DATAFORMAT2_BYTES, 10)]))),
+        "result, before": lambda: ast.literal_eval(pickle.loads(pickle.dumps((0, [repr_result])))[1][0]),
+        "result, after": lambda: json.loads(pickle.loads(pickle.dumps((0, [(True, json_result)])))[1][0][1]),
+    }
+    print("Transport step | us per decode")
+    for name, case in cases.items():
+        print(f"{name:>15} | {timeit.timeit(case, number=FRAME_NUMBER) / FRAME_NUMBER * 1e6:>13.1f}")
+
+    # End-to-end, needs the JS decoder
+    pool = JSWorkerPool(1)
+    pool.decode(DATAFORMAT2_BYTES, 10)
+    print(f"pool.decode end-to-end : {timeit.timeit(lambda: pool.decode(DATAFORMAT2_BYTES, 10), number=FRAME_NUMBER) / FRAME_NUMBER * 1e6:.1f} us")
+    pool.stop()
+
+
+def backends():
+    # Same DATAFORMAT2 frames, through the JS worker pool and the in-process Python decoder
+    print("Backend          | us per decode | decodes/s")
+
+    def report(name, seconds, decodes=FRAME_NUMBER):
+        print(f"{name:<16} | {seconds / decodes * 1e6:>13.1f} | {decodes / seconds:>9.0f}")
+
+    pool = JSWorkerPool(1)
+    pool.decode(DATAFORMAT2_BYTES, 10)
+    report("js, single", timeit.timeit(lambda: pool.decode(DATAFORMAT2_BYTES, 10), number=FRAME_NUMBER))
+    report("js, batch 64", timeit.timeit(lambda: pool.decode_batch([DATAFORMAT2_BYTES] * 64, 10), number=FRAME_NUMBER // 64), FRAME_NUMBER // 64 * 64)
+    pool.stop()
+
+    backend = PythonBackend(["te-multipoint"])
+    assert backend.decode(DATAFORMAT2_BYTES, 10) == DATAFORMAT2_DECODED
+    report("python", timeit.timeit(lambda: backend.decode(DATAFORMAT2_BYTES, 10), number=FRAME_NUMBER))
+
+
+if __name__ == "__main__":
+    pool_scaling()
+    batch_vs_single()
+    transport()
+    backends()
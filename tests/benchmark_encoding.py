@@ -0,0 +1,44 @@
+# Bytes on the wire and serialization time of a decoded frame, for each output encoding & compression.
+# In-process, no broker needed. Run from the tests folder : python benchmark_encoding.py
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src/app")))
+
+from lib.encoding import COMPRESSIONS, ENCODINGS, Encoder
+from static import DATAFORMAT2_DECODED
+
+
+FRAME_NUMBER = 20000
+BATCH_SIZE = 100
+
+
+def encode_time(encoder: Encoder, obj: dict | list, count: int) -> float:
+    """Time (µs) to encode `obj` once."""
+    start = time.perf_counter()
+    for _ in range(count):
+        encoder.encode(obj)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main_benchmark():
+    batch = [{"devEUI": f"{i:016X}", "frame": DATAFORMAT2_DECODED} for i in range(BATCH_SIZE)]
+    cases = [("frame", DATAFORMAT2_DECODED, FRAME_NUMBER), (f"batch of {BATCH_SIZE}", batch, FRAME_NUMBER // BATCH_SIZE)]
+
+    print("payload | encoding | compression | bytes | ratio to json | µs")
+    for name, obj, count in cases:
+        reference = len(Encoder().encode(obj)[0])
+        for encoding in ENCODINGS:
+            for compression in (None, *COMPRESSIONS):
+                try:
+                    encoder = Encoder(encoding, compression, compress_above=0)
+                except ValueError as e:
+                    print(f"{name} | {encoding} | {compression} | skipped, {e}")
+                    continue
+                size = len(encoder.encode(obj)[0])
+                print(f"{name} | {encoding} | {compression} | {size} | {size / reference:.3f} | {encode_time(encoder, obj, count):.1f}")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,157 @@
+# In-process benchmark of the frame buffer, no broker needed.
+# Run from the tests folder : python benchmark_frame_buffer.py
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src/app")))
+
+from lib.frame_buffer import FrameBuffer
+
+
+DEVICE_COUNT = 10 * 1000
+THREAD_COUNT = 16
+DECODE_TIME = 0.0001 # Simulated JS decode round-trip (second)
+
+
+def make_frame(devEUI: str, fPort: int):
+    return {"raw": b"\x15\x2f\x00\x04", "devEUI": devEUI, "fPort": fPort, "received_time": time.time()}
+
+
+def run(thread_count: int, ingest) -> float:
+    """Every thread sends a first then a last fragment for its share of devices. Return uplinks/s."""
+    def worker(thread_id):
+        for i in range(thread_id, DEVICE_COUNT, thread_count):
+            ingest(make_frame(f"Dev{i}", 138))
+            ingest(make_frame(f"Dev{i}", 202))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(thread_count)]
+    start = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return 2 * DEVICE_COUNT / (time.perf_counter() - start)
+
+
+def scenario_global_lock():
+    # Previous behaviour : one lock, held while decoding
+    frame_buffer: dict[str, list] = {}
+    frame_lock = threading.Lock()
+
+    def ingest(frame):
+        with frame_lock:
+            frame_buffer.setdefault(frame["devEUI"], []).append(frame)
+            if frame["fPort"] == 202:
+                b''.join(f["raw"] for f in frame_buffer.pop(frame["devEUI"]))
+                time.sleep(DECODE_TIME)
+
+    return run(THREAD_COUNT, ingest)
+
+
+def scenario_sharded():
+    frame_buffer = FrameBuffer()
+
+    def ingest(frame):
+        frame_buffer.append(frame)
+        if frame["fPort"] == 202:
+            frame_buffer.pop(frame["devEUI"]).payload()
+            time.sleep(DECODE_TIME)
+
+    return run(THREAD_COUNT, ingest)
+
+
+def contention():
+    print(f"{DEVICE_COUNT} devices, {THREAD_COUNT} threads, {DECODE_TIME * 1e6:.0f} us decode")
+    print(f"Global lock : {scenario_global_lock():>10.0f} uplinks/s")
+    print(f"Sharded     : {scenario_sharded():>10.0f} uplinks/s")
+
+
+def sweep_cost():
+    # 1% of the pending devices are due at each check
+    print("Pending devices | full scan (ms) | deadline heap (ms)")
+    for size in (1000, 10 * 1000, 100 * 1000, 500 * 1000):
+        timings = []
+        for expire in (lambda buffer: buffer.sweep(lambda devEUI, pending: pending.last_time < size // 100),
+                       lambda buffer: buffer.expire(older_than=size // 100)):
+            frame_buffer = FrameBuffer()
+            for i in range(size):
+                frame_buffer.append({"raw": b"\x15", "devEUI": f"Dev{i}", "fPort": 138, "received_time": i})
+
+            start = time.perf_counter()
+            expire(frame_buffer)
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{size:>15} | {timings[0]:>14.1f} | {timings[1]:>18.1f}")
+
+
+def memory_per_device():
+    # Fragments as parsed from MQTT : fresh devEUI string & 26 bytes payload each time
+    def parsed_frame(i):
+        return {"raw": bytes(26), "devEUI": f"{0x4200000000000000 + i:016X}", "fPort": 138, "received_time": time.time()}
+
+    def store_list_of_dict(buffer: dict, frame):
+        buffer.setdefault(frame["devEUI"], []).append(frame)
+
+    def store_compact(buffer: FrameBuffer, frame):
+        buffer.append(frame)
+
+    print("Fragments per device | list of Frame (B/device) | PendingFrame (B/device)")
+    for fragment_count in (1, 3, 10):
+        results = []
+        for make_buffer, store in ((dict, store_list_of_dict), (FrameBuffer, store_compact)):
+            tracemalloc.start()
+            buffer = make_buffer()
+            start = tracemalloc.get_traced_memory()[0]
+            for i in range(DEVICE_COUNT):
+                for _ in range(fragment_count):
+                    store(buffer, parsed_frame(i))
+            results.append((tracemalloc.get_traced_memory()[0] - start) / DEVICE_COUNT)
+            tracemalloc.stop()
+            del buffer
+        print(f"{fragment_count:>20} | {results[0]:>24.0f} | {results[1]:>23.0f}")
+
+
+def recovery_time():
+    # 1 million fragments on disk : 3 fragments per device
+    import tempfile
+    from lib.frame_store import FrameStore
+
+    device_count = 333 * 1000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "frames.db")
+        frame_buffer, store = FrameBuffer(), FrameStore(path)
+        store.attach(frame_buffer)
+        for i in range(device_count):
+            for _ in range(3):
+                frame_buffer.append({"raw": bytes(26), "devEUI": f"Dev{i}", "fPort": 138, "received_time": time.time()})
+
+        start = time.perf_counter()
+        store.close()
+        print(f"Flush of {device_count} dirty devices : {time.perf_counter() - start:.2f} s")
+
+        start = time.perf_counter()
+        FrameStore(path).attach(FrameBuffer())
+        print(f"Recovery of {3 * device_count} fragments : {time.perf_counter() - start:.2f} s")
+
+
+def budget_flood():
+    # scenario2 style flood of unique DevEUIs, with and without a global budget
+    print("Unique DevEUIs | no budget (MB) | 10k fragments budget (MB)")
+    for device_count in (10 * 1000, 100 * 1000, 300 * 1000):
+        results = []
+        for max_fragments in (None, 10 * 1000):
+            tracemalloc.start()
+            frame_buffer = FrameBuffer(max_fragments=max_fragments)
+            for i in range(device_count):
+                frame_buffer.append({"raw": bytes(26), "devEUI": f"Dev{i}", "fPort": 138, "received_time": time.time()})
+            results.append(tracemalloc.get_traced_memory()[1] / 1e6)
+            tracemalloc.stop()
+            del frame_buffer
+        print(f"{device_count:>14} | {results[0]:>14.1f} | {results[1]:>25.1f}")
+
+
+contention()
+sweep_cost()
+memory_per_device()
+recovery_time()
+budget_flood()
@@ -0,0 +1,65 @@
+# Benchmark of the /input HTTP endpoint of a running instance, HTTP input enabled and lns: ttn
+# Run from the tests folder : python benchmark_http_input.py [url]
+import json
+import sys
+import time
+from threading import Thread
+
+import requests
+
+
+URL = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8080/input"
+THREAD_COUNT = 8
+UPLINK_NUMBER = 20000 # Per case
+
+fragment = json.load(open("payload/payload_ttn_fragment1.json"))
+last = json.load(open("payload/payload_ttn_fragment_last.json"))
+
+
+def uplinks(prefix: str, count: int) -> list[dict]:
+    """First & last fragment of count / 2 devices, in order"""
+    result = []
+    for i in range(count // 2):
+        for template in (fragment, last):
+            uplink = json.loads(json.dumps(template))
+            uplink["end_device_ids"]["dev_eui"] = f"{prefix}{i}"
+            result.append(uplink)
+    return result
+
+
+def run(batch_size: int) -> tuple[float, float, int]:
+    """Post UPLINK_NUMBER uplinks, `batch_size` per request, from THREAD_COUNT threads.
+    Return (requests/s, uplinks/s, failed requests)."""
+    per_thread = UPLINK_NUMBER // THREAD_COUNT
+    # Bodies are prepared beforehand, only the HTTP exchange is measured
+    bodies = []
+    for thread_id in range(THREAD_COUNT):
+        thread_uplinks = uplinks(f"http{batch_size}_{thread_id}_", per_thread)
+        if batch_size == 1:
+            bodies.append([json.dumps(uplink) for uplink in thread_uplinks])
+        else:
+            bodies.append([json.dumps(thread_uplinks[i:i + batch_size]) for i in range(0, len(thread_uplinks), batch_size)])
+
+    failed = []
+
+    def post(thread_bodies):
+        session = requests.Session()
+        for body in thread_bodies:
+            if session.post(URL, data=body, headers={"Content-Type": "application/json"}).status_code != 200:
+                failed.append(body)
+
+    threads = [Thread(target=post, args=(thread_bodies,)) for thread_bodies in bodies]
+    start = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - start
+
+    request_count = sum(len(thread_bodies) for thread_bodies in bodies)
+    return request_count / elapsed, per_thread // 2 * 2 * THREAD_COUNT / elapsed, len(failed)
+
+
+if __name__ == "__main__":
+    print("Uplinks per request | requests/s | uplinks/s | failed requests")
+    for batch_size in (1, 100, 1000):
+        requests_per_second, uplinks_per_second, failed = run(batch_size)
+        print(f"{batch_size:>19} | {requests_per_second:>10.0f} | {uplinks_per_second:>9.0f} | {failed:>15}")
@@ -0,0 +1,88 @@
+# Load test of the HTTP input of a running instance, HTTP input enabled and lns: ttn
+# Requests are sent at a fixed rate whatever the response times (open loop), latency is
+# counted from the time each request was due so that queuing is not hidden.
+# Run from the tests folder : python benchmark_http_latency.py [url] [requests/s] [seconds]
+import asyncio
+import json
+import sys
+import time
+from urllib.parse import urlsplit
+
+
+URL = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8080/input"
+RATE = int(sys.argv[2]) if len(sys.argv) > 2 else 5000 # requests/s
+DURATION = float(sys.argv[3]) if len(sys.argv) > 3 else 10 # second
+CONNECTION_COUNT = 64
+
+fragment = json.load(open("payload/payload_ttn_fragment1.json"))
+last = json.load(open("payload/payload_ttn_fragment_last.json"))
+
+
+def request_bytes(host: str, path: str, uplink: dict) -> bytes:
+    body = json.dumps(uplink).encode()
+    head = f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    return head.encode() + body
+
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode().split("\r\n")
+    headers = {name.lower(): value.strip() for name, _, value in (line.partition(":") for line in lines[1:] if line)}
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    else: # Chunked
+        while (size := int((await reader.readuntil(b"\r\n")).strip(), 16)) > 0:
+            await reader.readexactly(size + 2)
+        await reader.readuntil(b"\r\n")
+    return int(lines[0].split()[1])
+
+
+async def connection(index: int, start: float, latencies: list[float], failures: list[int]):
+    """Send this connection share of the requests. Failures are HTTP status, 0 if the connection was closed."""
+    url = urlsplit(URL)
+    reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+
+    # Each connection alternates first & last fragment of its own device, so the buffer does not grow
+    requests = []
+    for template in (fragment, last):
+        uplink = json.loads(json.dumps(template))
+        uplink["end_device_ids"]["dev_eui"] = f"latency{index}"
+        requests.append(request_bytes(url.netloc, url.path, uplink))
+
+    interval = CONNECTION_COUNT / RATE
+    due = start + index * interval / CONNECTION_COUNT
+    sent = 0
+    while due < start + DURATION:
+        await asyncio.sleep(max(due - time.perf_counter(), 0))
+        writer.write(requests[sent % 2])
+        try:
+            status = await read_response(reader)
+        except (asyncio.IncompleteReadError, ConnectionError): # Closed by the server
+            status = 0
+            reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+        latencies.append(time.perf_counter() - due)
+        if status != 200:
+            failures.append(status)
+        sent += 1
+        due += interval
+    writer.close()
+
+
+async def main():
+    latencies: list[float] = []
+    failures: list[int] = []
+    start = time.perf_counter() + 0.5 # Leave time to open the connections
+    await asyncio.gather(*(connection(i, start, latencies, failures) for i in range(CONNECTION_COUNT)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    def percentile(fraction):
+        return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)] * 1000
+
+    print(f"Target {RATE} req/s for {DURATION:.0f}s over {CONNECTION_COUNT} connections")
+    print(f"Sent {len(latencies)} requests, {len(latencies) / elapsed:.0f} req/s, {len(failures)} failed")
+    print(f"Latency p50 {percentile(0.5):.2f} ms | p99 {percentile(0.99):.2f} ms | max {latencies[-1] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+# CPU time spent on MQTT uplinks that are not fragments, with and without the prefilter.
+# In-process, no broker needed. Run from the tests folder : python benchmark_prefilter.py
+import json
+import logging
+import os
+import sys
+import time
+from copy import deepcopy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src/app")))
+
+import paho.mqtt.client as mqtt
+
+import main
+from static import EXAMPLE_CONFIG
+
+
+MESSAGE_NUMBER = 20000
+
+
+def ttn_uplink(gateway_count: int) -> bytes:
+    uplink = json.load(open("payload/payload_ttn_fragment1.json"))
+    uplink["uplink_message"]["f_port"] = 10
+    uplink["uplink_message"]["rx_metadata"] *= gateway_count
+    return json.dumps(uplink).encode()
+
+
+def loriot_uplink() -> bytes:
+    uplink = json.load(open("payload/payload_loriot_fragment1.json"))
+    uplink["port"] = 10
+    return json.dumps(uplink).encode()
+
+
+def cpu_per_message(payload: bytes, prefilter: bool) -> float:
+    """CPU time (µs) of the ingest stage handler for one discarded uplink."""
+    main.config["frame"]["prefilter"] = prefilter
+    main.init_lns()
+    message = mqtt.MQTTMessage(topic=b"input")
+    message.payload = payload
+
+    start = time.process_time()
+    for _ in range(MESSAGE_NUMBER):
+        main.ingest_mqtt_message(message)
+    return (time.process_time() - start) / MESSAGE_NUMBER * 1e6
+
+
+def main_benchmark():
+    logging.disable(logging.INFO)
+    main.config.update(deepcopy(EXAMPLE_CONFIG))
+
+    cases = [(f"ttn, {count} gateways", "ttn", ttn_uplink(count)) for count in (1, 8)]
+    cases.append(("loriot", "loriot", loriot_uplink()))
+
+    print("uplink | bytes | full parse µs | prefilter µs | speedup")
+    for name, lns, payload in cases:
+        main.config["frame"]["lns"] = lns
+        full = cpu_per_message(payload, prefilter=False)
+        filtered = cpu_per_message(payload, prefilter=True)
+        print(f"{name} | {len(payload)} | {full:.2f} | {filtered:.2f} | x{full / filtered:.1f}")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -18,6 +18,8 @@ os.chdir(os.path.dirname(__file__))
 os.environ["ENV"] = "test"
 
 import lib.js_fetcher
+import lib.pipeline
+from lib.frame_buffer import FrameBuffer
 import lib.self_broker
 import main
 from main import exit_event, frame_buffer
@@ -42,9 +44,21 @@ def exit_event_unset():
     yield
 
 
+@pytest.fixture(autouse=True)
+def clear_pipeline(monkeypatch: MonkeyPatch):
+    """
+    Replace pipeline stages by fresh, not started ones so queued items don't leak between tests.
+    """
+    monkeypatch.setattr(main, "ingest_stage", lib.pipeline.Stage("ingest", main.ingest_mqtt_message))
+    monkeypatch.setattr(main, "decode_stage", lib.pipeline.Stage("decode", main.decode_frames, batch_size=64))
+    monkeypatch.setattr(main, "output_stage", lib.pipeline.Stage("output", main.publish_frame))
+    yield
+
+
 @pytest.fixture
 def mock_config():
     main.config.update(deepcopy(EXAMPLE_CONFIG))
+    main.init_lns()
 
 
 @pytest.fixture
@@ -62,47 +76,38 @@ def mock_patch_reassemble(request: pytest.FixtureRequest, monkeypatch: MonkeyPat
 
 
 @pytest.fixture
-def mock_frame_buffer() -> dict[str, list[Frame]]:
+def mock_frame_buffer() -> FrameBuffer:
     # Prepare mock data in frame_buffer
     main.frame_buffer.clear()  # Clear any existing data
-    main.frame_buffer["CAFE"] = [
-        {
-            "raw": b"152f000408630b3e81000c000000060000180000000400010000",
-            "devEUI": "CAFE",
-            "fPort": 138,
-            "received_time": 10,
-        },
-        {
-            "raw": b"d0001c0003c000d0001b00038000d0001a800360014200288005",
-            "devEUI": "CAFE",
-            "fPort": 138,
-            "received_time": 20,
-        },
-        {
-            "raw": b"1800cd0019c0033c00cd0019b0033800cd0019a8033600",
-            "devEUI": "CAFE",
-            "fPort": 202,
-            "received_time": 30,
-        },
-    ]
-
-    main.frame_buffer["BB"] = [
+    for raw, fPort, received_time in [
+        (b"152f000408630b3e81000c000000060000180000000400010000", 138, 10),
+        (b"d0001c0003c000d0001b00038000d0001a800360014200288005", 138, 20),
+        (b"1800cd0019c0033c00cd0019b0033800cd0019a8033600", 202, 30),
+    ]:
+        main.frame_buffer.append({"raw": raw, "devEUI": "CAFE", "fPort": fPort, "received_time": received_time})
+
+    main.frame_buffer.append(
         {
             "raw": b"152f000408630b3e81000c000000060000180000000400010000",
-            "devEUI": "CAFE",
+            "devEUI": "BB",
             "fPort": 138,
             "received_time": 10,
         }
-    ]
+    )
     return main.frame_buffer
 
 
 @pytest.fixture
 def mock_patch_jsdecode(monkeypatch: MonkeyPatch):
-    # Mock the js_fetcher.decode method
+    # Mock the JS worker pool
 
     monkeypatch.setattr(
-        lib.js_fetcher, "decode", MagicMock(return_value=DATAFORMAT2_DECODED)
+        main,
+        "js_pool",
+        MagicMock(
+            decode=MagicMock(return_value=DATAFORMAT2_DECODED),
+            decode_batch=MagicMock(side_effect=lambda raws, fPort, devEUIs=None: [DATAFORMAT2_DECODED] * len(raws)),
+        ),
     )
 
 
@@ -137,8 +142,12 @@ def start_system(monkeymodule):
     )  # type: ignore
 
     main.load_config()
+    main.init_lns()
     main.init_javascript()
     mosquitto_process = main.init_self_broker()
+    main.init_frame_buffer()
+    main.init_frame_store()
+    main.init_pipeline()
     main.init_input()
     main.init_http_server()
     main.init_output()
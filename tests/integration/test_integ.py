@@ -10,10 +10,11 @@ import main
 import paho.mqtt.client as mqtt
 import pytest
 import requests
+from starlette.testclient import TestClient
 
 # Project import
+from lib.mqtt_output import MqttOutput
 from lib.schemas import InvalidFrame
-from paho.mqtt.enums import CallbackAPIVersion
 
 from tests.static import DATAFORMAT2_DECODED, EXAMPLE_CONFIG, wait_until
 
@@ -35,13 +36,14 @@ def test_mqtt_input_frame_not_known(monkeypatch, mock_config):
 def test_monitor_page_complete(mock_frame_buffer):
     """Test : Check that monitor page return something"""
 
-    client = main.flask_app.test_client()
+    client = TestClient(main.http_app)
 
     res = client.get("/monitor")
     assert res.status_code == 200
 
     # Assert that one the frame are found in response HTML
-    assert main.frame_buffer["CAFE"][0]["devEUI"] in res.text
+    assert "CAFE" in res.text
+    assert main.frame_buffer["CAFE"].fragments()[0].hex() in res.text
 
 
 @pytest.mark.usefixtures("start_self_broker")
@@ -49,10 +51,14 @@ class TestMqttInteg:
     def test_mqtt_output_sending_good(self, mock_config):
         """Check that sending works"""
 
-        main.client_mqtt_output.connect("localhost")
+        main.mqtt_output = MqttOutput("localhost", 1883, "output")
+        main.mqtt_output.connect()
 
         status_code = main.send_mqtt_message("CAFE", DATAFORMAT2_DECODED)
         assert status_code is True
+        assert wait_until(lambda: main.mqtt_output.pending() == 0) # Acked
+        assert main.mqtt_output.stats()["ack_latency"]["count"] == 1
+        main.mqtt_output.stop()
 
     def test_init_input_mqtt_success(self):
         """Check that input MQTT successfully connect"""
@@ -60,30 +66,39 @@ class TestMqttInteg:
         main.config["input"]["mqtt"]["host"] = "localhost"
         main.config["input"]["mqtt"]["port"] = 1883
 
-        client = main.init_input()
-        assert client is not None
-        assert wait_until(client.is_connected)
+        clients = main.init_input()
+        assert len(clients) == 1
+        assert wait_until(clients[0].is_connected)
 
     def test_init_output_mqtt_connected(self):
         """Check that mqtt output is well connected."""
 
         main.config["output"]["mqtt"]["enable"] = True
 
-        assert not main.client_mqtt_output.is_connected()
         main.init_output()
-        assert wait_until(main.client_mqtt_output.is_connected)
+        assert wait_until(main.mqtt_output.client.is_connected)
+        main.mqtt_output.stop()
 
     def test_mqtt_output_sending_no_conn(self):
         """Check that sending fails when if no connection"""
 
-        # client is not initialized on purpose (no connection)
-        main.client_mqtt_output = mqtt.Client(
-            callback_api_version=CallbackAPIVersion.VERSION2
-        )
+        # client is not connected on purpose, QoS 0 messages are dropped
+        main.mqtt_output = MqttOutput("localhost", 1883, "output", qos=0)
 
         status_code = main.send_mqtt_message("CAFE", DATAFORMAT2_DECODED)
         assert not status_code
 
+    def test_mqtt_output_queued_no_conn(self):
+        """Check that QoS 1 messages are kept until connected"""
+
+        main.mqtt_output = MqttOutput("localhost", 1883, "output", qos=1)
+        assert main.send_mqtt_message("CAFE", DATAFORMAT2_DECODED)
+        assert main.mqtt_output.pending() == 1
+
+        main.mqtt_output.connect()
+        assert wait_until(lambda: main.mqtt_output.pending() == 0)
+        main.mqtt_output.stop()
+
 
 def test_init_broker_start_stop(mock_config):
     """Check that broker is started right, then stopped."""
@@ -106,7 +121,7 @@ def test_init_http_server(mock_config):
     )
 
     main.http_server.should_exit = True
-    main.flask_thread.join()
+    main.http_thread.join()
 
 
 def test_launch(monkeypatch):
@@ -118,14 +133,14 @@ def test_launch(monkeypatch):
     t = threading.Thread(target=main.launch)
     t.start()
     time.sleep(2)
-    assert wait_until(lambda: main.js_worker_process is not None)
+    assert wait_until(lambda: main.js_pool is not None)
     assert requests.get(
         f"http://localhost:{main.config['input']['http']['port']}/monitor"
     )
 
     main.exit_event.set()
     main.http_server.should_exit = True
-    main.flask_thread.join()
+    main.http_thread.join()
 
 
 def test_shutdown(mock_config):
@@ -134,6 +149,7 @@ def test_shutdown(mock_config):
     ######## CONFIG
     main.init_javascript()
     mosquitto_process = main.init_self_broker()
+    main.init_pipeline()
     main.init_input()
     main.init_http_server()
     main.init_output()
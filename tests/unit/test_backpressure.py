@@ -0,0 +1,53 @@
+from unittest.mock import MagicMock
+
+import pytest
+from lib.backpressure import Backpressure
+
+from tests.static import wait_until
+
+
+def make_backpressure(backlog: list[int]) -> Backpressure:
+    return Backpressure(lambda: backlog[0], high=10, low=2, pause=MagicMock(), resume=MagicMock())
+
+
+def test_watermarks():
+    """Test : paused above the high watermark, resumed only once back to the low one"""
+    backlog = [0]
+    backpressure = make_backpressure(backlog)
+
+    assert not backpressure.check()
+    backlog[0] = 11
+    assert backpressure.check()
+    assert backpressure.check() # Already paused, no second call
+    backpressure.pause.assert_called_once() # type: ignore
+
+    backlog[0] = 5 # Between both watermarks
+    assert backpressure.check()
+    backpressure.resume.assert_not_called() # type: ignore
+
+    backlog[0] = 2
+    assert not backpressure.check()
+    backpressure.resume.assert_called_once() # type: ignore
+
+    stats = backpressure.stats()
+    assert stats["pauses"] == 1
+    assert stats["paused"] is False
+    assert stats["backlog"] == 2
+
+
+def test_invalid_watermarks():
+    with pytest.raises(ValueError):
+        Backpressure(lambda: 0, high=2, low=2, pause=MagicMock(), resume=MagicMock())
+
+
+def test_watch_thread():
+    backlog = [20]
+    backpressure = make_backpressure(backlog)
+    backpressure.start()
+    try:
+        assert wait_until(lambda: backpressure.paused)
+        backlog[0] = 0
+        assert wait_until(lambda: not backpressure.paused)
+    finally:
+        backpressure.stop()
+    backpressure.resume.assert_called_once() # type: ignore
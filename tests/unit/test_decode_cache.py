@@ -0,0 +1,44 @@
+import time
+from unittest.mock import MagicMock
+
+from lib.decode_cache import DecodeCache
+from pytest import MonkeyPatch
+
+from tests.static import DATAFORMAT2_BYTES, DATAFORMAT2_DECODED
+
+
+def test_hit_miss():
+    cache = DecodeCache(max_size=10)
+
+    assert cache.get(DATAFORMAT2_BYTES, 10) is None
+    cache.put(DATAFORMAT2_BYTES, 10, DATAFORMAT2_DECODED)
+    assert cache.get(DATAFORMAT2_BYTES, 10) == DATAFORMAT2_DECODED
+
+    # Same payload on another fPort is another entry
+    assert cache.get(DATAFORMAT2_BYTES, 11) is None
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 2, "evictions": 0, "expirations": 0}
+
+
+def test_lru_eviction():
+    cache = DecodeCache(max_size=2)
+    cache.put(b"\x01", 10, {"a": 1})
+    cache.put(b"\x02", 10, {"b": 2})
+    cache.get(b"\x01", 10) # \x02 is now the least recently used
+    cache.put(b"\x03", 10, {"c": 3})
+
+    assert cache.get(b"\x02", 10) is None
+    assert cache.get(b"\x01", 10) == {"a": 1}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl(monkeypatch: MonkeyPatch):
+    cache = DecodeCache(max_size=2, ttl=60)
+    monkeypatch.setattr(time, "monotonic", MagicMock(return_value=0))
+    cache.put(b"\x01", 10, {"a": 1})
+
+    monkeypatch.setattr(time, "monotonic", MagicMock(return_value=30))
+    assert cache.get(b"\x01", 10) == {"a": 1}
+
+    monkeypatch.setattr(time, "monotonic", MagicMock(return_value=61))
+    assert cache.get(b"\x01", 10) is None
+    assert cache.stats()["expirations"] == 1
@@ -0,0 +1,77 @@
+import os
+import re
+
+import pythonmonkey as pm
+import pytest
+from lib import decoders
+from lib.decoders import JS_BACKEND, PythonBackend
+from lib.te_decoder import MAGNITUDES_RMS, decode_multipoint
+
+from tests.static import DATAFORMAT2_BYTES, DATAFORMAT2_DECODED
+
+
+def test_te_multipoint_dataformat2():
+    assert decode_multipoint(DATAFORMAT2_BYTES, 10) == DATAFORMAT2_DECODED
+
+
+def test_magnitudes_rms_js_parity():
+    """Test : the whole magnitude table is exactly what the JS decoder computes, so both backends give the same output"""
+    path = os.path.join(os.path.dirname(__file__), "../../src/submodules/ttn-decoder/TnnJsDecoder/TE_TtnDecoder.js")
+    with open(path) as file:
+        function = re.search(r"function dBDecompression\(val\) \{.*?\n\}", file.read(), re.S).group(0) # type: ignore
+    db_decompression = pm.eval(f"({function})")
+    assert MAGNITUDES_RMS == [db_decompression(value) for value in range(256)]
+
+
+def test_te_multipoint_memoryview():
+    assert decode_multipoint(memoryview(bytearray(DATAFORMAT2_BYTES)), 10) == DATAFORMAT2_DECODED
+
+
+@pytest.mark.parametrize("raw, fPort", [
+    (DATAFORMAT2_BYTES, 138), # Fragment, not a data frame
+    (bytes.fromhex("1321") + DATAFORMAT2_BYTES[2:], 10), # Single point device
+    (DATAFORMAT2_BYTES[:10], 10), # Too short
+    (DATAFORMAT2_BYTES[:4] + b"\x80" + DATAFORMAT2_BYTES[5:], 10), # Sensor error
+    (DATAFORMAT2_BYTES[:10] + b"\x10" + DATAFORMAT2_BYTES[11:], 10), # Invalid bw_mode
+])
+def test_te_multipoint_left_to_js(raw, fPort):
+    assert decode_multipoint(raw, fPort) is None
+
+
+def test_te_multipoint_format1():
+    # Window with a single valid peak
+    raw = bytes.fromhex("1521" "0004" "08" "63" "0b3e" "41" "00" "03" "0001" "0002" "0003" "000a" "0010" "0020" "ffff" "0000" "ffff" "0000")
+    decoded = decode_multipoint(raw, 10)
+
+    assert decoded["data"]["vibration_information"] == {"frame_format": 1, "rotating_mode": 0, "axis": ["z"]}
+    assert decoded["data"]["vibration_data"]["windows"] == [{"rms_window": 10, "peak1_bin": 16, "peak1_frequency": 16, "peak1_rms": 32}]
+
+
+def test_backend_decode():
+    backend = PythonBackend()
+    assert backend.decode_batch([DATAFORMAT2_BYTES, b"\x00"], 10) == [DATAFORMAT2_DECODED, None]
+    assert backend.stats()["decoded"] == 1
+    assert backend.stats()["passed"] == 1
+
+
+def test_backend_device_forced_to_js():
+    backend = PythonBackend(devices={"CAFE": JS_BACKEND})
+    assert backend.decode(DATAFORMAT2_BYTES, 10, "CAFE") is None
+    assert backend.decode(DATAFORMAT2_BYTES, 10, "BB") == DATAFORMAT2_DECODED
+
+
+def test_backend_unknown_decoder():
+    with pytest.raises(ValueError):
+        PythonBackend(["does-not-exist"])
+
+
+def test_backend_failing_decoder(monkeypatch):
+    """A decoder raising leaves the frame to the next decoder"""
+    def broken(raw, fPort):
+        raise ValueError("broken")
+
+    monkeypatch.setitem(decoders.registry, "broken", broken)
+    backend = PythonBackend(["broken", "te-multipoint"])
+
+    assert backend.decode(DATAFORMAT2_BYTES, 10) == DATAFORMAT2_DECODED
+    assert backend.stats()["failed"] == 1
@@ -0,0 +1,59 @@
+import json
+import zlib
+
+import lib.encoding
+import pytest
+from lib.encoding import Encoder
+
+from tests.static import DATAFORMAT2_DECODED
+
+
+def test_json():
+    """Test : default encoding is what json.dumps() writes, compact one has no whitespace"""
+    payload, content_encoding = Encoder().encode(DATAFORMAT2_DECODED)
+    assert payload == json.dumps(DATAFORMAT2_DECODED).encode()
+    assert content_encoding is None
+
+    compact, _ = Encoder("json_compact").encode(DATAFORMAT2_DECODED)
+    assert json.loads(compact) == DATAFORMAT2_DECODED
+    assert len(compact) < len(payload)
+
+
+@pytest.mark.parametrize("encoding, module, loads", [("msgpack", "msgpack", "unpackb"), ("cbor", "cbor2", "loads")])
+def test_binary(encoding, module, loads):
+    loads = getattr(pytest.importorskip(module), loads)
+    encoder = Encoder(encoding)
+    payload, _ = encoder.encode(DATAFORMAT2_DECODED)
+    assert loads(payload) == DATAFORMAT2_DECODED
+    assert len(payload) < len(json.dumps(DATAFORMAT2_DECODED))
+
+
+def test_compress_above():
+    """Test : only payloads over the threshold are compressed"""
+    encoder = Encoder("json_compact", "zlib", compress_above=100)
+    payload, content_encoding = encoder.encode(DATAFORMAT2_DECODED)
+    assert content_encoding == "deflate"
+    assert json.loads(zlib.decompress(payload)) == DATAFORMAT2_DECODED
+
+    assert encoder.encode({"small": 1}) == (b'{"small":1}', None)
+    stats = encoder.stats()
+    assert stats["encoded"] == 2 and stats["compressed"] == 1
+    assert stats["wire_bytes"] < stats["raw_bytes"]
+
+
+def test_zstd():
+    zstandard = pytest.importorskip("zstandard")
+    payload, content_encoding = Encoder(compression="zstd", compress_above=0).encode(DATAFORMAT2_DECODED)
+    assert content_encoding == "zstd"
+    assert json.loads(zstandard.ZstdDecompressor().decompress(payload)) == DATAFORMAT2_DECODED
+
+
+def test_invalid(monkeypatch):
+    with pytest.raises(ValueError):
+        Encoder("xml")
+    with pytest.raises(ValueError):
+        Encoder(compression="gzip")
+
+    monkeypatch.setitem(lib.encoding.OPTIONAL_PACKAGES, "msgpack", ("msgpack", None))
+    with pytest.raises(ValueError, match="msgpack package"):
+        Encoder("msgpack")
@@ -0,0 +1,208 @@
+import threading
+
+import pytest
+from lib.frame_buffer import FrameBuffer, PendingFrame
+from lib.schemas import FrameLimitExceeded
+
+from tests.static import FRAME_EXAMPLE
+
+
+def make_frame(devEUI: str, received_time: float = 10):
+    return {**FRAME_EXAMPLE, "devEUI": devEUI, "received_time": received_time}
+
+
+def test_append_pop():
+    buffer = FrameBuffer(shard_count=4)
+
+    assert buffer.append(make_frame("CAFE")) == 1
+    assert buffer.append(make_frame("CAFE")) == 2
+    assert "CAFE" in buffer
+    assert len(buffer) == 1
+
+    frame_list = buffer.pop("CAFE")
+    assert frame_list is not None and len(frame_list) == 2
+    assert "CAFE" not in buffer
+    assert buffer.pop("CAFE") is None
+
+
+def test_sweep():
+    buffer = FrameBuffer(shard_count=4)
+    for i in range(20):
+        buffer.append(make_frame(f"DEV{i}", received_time=i))
+
+    deleted = buffer.sweep(lambda devEUI, pending: pending.last_time < 10)
+
+    assert sorted(deleted) == sorted(f"DEV{i}" for i in range(10))
+    assert len(buffer) == 10
+
+
+def test_expire():
+    buffer = FrameBuffer(shard_count=4)
+    for i in range(20):
+        buffer.append(make_frame(f"DEV{i}", received_time=i))
+
+    assert buffer.oldest_fragment_time() == 0
+    deleted = buffer.expire(older_than=10)
+
+    assert sorted(deleted) == sorted(f"DEV{i}" for i in range(10))
+    assert len(buffer) == 10
+    assert buffer.oldest_fragment_time() == 10
+
+
+def test_expire_uses_last_fragment():
+    buffer = FrameBuffer(shard_count=4)
+    buffer.append(make_frame("CAFE", received_time=1))
+    buffer.append(make_frame("CAFE", received_time=20))
+
+    # First fragment is old, but the device is still fresh
+    assert buffer.expire(older_than=10) == []
+    assert "CAFE" in buffer
+
+    # Device reassembled, then a new frame started : stale entry must not delete it
+    buffer.pop("CAFE")
+    buffer.append(make_frame("CAFE", received_time=30))
+    assert buffer.expire(older_than=25) == []
+    assert "CAFE" in buffer
+
+
+def test_expire_heap_compaction():
+    buffer = FrameBuffer(shard_count=1)
+    for i in range(1000):
+        buffer.append(make_frame("CAFE", received_time=i))
+        buffer.pop("CAFE")
+
+    assert len(buffer._shards[0].deadlines) < 100
+
+
+def test_snapshot_is_a_copy():
+    buffer = FrameBuffer(shard_count=4)
+    buffer.append(make_frame("CAFE"))
+
+    snapshot = buffer.snapshot()
+    buffer.append(make_frame("CAFE"))
+
+    assert len(snapshot["CAFE"]) == 1
+    assert len(buffer["CAFE"]) == 2
+
+
+def test_pending_frame():
+    pending = PendingFrame()
+    pending.add(b"\x01\x02", 10)
+    pending.add(b"\x03", 20)
+
+    assert len(pending) == 2
+    assert pending.last_time == 20
+    assert pending.fragments() == [b"\x01\x02", b"\x03"]
+    assert pending.payload() == b"\x01\x02\x03"
+
+
+def test_concurrent_append():
+    buffer = FrameBuffer(shard_count=8)
+    THREAD_COUNT, FRAME_NUMBER = 8, 500
+
+    def spam(thread_id):
+        for i in range(FRAME_NUMBER):
+            buffer.append(make_frame(f"DEV{i}"))
+
+    threads = [threading.Thread(target=spam, args=(i,)) for i in range(THREAD_COUNT)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert len(buffer) == FRAME_NUMBER
+    assert all(len(buffer[f"DEV{i}"]) == THREAD_COUNT for i in range(FRAME_NUMBER))
+
+
+def test_accounting():
+    buffer = FrameBuffer(shard_count=4)
+    buffer.append(make_frame("CAFE"))
+    buffer.append(make_frame("CAFE"))
+    buffer.append(make_frame("BB"))
+
+    assert buffer.pending_fragments == 3
+    assert buffer.pending_bytes == 3 * len(FRAME_EXAMPLE["raw"])
+
+    buffer.pop("CAFE")
+    buffer.expire(older_than=100)
+    assert buffer.pending_fragments == 0
+    assert buffer.pending_bytes == 0
+
+
+def test_no_budget_no_recency():
+    """Test : without budget, appends only touch their own shard, no recency order is kept"""
+    buffer = FrameBuffer(shard_count=4)
+    for i in range(20):
+        buffer.append(make_frame(f"DEV{i}"))
+
+    assert all(not shard.recent for shard in buffer._shards)
+    assert buffer.pending_fragments == 20
+    assert buffer.evicted == 0
+
+
+def test_concurrent_budget():
+    buffer = FrameBuffer(shard_count=8, max_fragments=100)
+    THREAD_COUNT, FRAME_NUMBER = 8, 500
+
+    def spam(thread_id):
+        for i in range(FRAME_NUMBER):
+            buffer.append(make_frame(f"DEV{thread_id}-{i}"))
+
+    threads = [threading.Thread(target=spam, args=(i,)) for i in range(THREAD_COUNT)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert buffer.pending_fragments <= 100
+    assert len(buffer) == buffer.pending_fragments
+    assert buffer.evicted == THREAD_COUNT * FRAME_NUMBER - len(buffer)
+    assert sum(len(shard.recent) for shard in buffer._shards) == len(buffer)
+
+
+def test_budget_evicts_least_recent():
+    buffer = FrameBuffer(shard_count=4, max_fragments=3)
+    buffer.append(make_frame("A"))
+    buffer.append(make_frame("B"))
+    buffer.append(make_frame("C"))
+    buffer.append(make_frame("A")) # A is now the most recent
+
+    assert "B" not in buffer
+    assert "A" in buffer and "C" in buffer
+    assert buffer.evicted == 1
+    assert buffer.pending_fragments == 3
+
+
+def test_budget_bytes():
+    buffer = FrameBuffer(shard_count=4, max_bytes=10 * len(FRAME_EXAMPLE["raw"]))
+    for i in range(100):
+        buffer.append(make_frame(f"DEV{i}"))
+
+    assert len(buffer) == 10
+    assert buffer.evicted == 90
+    assert all(f"DEV{i}" in buffer for i in range(90, 100))
+
+
+def test_max_chunks_rejected_at_insert():
+    buffer = FrameBuffer(shard_count=4)
+    buffer.append(make_frame("CAFE"), max_chunks=2)
+    buffer.append(make_frame("CAFE"), max_chunks=2)
+
+    with pytest.raises(FrameLimitExceeded):
+        buffer.append(make_frame("CAFE"), max_chunks=2)
+
+    # Every pending fragment of the device is dropped
+    assert "CAFE" not in buffer
+    assert buffer.pending_fragments == 0
+
+
+def test_max_frame_bytes_rejected_at_insert():
+    size = len(FRAME_EXAMPLE["raw"])
+    buffer = FrameBuffer(shard_count=4)
+    buffer.append(make_frame("CAFE"), max_frame_bytes=2 * size)
+    buffer.append(make_frame("CAFE"), max_frame_bytes=2 * size)
+
+    with pytest.raises(FrameLimitExceeded):
+        buffer.append(make_frame("CAFE"), max_frame_bytes=2 * size)
+    assert "CAFE" not in buffer
+
+    # A single fragment bigger than the limit is never stored
+    with pytest.raises(FrameLimitExceeded):
+        buffer.append(make_frame("BB"), max_frame_bytes=size - 1)
+    assert "BB" not in buffer
@@ -0,0 +1,114 @@
+import sqlite3
+from unittest.mock import MagicMock
+
+import pytest
+from lib.frame_buffer import FrameBuffer
+from lib.frame_store import FrameStore
+
+from tests.static import FRAME_EXAMPLE, wait_until
+
+
+def make_frame(devEUI: str, raw: bytes, received_time: float = 10):
+    return {**FRAME_EXAMPLE, "devEUI": devEUI, "raw": raw, "received_time": received_time}
+
+
+def test_recover_after_restart(tmp_path):
+    path = str(tmp_path / "frames.db")
+
+    buffer = FrameBuffer()
+    store = FrameStore(path)
+    assert store.attach(buffer) == 0
+    buffer.append(make_frame("CAFE", b"\x01\x02", 10))
+    buffer.append(make_frame("CAFE", b"\x03", 20))
+    buffer.append(make_frame("BB", b"\x04", 30))
+    store.close()
+
+    recovered_buffer = FrameBuffer()
+    recovered_store = FrameStore(path)
+    assert recovered_store.attach(recovered_buffer) == 2
+    assert recovered_buffer["CAFE"].fragments() == [b"\x01\x02", b"\x03"]
+    assert recovered_buffer["CAFE"].last_time == 20
+    assert recovered_buffer.oldest_fragment_time() == 20
+    recovered_store.close()
+
+
+def test_reassembled_device_removed(tmp_path):
+    path = str(tmp_path / "frames.db")
+
+    buffer = FrameBuffer()
+    store = FrameStore(path)
+    store.attach(buffer)
+    buffer.append(make_frame("CAFE", b"\x01"))
+    assert store.flush() == 1
+
+    buffer.pop("CAFE")
+    assert store.flush() == 1
+    assert store.flush() == 0
+    store.close()
+
+    recovered_buffer = FrameBuffer()
+    FrameStore(path).attach(recovered_buffer)
+    assert "CAFE" not in recovered_buffer
+
+
+def test_background_flush(tmp_path):
+    path = str(tmp_path / "frames.db")
+
+    buffer = FrameBuffer()
+    store = FrameStore(path, sync_interval=0.05)
+    store.attach(buffer)
+    store.start()
+    buffer.append(make_frame("CAFE", b"\x01"))
+
+    reader = sqlite3.connect(path)
+    assert wait_until(lambda: reader.execute("SELECT COUNT(*) FROM pending").fetchone()[0] == 1)
+    reader.close()
+    store.close()
+
+
+def test_failed_flush_retried(tmp_path):
+    """Test : devices of a failed write are written by the next flush"""
+    path = str(tmp_path / "frames.db")
+
+    buffer = FrameBuffer()
+    store = FrameStore(path)
+    store.attach(buffer)
+    buffer.append(make_frame("CAFE", b"\x01"))
+    store.flush()
+    buffer.pop("CAFE")
+
+    db = store._db
+    store._db = MagicMock()
+    store._db.executemany.side_effect = sqlite3.OperationalError("disk I/O error")
+    with pytest.raises(sqlite3.OperationalError):
+        store.flush()
+    store._db = db
+    assert store.flush() == 1
+    store.close()
+
+    recovered_buffer = FrameBuffer()
+    FrameStore(path).attach(recovered_buffer)
+    assert "CAFE" not in recovered_buffer
+
+
+def test_not_recovered_deleted(tmp_path):
+    """Test : devices over max_chunks or evicted by the budget while loading are deleted from the store"""
+    path = str(tmp_path / "frames.db")
+
+    buffer = FrameBuffer()
+    store = FrameStore(path)
+    store.attach(buffer)
+    buffer.append(make_frame("AA", b"\x01", 10))
+    buffer.append(make_frame("BB", b"\x02", 20))
+    buffer.append(make_frame("BB", b"\x03", 20))
+    buffer.append(make_frame("CC", b"\x04", 30))
+    store.close()
+
+    recovered_buffer = FrameBuffer(max_fragments=1)
+    store = FrameStore(path)
+    assert store.attach(recovered_buffer, max_chunks=1) == 1
+    store.close()
+
+    reader = sqlite3.connect(path)
+    assert reader.execute("SELECT devEUI FROM pending").fetchall() == [(list(recovered_buffer)[0],)]
+    reader.close()
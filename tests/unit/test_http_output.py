@@ -0,0 +1,167 @@
+import json
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from lib.http_output import HttpOutput
+from lib.outbox import Outbox
+
+from tests.static import DATAFORMAT2_DECODED, wait_until
+
+
+class Endpoint(ThreadingHTTPServer):
+    """Local endpoint answering the queued statuses, then 200."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), EndpointHandler)
+        self.statuses: list[int] = []
+        self.received: list[dict] = []
+        self.content_types: list[str] = []
+        self.connections = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/api"
+
+
+class EndpointHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1 # type: ignore
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "deflate":
+            body = zlib.decompress(body)
+        server: Endpoint = self.server # type: ignore
+        status = server.statuses.pop(0) if server.statuses else 200
+        if status == 200:
+            server.received.append(json.loads(body))
+            server.content_types.append(self.headers["Content-Type"])
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def endpoint():
+    server = Endpoint()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_output(url: str, **settings) -> HttpOutput:
+    output = HttpOutput(url, backoff=0.01, **settings)
+    output.start()
+    return output
+
+
+def test_send_keep_alive(endpoint):
+    """Test : frames are sent on kept-alive connections, at most one per thread"""
+    output = make_output(endpoint.url, concurrency=2)
+    for _ in range(20):
+        output.submit("CAFE", DATAFORMAT2_DECODED)
+    output.stop(timeout=5)
+
+    assert len(endpoint.received) == 20
+    assert endpoint.received[0] == {"frame": DATAFORMAT2_DECODED}
+    assert endpoint.connections <= 2
+    assert output.stats()["sent"] == 20
+
+
+def test_retry_server_error(endpoint):
+    endpoint.statuses = [503, 500]
+    output = make_output(endpoint.url, concurrency=1)
+    output.submit("CAFE", DATAFORMAT2_DECODED)
+
+    assert wait_until(lambda: output.sent == 1)
+    assert output.retried == 2
+    assert output.failed == 0
+    output.stop()
+
+
+def test_no_retry_client_error(endpoint):
+    endpoint.statuses = [400]
+    output = make_output(endpoint.url, concurrency=1)
+    output.submit("CAFE", DATAFORMAT2_DECODED)
+
+    assert wait_until(lambda: output.failed == 1)
+    assert output.retried == 0
+    assert endpoint.received == []
+    output.stop()
+
+
+def test_unreachable(endpoint):
+    """Test : connection errors are retried, then the frame is given up"""
+    url = endpoint.url
+    endpoint.shutdown()
+    endpoint.server_close()
+
+    output = make_output(url, concurrency=1, retries=2, connect_timeout=0.5)
+    output.submit("CAFE", DATAFORMAT2_DECODED)
+
+    assert wait_until(lambda: output.failed == 1)
+    assert output.retried == 2
+    output.stop()
+
+
+def test_backoff():
+    output = HttpOutput("http://127.0.0.1", backoff=1, max_backoff=3)
+    assert 0.5 <= output.delay(1) <= 1
+    assert 1 <= output.delay(2) <= 2
+    assert 1.5 <= output.delay(5) <= 3
+
+
+def test_batches(endpoint):
+    """Test : frames are gathered in arrays, one request per batch"""
+    output = make_output(endpoint.url, concurrency=1, batch_size=10, batch_linger_ms=50)
+    for i in range(25):
+        output.submit(f"DEV{i}", DATAFORMAT2_DECODED)
+    output.stop(timeout=5)
+
+    assert [len(body) for body in endpoint.received] == [10, 10, 5]
+    assert endpoint.received[0][0] == {"devEUI": "DEV0", "frame": DATAFORMAT2_DECODED}
+    assert output.stats()["sent"] == 25
+    assert output.stats()["requests"] == 3
+
+
+def test_outbox(endpoint, tmp_path):
+    """Test : frames are stored while the endpoint fails, then sent again once it is back"""
+    endpoint.statuses = [503, 503, 503]
+    output = HttpOutput(endpoint.url, concurrency=1, retries=0, outbox=Outbox(str(tmp_path), max_bytes=100000, segment_bytes=20000))
+    output.drainer.retry_interval = 0.05 # type: ignore
+    output.start()
+    output.submit("A", DATAFORMAT2_DECODED)
+    assert wait_until(lambda: output.down)
+    output.submit("B", DATAFORMAT2_DECODED) # Straight to the outbox
+
+    assert wait_until(lambda: output.stats()["outbox"]["drained"] == 2)
+    assert output.stats()["outbox"]["pending"] == 0
+    assert output.stats()["outbox"]["stored"] == 2
+    assert not output.down
+    assert output.failed == 0
+    assert endpoint.received == [{"frame": DATAFORMAT2_DECODED}] * 2
+
+    output.submit("C", DATAFORMAT2_DECODED)
+    output.stop(timeout=5)
+    assert len(endpoint.received) == 3
+
+
+def test_encoding(endpoint):
+    """Test : bodies over the threshold are compressed, with the matching headers"""
+    output = make_output(endpoint.url, concurrency=1, encoding="json_compact", compression="zlib", compress_above=100)
+    output.submit("CAFE", DATAFORMAT2_DECODED)
+    output.stop(timeout=5)
+
+    assert endpoint.received == [{"frame": DATAFORMAT2_DECODED}]
+    assert endpoint.content_types == ["application/json"]
+    assert output.stats()["encoding"]["compressed"] == 1
@@ -0,0 +1,165 @@
+import os
+import signal
+import threading
+from concurrent.futures import Future
+
+import pytest
+from lib.js_fetcher import DEFAULT_MAX_WORKERS, JSWorkerPool, default_size, parse_result
+from lib.schemas import JSWorkerFail
+
+from tests.static import DATAFORMAT2_BYTES, DATAFORMAT2_DECODED, wait_until
+
+
+@pytest.fixture
+def js_pool():
+    pool = JSWorkerPool(2)
+    yield pool
+    pool.stop()
+
+
+def test_pool_decode(js_pool):
+    assert js_pool.decode(DATAFORMAT2_BYTES, 10) == DATAFORMAT2_DECODED
+
+
+def test_pool_least_outstanding(js_pool):
+    # First worker is busy : next call goes to the idle one
+    js_pool.workers[0]._pending[-1] = Future()
+    assert js_pool._pick() is js_pool.workers[1]
+    del js_pool.workers[0]._pending[-1]
+
+
+def test_pool_affinity(js_pool):
+    js_pool.dispatch = "affinity"
+    assert js_pool._pick("CAFE") is js_pool._pick("CAFE")
+
+
+def test_pool_decode_batch_affinity(js_pool, monkeypatch):
+    """Test : with affinity, a batch is split so each frame goes to the worker of its device"""
+    js_pool.dispatch = "affinity"
+    devEUIs = [f"DEV{i}" for i in range(8)]
+    calls = {id(worker): [] for worker in js_pool.workers}
+    for worker in js_pool.workers:
+        def call_batch(name, calls_args, worker=worker, call_batch=worker.call_batch):
+            calls[id(worker)].append(len(calls_args))
+            return call_batch(name, calls_args)
+        monkeypatch.setattr(worker, "call_batch", call_batch)
+
+    results = js_pool.decode_batch([DATAFORMAT2_BYTES] * len(devEUIs), 10, devEUIs)
+
+    assert results == [DATAFORMAT2_DECODED] * len(devEUIs)
+    for worker in js_pool.workers:
+        expected = sum(js_pool._pick(devEUI) is worker for devEUI in devEUIs)
+        assert sum(calls[id(worker)]) == expected
+
+
+def test_pool_concurrent_decode(js_pool):
+    results = []
+
+    def spam():
+        for _ in range(5):
+            results.append(js_pool.decode(DATAFORMAT2_BYTES, 10))
+
+    threads = [threading.Thread(target=spam) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert len(results) == 20
+    assert all(result == DATAFORMAT2_DECODED for result in results)
+    assert all(worker.outstanding == 0 for worker in js_pool.workers)
+
+
+def test_worker_many_in_flight(js_pool):
+    """Results are matched to their request even with many calls in flight on one worker"""
+    worker = js_pool.workers[0]
+    futures = [worker.call("te_decoder", DATAFORMAT2_BYTES, 10) for _ in range(20)]
+    futures.append(worker.call("unknown_function"))
+
+    assert all(parse_result(future.result(timeout=10)) == DATAFORMAT2_DECODED for future in futures[:-1])
+    with pytest.raises(JSWorkerFail):
+        parse_result(futures[-1].result(timeout=10))
+    assert worker.outstanding == 0
+
+
+def test_pool_decode_batch(js_pool):
+    results = js_pool.decode_batch([DATAFORMAT2_BYTES] * 10, 10)
+    assert results == [DATAFORMAT2_DECODED] * 10
+
+
+def test_worker_batch_single_message(js_pool):
+    worker = js_pool.workers[0]
+    future = worker.call_batch("te_decoder", [(DATAFORMAT2_BYTES, 10)] * 3)
+
+    results = future.result(timeout=10)
+    assert len(results) == 3
+
+
+def test_pool_decode_memoryview(js_pool):
+    """Reassembled frames are memoryview over the buffer"""
+    assert js_pool.decode(memoryview(bytearray(DATAFORMAT2_BYTES)), 10) == DATAFORMAT2_DECODED
+
+
+def test_pool_restarts_dead_worker(js_pool):
+    worker = js_pool.workers[0]
+    dead_pid = worker.process.pid
+    worker.process.kill()
+    worker.process.join()
+
+    assert js_pool.check(worker)
+    assert worker.process.pid != dead_pid
+    assert js_pool.crashes == 1
+    assert parse_result(worker.call("te_decoder", DATAFORMAT2_BYTES, 10).result(timeout=10)) == DATAFORMAT2_DECODED
+
+
+def test_pool_retries_calls_of_stuck_worker():
+    pool = JSWorkerPool(1, timeout=0.5, retries=1)
+    try:
+        worker = pool.workers[0]
+        os.kill(worker.process.pid, signal.SIGSTOP) # Frozen decoder
+        future = pool.submit(DATAFORMAT2_BYTES, 10)
+
+        # Watchdog restarts the worker and sends the call again to the new process
+        assert parse_result(future.result(timeout=10)) == DATAFORMAT2_DECODED
+        assert wait_until(lambda: pool.timeouts == 1 and pool.retried == 1)
+    finally:
+        pool.stop()
+
+
+def test_pool_fails_calls_out_of_retries():
+    pool = JSWorkerPool(1, timeout=0.5, retries=0)
+    try:
+        os.kill(pool.workers[0].process.pid, signal.SIGSTOP)
+        with pytest.raises(JSWorkerFail):
+            pool.decode(DATAFORMAT2_BYTES, 10)
+        assert wait_until(lambda: pool.failed == 1)
+
+        # New process is usable
+        assert pool.decode(DATAFORMAT2_BYTES, 10) == DATAFORMAT2_DECODED
+    finally:
+        pool.stop()
+
+
+def test_idle_worker_is_not_stuck(js_pool):
+    js_pool.workers[0].last_progress -= 3600
+    assert not js_pool.check(js_pool.workers[0])
+
+
+def test_pool_stats(js_pool):
+    js_pool.decode(DATAFORMAT2_BYTES, 10)
+    stats = js_pool.stats()
+    assert stats["latency"]["count"] == 1
+    assert stats["restarts"] == 0
+
+
+def test_pool_prewarm(js_pool):
+    assert js_pool.prewarm() >= 0
+    assert all(worker.outstanding == 0 for worker in js_pool.workers)
+
+
+def test_default_size(monkeypatch):
+    """Test : default worker count follows the CPUs this process may use, not the host cores"""
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: {0}, raising=False)
+    monkeypatch.setattr(os, "cpu_count", lambda: 64)
+    assert default_size() == 1
+
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(64)), raising=False)
+    assert default_size() == DEFAULT_MAX_WORKERS
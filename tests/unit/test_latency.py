@@ -0,0 +1,13 @@
+from lib.latency import LatencyHistogram
+
+
+def test_latency_histogram():
+    latency = LatencyHistogram(slo_ms=50)
+    for seconds in (0.002, 0.002, 0.03, 0.2):
+        latency.record(seconds)
+
+    stats = latency.stats()
+    assert stats["count"] == 4
+    assert stats["over_slo"] == 1
+    assert stats["p50_ms"] == 5
+    assert stats["p99_ms"] == 250
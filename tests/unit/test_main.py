@@ -2,16 +2,22 @@ import json
 import logging
 import threading
 import time
+import zlib
 from copy import deepcopy
 from unittest.mock import MagicMock
 
-import lib.js_fetcher
-
 # Project import
 import main
 import paho.mqtt.client as mqtt
 import pytest
+from starlette.responses import HTMLResponse
+from starlette.testclient import TestClient
+from lib.backpressure import Backpressure
+from lib.decode_cache import DecodeCache
+from lib.decoders import PythonBackend
+from lib.pipeline import Stage
 from lib.schemas import InvalidJSON
+from lib.validate_config import check_backpressure_watermarks, check_mqtt_input_scaling
 
 from tests.static import (
     DATAFORMAT2_BYTES,
@@ -29,7 +35,7 @@ class TestReassembleFrame:
     def test_reassemble(self, mock_frame_buffer):
         res = main.reassemble_frame("CAFE")  # return b'152...'
         assert res is not None
-        assert res.decode() == DATAFORMAT2_HEX
+        assert bytes(res).decode() == DATAFORMAT2_HEX
 
     def test_reassemble_no_frame(self):
         """Frame buffer is empty"""
@@ -40,24 +46,69 @@ class TestReassembleFrame:
 @pytest.mark.usefixtures("mock_config")
 class TestProcessFrame:
     @pytest.mark.mock_patch_reassemble(DATAFORMAT2_BYTES)
-    def test_process_frame_decoded(self, mock_patch_jsdecode, mock_patch_reassemble):
-        assert main.process_frame("CAFE") == DATAFORMAT2_DECODED
+    def test_process_frame_queued(self, mock_patch_reassemble):
+        assert main.process_frame("CAFE") == DATAFORMAT2_BYTES
+        assert main.decode_stage.qsize() == 1
 
     @pytest.mark.mock_patch_reassemble(None)
     def test_process_frame_empty(self, mock_patch_jsdecode, mock_patch_reassemble):
         assert main.process_frame("CAFE") == -1
+        assert main.decode_stage.qsize() == 0
+
+    def test_decode_frames(self, mock_patch_jsdecode):
+        results = main.decode_frames([("CAFE", DATAFORMAT2_BYTES), ("BB", DATAFORMAT2_BYTES)])
+        assert results == [DATAFORMAT2_DECODED, DATAFORMAT2_DECODED]
+        assert main.output_stage.qsize() == 2
+
+    def test_decode_frames_cache(self, monkeypatch, mock_patch_jsdecode):
+        """Second identical frame is served by the cache, not the JS worker"""
+        monkeypatch.setattr(main, "decode_cache", DecodeCache(10))
+
+        main.decode_frames([("CAFE", DATAFORMAT2_BYTES)])
+        assert main.decode_frames([("CAFE", DATAFORMAT2_BYTES), ("BB", DATAFORMAT2_BYTES)]) == [DATAFORMAT2_DECODED] * 2
+
+        assert main.js_pool.decode_batch.call_count == 1
+        assert main.decode_cache.stats()["hits"] == 2
+        assert main.output_stage.qsize() == 3
+
+    def test_decode_frames_native(self, monkeypatch, mock_patch_jsdecode):
+        """Frames known by an in-process decoder skip the JS worker, the others still go to it"""
+        monkeypatch.setattr(main, "native_decoders", PythonBackend())
+
+        results = main.decode_frames([("CAFE", DATAFORMAT2_BYTES), ("BB", b"\x00\x01")])
+        assert results == [DATAFORMAT2_DECODED, DATAFORMAT2_DECODED]
+        main.js_pool.decode_batch.assert_called_once_with([b"\x00\x01"], 10, ["BB"])
+        assert main.output_stage.qsize() == 2
+
+    def test_decode_frames_failure(self, monkeypatch):
+        """A frame failing to decode doesn't prevent the rest of the batch to be published"""
+        monkeypatch.setattr(main, "js_pool", MagicMock(decode_batch=MagicMock(return_value=[ValueError(), DATAFORMAT2_DECODED])))
+
+        main.decode_frames([("CAFE", DATAFORMAT2_BYTES), ("BB", DATAFORMAT2_BYTES)])
+        assert main.output_stage.qsize() == 1
+
+    def test_publish_frame(self, monkeypatch):
+        send_mqtt_message = MagicMock(return_value=True)
+        monkeypatch.setattr(main, "send_mqtt_message", send_mqtt_message)
+
+        main.publish_frame(("CAFE", DATAFORMAT2_DECODED))
+        send_mqtt_message.assert_called_once_with("CAFE", DATAFORMAT2_DECODED)
+
+    def test_publish_frame_http(self, monkeypatch):
+        """Test : decoded frames are queued to the HTTP output, not sent inline"""
+        http_output = MagicMock()
+        monkeypatch.setattr(main, "http_output", http_output)
+        main.config["output"]["mqtt"]["enable"] = False
+
+        main.publish_frame(("CAFE", DATAFORMAT2_DECODED))
+        http_output.submit.assert_called_once_with("CAFE", DATAFORMAT2_DECODED)
 
 
 @pytest.mark.usefixtures("mock_frame_buffer", "mock_config")
 class TestTimeoutChecker:
-    @pytest.mark.parametrize(
-        "dynamic_config",
-        [{"frame": {"max_chunks": 100, "timeout": 1, "lns": "ttn"}},
-          {"frame": {"max_chunks": 1, "timeout": 1000000000000, "lns": "ttn"}}],
-    )
-    def test_deletion(self, monkeypatch, dynamic_config):
-        """Test : deletion cuz timeout, cuz max chunk"""
-        main.config.update(dynamic_config)
+    def test_deletion(self, monkeypatch):
+        """Test : deletion cuz timeout"""
+        main.config.update({"frame": {"max_chunks": 100, "timeout": 1, "lns": "ttn"}})
 
         monkeypatch.setattr(time, "sleep", MagicMock(return_value=None))
 
@@ -87,6 +138,22 @@ class TestTimeoutChecker:
 
         assert "CAFE" in main.frame_buffer
 
+    def test_next_check(self, monkeypatch):
+        """Test : checker wakes up when the oldest device is due, not a full interval later"""
+        main.config.update({"frame": {"max_chunks": 10, "timeout": 1, "lns": "ttn"}})
+
+        # Oldest pending fragment received at t=10, due at t=3610
+        monkeypatch.setattr(time, "time", MagicMock(return_value=3605))
+        assert main.next_timeout_check() == 5
+
+        monkeypatch.setattr(time, "time", MagicMock(return_value=4000))
+        assert main.next_timeout_check() == 0
+
+    def test_next_check_empty(self):
+        """Test : empty buffer, checker waits a full interval"""
+        main.frame_buffer.clear()
+        assert main.next_timeout_check() == main.TIMEOUT_CHECK_INTERVAL
+
 
 @pytest.mark.usefixtures("mock_config")
 class TestMQTTInput:
@@ -103,14 +170,14 @@ class TestMQTTInput:
         """Test : Received MQTT JSON is a known frame"""
 
         monkeypatch.setattr(json, "loads", MagicMock(return_value=1))
-        monkeypatch.setattr(main, "parse_ttn", MagicMock(return_value=FRAME_EXAMPLE))
+        monkeypatch.setattr(main, "lns_parser", MagicMock(return_value=FRAME_EXAMPLE))
 
         mess = mqtt.MQTTMessage(topic=b"input")
         mess.payload = b"whateverformat"  # function is patched anyway
 
         assert FRAME_EXAMPLE["devEUI"] not in main.frame_buffer
 
-        main.on_mqtt_message(None, None, mess)
+        main.ingest_mqtt_message(mess)
 
         assert FRAME_EXAMPLE["devEUI"] in main.frame_buffer
 
@@ -120,34 +187,283 @@ class TestMQTTInput:
         monkeypatch.setattr(json, "loads", MagicMock(return_value=1))
         wrong_fport = FRAME_EXAMPLE
         wrong_fport["fPort"] = 1
-        monkeypatch.setattr(main, "parse_ttn", MagicMock(return_value=wrong_fport))
+        monkeypatch.setattr(main, "lns_parser", MagicMock(return_value=wrong_fport))
 
         mess = mqtt.MQTTMessage(topic=b"input")
         mess.payload = b"whateverformat"
 
         assert FRAME_EXAMPLE["devEUI"] not in main.frame_buffer
 
-        main.on_mqtt_message(None, None, mess)
+        main.ingest_mqtt_message(mess)
 
         assert FRAME_EXAMPLE["devEUI"] not in main.frame_buffer
 
+    def test_mqtt_input_max_chunk(self, monkeypatch):
+        """Test : pending fragments are flushed as soon as max chunk is exceeded"""
+
+        main.config["frame"]["max_chunks"] = 1
+        monkeypatch.setattr(json, "loads", MagicMock(return_value=1))
+        monkeypatch.setattr(main, "lns_parser", MagicMock(side_effect=lambda chunk: {**FRAME_EXAMPLE, "fPort": main.FRAGMENT_FPORT}))
+
+        mess = mqtt.MQTTMessage(topic=b"input")
+        mess.payload = b"whateverformat"
+
+        main.ingest_mqtt_message(mess)
+        assert FRAME_EXAMPLE["devEUI"] in main.frame_buffer
+
+        main.ingest_mqtt_message(mess)
+        assert FRAME_EXAMPLE["devEUI"] not in main.frame_buffer
+
+    def test_mqtt_input_other_partition(self, monkeypatch):
+        """Test : uplinks of devices out of this instance partition are skipped"""
+
+        monkeypatch.setattr(json, "loads", MagicMock(return_value=1))
+        monkeypatch.setattr(main, "lns_parser", MagicMock(return_value={**FRAME_EXAMPLE, "fPort": main.FRAGMENT_FPORT}))
+        index = zlib.crc32(FRAME_EXAMPLE["devEUI"].lower().encode()) % 2
+        main.config["input"]["mqtt"]["partition"] = {"count": 2, "index": 1 - index}
+        skipped = main.partition_skipped
+
+        mess = mqtt.MQTTMessage(topic=b"input")
+        mess.payload = b"whateverformat"
+        main.ingest_mqtt_message(mess)
+
+        assert FRAME_EXAMPLE["devEUI"] not in main.frame_buffer
+        assert main.partition_skipped == skipped + 1
+
+        main.config["input"]["mqtt"]["partition"]["index"] = index
+        main.ingest_mqtt_message(mess)
+        assert FRAME_EXAMPLE["devEUI"] in main.frame_buffer
+
+    def test_mqtt_input_prefiltered(self, monkeypatch):
+        """Test : uplinks that are not fragments are dropped before json.loads"""
+
+        uplink = json.load(open("payload/payload_ttn_fragment1.json"))
+        loads = MagicMock(side_effect=json.loads)
+        monkeypatch.setattr(json, "loads", loads)
+        prefiltered = main.prefiltered
+
+        mess = mqtt.MQTTMessage(topic=b"input")
+        uplink["uplink_message"]["f_port"] = 10
+        mess.payload = json.dumps(uplink).encode()
+        main.ingest_mqtt_message(mess)
+
+        assert main.prefiltered == prefiltered + 1
+        loads.assert_not_called()
+
+        uplink["uplink_message"]["f_port"] = main.FRAGMENT_FPORT
+        mess.payload = json.dumps(uplink).encode()
+        main.ingest_mqtt_message(mess)
+
+        assert uplink["end_device_ids"]["dev_eui"] in main.frame_buffer
+
+    def test_mqtt_input_prefilter_partition(self, monkeypatch):
+        """Test : with a partition, the DevEUI found by the prefilter skips other devices before json.loads"""
+
+        uplink = json.load(open("payload/payload_ttn_fragment1.json"))
+        loads = MagicMock(side_effect=json.loads)
+        monkeypatch.setattr(json, "loads", loads)
+        devEUI = uplink["end_device_ids"]["dev_eui"]
+        main.config["input"]["mqtt"]["partition"] = {"count": 2, "index": 1 - zlib.crc32(devEUI.lower().encode()) % 2}
+
+        mess = mqtt.MQTTMessage(topic=b"input")
+        mess.payload = json.dumps(uplink).encode()
+        main.ingest_mqtt_message(mess)
+
+        assert devEUI not in main.frame_buffer
+        loads.assert_not_called()
+
+    def test_partition_spread(self):
+        """Test : every device belongs to exactly one partition, whatever the DevEUI case"""
+
+        main.config["input"]["mqtt"]["partition"] = {"count": 3, "index": 0}
+        devices = [f"{i:016X}" for i in range(300)]
+        owners = {}
+        for index in range(3):
+            main.config["input"]["mqtt"]["partition"]["index"] = index
+            for devEUI in devices:
+                if main.in_partition(devEUI):
+                    assert main.in_partition(devEUI.lower())
+                    owners.setdefault(devEUI, []).append(index)
+
+        assert all(len(owners[devEUI]) == 1 for devEUI in devices)
+        assert {owner[0] for owner in owners.values()} == {0, 1, 2}
+
+    def test_input_topic(self):
+        """Test : shared subscription topic only when a group is configured"""
+
+        assert main.get_input_topic() == "input"
+        main.config["input"]["mqtt"]["shared_group"] = "weavers"
+        assert main.get_input_topic() == "$share/weavers/input"
+
+    def test_mqtt_callback_only_queues(self):
+        """Test : paho callback hands the message to the ingest stage without parsing it"""
+
+        mess = mqtt.MQTTMessage(topic=b"input")
+        mess.payload = b"whateverformat"
+
+        main.on_mqtt_message(None, None, mess)
+
+        assert main.ingest_stage.qsize() == 1
+
+    def test_ingest_key(self, monkeypatch):
+        """Test : messages are spread on ingest workers by DevEUI, even all on the same topic (Loriot)"""
+        monkeypatch.setitem(main.config["frame"], "lns", "loriot")
+        main.init_lns()
+        uplink = json.load(open("payload/payload_loriot_fragment1.json"))
+
+        mess = mqtt.MQTTMessage(topic=b"input")
+        mess.payload = json.dumps(uplink).encode()
+        assert main.ingest_key(mess) == uplink["EUI"].upper()
+
+        mess.payload = b"whateverformat"
+        assert main.ingest_key(mess) == "input"
+
+    @pytest.mark.parametrize("high", [None, 10])
+    def test_on_mqtt_message_queue_full(self, monkeypatch, high):
+
+        """Test : with or without backpressure, paho thread is never blocked, uplinks are dropped when their ingest queue is full"""
+        backpressure = None if high is None else Backpressure(lambda: main.get_backlog(), high=high, low=2, pause=main.pause_mqtt_input, resume=main.resume_mqtt_input)
+        monkeypatch.setattr(main, "backpressure", backpressure)
+        monkeypatch.setattr(main, "ingest_stage", Stage("ingest", main.ingest_mqtt_message, depth=1))
+        monkeypatch.setattr(main, "ingest_dropped", 0)
+        mess = mqtt.MQTTMessage(topic=b"input")
+
+        main.on_mqtt_message(None, None, mess)
+        main.on_mqtt_message(None, None, mess)
+
+        assert main.ingest_stage.qsize() == 1
+        assert main.ingest_dropped == 1
+
 
 @pytest.mark.usefixtures("mock_config")
-class TestFlaskApp:
+class TestBackpressure:
+    @pytest.fixture(autouse=True)
+    def paused_backpressure(self, monkeypatch):
+        backpressure = Backpressure(lambda: main.get_backlog(), high=10, low=2, pause=main.pause_mqtt_input, resume=main.resume_mqtt_input)
+        monkeypatch.setattr(main, "backpressure", backpressure)
+        monkeypatch.setattr(main, "deferred_acks", [])
+        return backpressure
+
+    def qos1_message(self, mid: int) -> mqtt.MQTTMessage:
+        mess = mqtt.MQTTMessage(mid=mid, topic=b"input")
+        mess.qos = 1
+        return mess
+
+    def test_ack_when_not_paused(self):
+        client = MagicMock()
+        main.on_mqtt_message(client, None, self.qos1_message(1))
+
+        client.ack.assert_called_once_with(1, 1)
+        assert main.ingest_stage.qsize() == 1
+
+    def test_acks_held_while_paused(self, paused_backpressure, monkeypatch):
+        """Test : QoS 1 messages are still queued while paused, their acks are sent once resumed"""
+        client = MagicMock()
+        monkeypatch.setattr(main, "get_backlog", MagicMock(return_value=11))
+        assert paused_backpressure.check()
+
+        for mid in (1, 2):
+            main.on_mqtt_message(client, None, self.qos1_message(mid))
+        assert main.ingest_stage.qsize() == 2
+        client.ack.assert_not_called()
+
+        main.get_backlog.return_value = 0
+        assert not paused_backpressure.check()
+        assert [call.args for call in client.ack.call_args_list] == [(1, 1), (2, 1)]
+        assert main.deferred_acks == []
+
+    def test_qos0_unsubscribes(self, monkeypatch):
+        client = MagicMock()
+        monkeypatch.setattr(main, "mqtt_input_clients", [client])
+
+        main.pause_mqtt_input()
+        client.unsubscribe.assert_called_once_with("input")
+        main.resume_mqtt_input()
+        client.subscribe.assert_called_once_with("input", qos=0)
+
+    def test_backlog(self):
+        main.ingest_stage.submit(1)
+        main.output_stage.submit(2)
+        assert main.get_backlog() == 2
+
+
+@pytest.mark.usefixtures("mock_config")
+class TestHttpApp:
     def test_monitor_page_mocked(self, monkeypatch):
         """Test : Check that monitor page return something"""
 
         HTML_EXPECTED_VALUE = "test_html"
         monkeypatch.setattr(
-            main, "render_template", MagicMock(return_value=HTML_EXPECTED_VALUE)
+            main, "templates", MagicMock(TemplateResponse=MagicMock(return_value=HTMLResponse(HTML_EXPECTED_VALUE)))
         )
 
-        client = main.flask_app.test_client()
+        client = TestClient(main.http_app)
 
         res = client.get("/monitor")
         assert res.status_code == 200
         assert res.text == HTML_EXPECTED_VALUE
 
+    def test_stats(self):
+        """Test : Check that stats expose pipeline queue depths"""
+
+        main.decode_stage.submit(("CAFE", DATAFORMAT2_BYTES))
+        client = TestClient(main.http_app)
+
+        res = client.get("/stats")
+        assert res.status_code == 200
+        assert res.json()["pipeline"]["decode"]["depth"] == 1
+
+
+    def test_ready(self):
+        """Test : readiness probe follows the ready event"""
+        client = TestClient(main.http_app)
+        assert client.get("/ready").status_code == 503
+
+        main.ready_event.set()
+        try:
+            assert client.get("/ready").status_code == 200
+        finally:
+            main.ready_event.clear()
+
+
+class TestHttpInput:
+    fragment = json.load(open("payload/payload_ttn_fragment1.json"))
+    last = json.load(open("payload/payload_ttn_fragment_last.json"))
+
+    @pytest.fixture(autouse=True)
+    def http_enabled(self, mock_config):
+        main.config["input"]["http"]["enable"] = True
+
+    def test_single_uplink(self):
+        res = TestClient(main.http_app).post("/input", json=self.fragment)
+
+        assert res.status_code == 200
+        assert res.json()["results"] == [{"status": "fragment", "devEUI": self.fragment["end_device_ids"]["dev_eui"]}]
+        assert self.fragment["end_device_ids"]["dev_eui"] in main.frame_buffer
+
+    def test_bulk_uplinks(self):
+        """Test : fragments of one array are reassembled in order, each uplink gets its status"""
+        res = TestClient(main.http_app).post("/input", json=[self.fragment, {"not": "an uplink"}, self.last])
+
+        assert res.status_code == 200
+        assert res.json()["received"] == 3
+        assert [result["status"] for result in res.json()["results"]] == ["fragment", "invalid", "complete"]
+        assert main.decode_stage.qsize() == 1
+
+    def test_not_json(self):
+        res = TestClient(main.http_app).post("/input", content=b"not json")
+        assert res.status_code == 400
+
+    def test_too_many_uplinks(self):
+        main.config["input"]["http"]["max_uplinks"] = 2
+        res = TestClient(main.http_app).post("/input", json=[self.fragment] * 3)
+        assert res.status_code == 413
+
+    def test_disabled(self):
+        main.config["input"]["http"]["enable"] = False
+        res = TestClient(main.http_app).post("/input", json=self.fragment)
+        assert res.status_code == 404
+
 
 class TestLoadConfig:
     def test_load_config_ok(self, monkeypatch):
@@ -182,22 +498,18 @@ def test_init_logging(mock_config, dynamic_config):
 
 
 def test_init_javascript(mock_config):
-    """Check that JS Worker is properly started"""
+    """Check that JS Worker pool is properly started"""
 
     # Cleaning
-    main.js_worker_process, main.task_queue, main.result_queue = None, None, None
+    main.js_pool = None
+    main.config["decoder"] = {"workers": 2}
 
-    assert (main.js_worker_process, main.task_queue, main.result_queue) == (
-        None,
-        None,
-        None,
-    )
     main.init_javascript()
 
-    assert main.js_worker_process is not None
-    assert main.task_queue is not None
-    assert main.result_queue is not None
-    lib.js_fetcher.stop_js_worker(main.task_queue, main.js_worker_process)
+    assert main.js_pool is not None
+    assert len(main.js_pool.workers) == 2
+    assert all(worker.process.is_alive() for worker in main.js_pool.workers)
+    main.js_pool.stop()
 
 
 class TestInitSelfBroker:
@@ -231,6 +543,35 @@ class TestInitInput:
             main.init_input()
 
 
+class TestInputScalingConfig:
+    def test_connections_need_group(self):
+        """Several connections without shared group would each receive every uplink"""
+
+        config = deepcopy(EXAMPLE_CONFIG)
+        config["input"]["mqtt"]["connections"] = 4
+        assert not check_mqtt_input_scaling(config)
+
+        config["input"]["mqtt"]["shared_group"] = "weavers"
+        assert check_mqtt_input_scaling(config)
+
+    def test_partition_index(self):
+        config = deepcopy(EXAMPLE_CONFIG)
+        config["input"]["mqtt"]["partition"] = {"count": 2, "index": 2}
+        assert not check_mqtt_input_scaling(config)
+
+        config["input"]["mqtt"]["partition"]["index"] = 1
+        assert check_mqtt_input_scaling(config)
+
+    def test_backpressure_ingest_depth(self):
+        """Check that input is paused before an ingest worker queue can be full"""
+        config = deepcopy(EXAMPLE_CONFIG)
+        config["backpressure"] = {"high_watermark": 10000, "low_watermark": 100}
+        assert not check_backpressure_watermarks(config) # Default pipeline.ingest.depth
+
+        config["pipeline"] = {"ingest": {"depth": 20000}}
+        assert check_backpressure_watermarks(config)
+
+
 @pytest.mark.usefixtures("mock_config")
 class TestInitOutput:
     def test_init_output(self):
@@ -242,6 +583,22 @@ class TestInitOutput:
         with pytest.raises(SystemExit):
             main.init_output()
 
+    def test_init_output_http(self, monkeypatch):
+        """Check that HTTP output is started with its settings."""
+
+        monkeypatch.setattr(main, "http_output", None)
+        main.config["output"]["mqtt"]["enable"] = False
+        main.config["output"]["http"].update({"enable": True, "concurrency": 3, "retries": 1})
+
+        main.init_output()
+        try:
+            assert main.http_output is not None
+            assert main.http_output.url == "http://example.com"
+            assert main.http_output.stats()["concurrency"] == 3
+            assert main.http_output.retries == 1
+        finally:
+            main.http_output.stop() # type: ignore
+
     def test_init_output_mqtt_noconnection(self):
         """Check that mqtt output cannot connect."""
 
@@ -0,0 +1,110 @@
+import json
+from unittest.mock import MagicMock
+
+import paho.mqtt.client as mqtt
+import pytest
+from lib.mqtt_output import MqttOutput
+from lib.outbox import Outbox
+
+from tests.static import DATAFORMAT2_DECODED, wait_until
+
+
+def test_connect():
+    """Test : limits are set on the client, and the network thread started once connected"""
+    output = MqttOutput("localhost", 1883, "output", max_inflight=5, max_queued=50)
+    output.client.connect = MagicMock(return_value=mqtt.MQTT_ERR_SUCCESS)
+    output.client.loop_start = MagicMock()
+    output.connect()
+
+    output.client.loop_start.assert_called_once()
+    assert output.client._max_inflight_messages == 5
+    assert output.client._max_queued_messages == 50
+
+
+def test_connect_refused():
+    output = MqttOutput("localhost", 1883, "output")
+    output.client.connect = MagicMock(return_value=mqtt.MQTT_ERR_NO_CONN)
+    output.client.loop_start = MagicMock()
+
+    with pytest.raises(ConnectionError):
+        output.connect()
+    output.client.loop_start.assert_not_called()
+
+
+def test_queued_while_disconnected():
+    """Test : QoS 1 messages are kept while disconnected, QoS 0 ones are dropped"""
+    output = MqttOutput("localhost", 1883, "output", qos=1)
+    assert output.submit("CAFE", DATAFORMAT2_DECODED)
+    assert output.pending() == 1
+
+    output = MqttOutput("localhost", 1883, "output", qos=0)
+    assert not output.submit("CAFE", DATAFORMAT2_DECODED)
+    assert output.stats()["dropped"] == 1
+
+
+def test_queue_full():
+    """Test : publishing waits while paho queue is full, and gives up once stopping"""
+    output = MqttOutput("localhost", 1883, "output", qos=1, max_queued=2)
+    assert output.submit("CAFE", DATAFORMAT2_DECODED)
+    assert output.submit("CAFE", DATAFORMAT2_DECODED)
+
+    output._stop_event.set()
+    assert not output.submit("CAFE", DATAFORMAT2_DECODED)
+    assert output.stats()["dropped"] == 1
+    assert output.pending() == 2
+
+
+def test_ack_latency():
+    output = MqttOutput("localhost", 1883, "output", qos=1)
+    output.submit("CAFE", DATAFORMAT2_DECODED)
+    mid = next(iter(output._published))
+
+    output._on_publish(output.client, None, mid, None, None)
+
+    assert output.pending() == 0
+    assert output.latency.stats()["count"] == 1
+
+
+def test_ack_before_publish_returns(monkeypatch):
+    """Test : an ack handled by the network thread before publish() returns is still matched"""
+    output = MqttOutput("localhost", 1883, "output", qos=1)
+
+    def publish(topic, payload, qos):
+        output._on_publish(output.client, None, 7, None, None)
+        return mqtt.MQTTMessageInfo(7)
+    monkeypatch.setattr(output.client, "publish", publish)
+
+    assert output.submit("CAFE", DATAFORMAT2_DECODED)
+    assert output.pending() == 0
+    assert output.latency.stats()["count"] == 1
+
+
+def test_batches():
+    """Test : frames are published as JSON arrays on the topic itself"""
+    output = MqttOutput("localhost", 1883, "output", qos=1, batch_size=3, batch_linger_ms=50)
+    output.publish = MagicMock(return_value=True)
+    output.batches.start() # type: ignore
+    for devEUI in ("A", "B", "C", "D"):
+        assert output.submit(devEUI, DATAFORMAT2_DECODED)
+
+    assert wait_until(lambda: output.publish.call_count == 2) # type: ignore
+    output.batches.stop() # type: ignore
+    topic, payload = output.publish.call_args_list[0].args # type: ignore
+    assert topic == "output"
+    assert [item["devEUI"] for item in json.loads(payload)] == ["A", "B", "C"]
+    assert json.loads(payload)[0]["frame"] == DATAFORMAT2_DECODED
+
+
+def test_outbox(tmp_path):
+    """Test : frames submitted while disconnected are stored, then published once connected"""
+    output = MqttOutput("localhost", 1883, "output", qos=0, outbox=Outbox(str(tmp_path), max_bytes=100000, segment_bytes=20000))
+    assert output.submit("CAFE", DATAFORMAT2_DECODED)
+    assert output.stats()["outbox"]["pending"] == 1
+    assert output.drainer.drain_once() == output.drainer.retry_interval # type: ignore
+
+    output.client.is_connected = MagicMock(return_value=True)
+    output.publish = MagicMock(return_value=True)
+    output.drainer.drain_once() # type: ignore
+    output.publish.assert_called_once_with("output/CAFE", json.dumps(DATAFORMAT2_DECODED).encode())
+    assert output.stats()["outbox"]["pending"] == 0
+    assert output.stats()["dropped"] == 0
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+from lib.outbox import Drainer, Outbox, decode_frame, encode_frame
+
+from tests.static import DATAFORMAT2_DECODED
+
+
+def records(count: int, size: int = 10) -> list[bytes]:
+    return [f"{i:0{size}d}".encode() for i in range(count)]
+
+
+def test_read_commit(tmp_path):
+    outbox = Outbox(str(tmp_path), max_bytes=1000, segment_bytes=100)
+    for record in records(20):
+        assert outbox.append(record)
+    assert outbox.pending == 20
+    assert outbox.stats()["segments"] > 1
+
+    assert outbox.read(3) == records(3)
+    assert outbox.read(3) == records(3) # Not consumed until committed
+    outbox.commit(3)
+    assert outbox.pending == 17
+
+    # Reading across segments
+    assert outbox.read(15) == records(20)[3:18]
+    outbox.commit(15)
+    assert outbox.read(10) == records(20)[18:]
+    outbox.commit(2)
+    assert outbox.pending == 0
+    assert outbox.read(1) == []
+    assert outbox.stats()["segments"] == 1 # Segments read are deleted
+    outbox.close()
+
+
+def test_recover_after_restart(tmp_path):
+    outbox = Outbox(str(tmp_path), max_bytes=1000, segment_bytes=100)
+    for record in records(20):
+        outbox.append(record)
+    outbox.read(12)
+    outbox.commit(12)
+    outbox.close()
+
+    outbox = Outbox(str(tmp_path), max_bytes=1000, segment_bytes=100)
+    assert outbox.pending == 8
+    assert outbox.read(100) == records(20)[12:]
+    outbox.append(b"new")
+    assert outbox.read(100)[-1] == b"new"
+    outbox.close()
+
+
+def test_torn_write(tmp_path):
+    """Test : a record partly written before a crash is cut, the ones before are kept"""
+    outbox = Outbox(str(tmp_path), max_bytes=1000, segment_bytes=500)
+    for record in records(3):
+        outbox.append(record)
+    outbox.close()
+    segment = os.path.join(tmp_path, sorted(os.listdir(tmp_path))[0])
+    with open(segment, "ab") as file:
+        file.write(b"\x00\x00\x00\x10\x12\x34") # Header of a record never written
+
+    outbox = Outbox(str(tmp_path), max_bytes=1000, segment_bytes=500)
+    assert outbox.pending == 3
+    outbox.append(b"next")
+    assert outbox.read(10) == records(3) + [b"next"]
+    outbox.close()
+
+
+def test_drop_oldest(tmp_path):
+    outbox = Outbox(str(tmp_path), max_bytes=200, segment_bytes=100) # 5 records of 18 bytes per segment
+    for record in records(30):
+        assert outbox.append(record)
+
+    stats = outbox.stats()
+    assert stats["disk_bytes"] <= 200
+    assert stats["dropped"] > 0
+    assert stats["pending"] == 30 - stats["dropped"]
+    assert outbox.read(100) == records(30)[stats["dropped"]:]
+    outbox.close()
+
+
+def test_drop_newest(tmp_path):
+    outbox = Outbox(str(tmp_path), max_bytes=200, segment_bytes=100, drop_policy="newest")
+    appended = [record for record in records(30) if outbox.append(record)]
+
+    assert outbox.stats()["dropped"] == 30 - len(appended)
+    assert outbox.read(100) == records(30)[:len(appended)]
+    outbox.close()
+
+
+def test_invalid_settings(tmp_path):
+    with pytest.raises(ValueError):
+        Outbox(str(tmp_path), drop_policy="random")
+    with pytest.raises(ValueError):
+        Outbox(str(tmp_path), max_bytes=100, segment_bytes=100)
+
+
+def test_drainer(tmp_path):
+    """Test : frames are committed as far as they were delivered, the output being retried later"""
+    outbox = Outbox(str(tmp_path), max_bytes=100000, segment_bytes=20000)
+    for devEUI in ("A", "B", "C"):
+        outbox.append(encode_frame(devEUI, DATAFORMAT2_DECODED))
+    delivered = []
+
+    def send(items):
+        if delivered: # Output goes down after the first frame
+            return 0
+        delivered.append(items[0])
+        return 1
+
+    drainer = Drainer(outbox, send, rate=100, batch_size=10, retry_interval=5)
+    assert drainer.drain_once() == 5
+    assert drainer.drain_once() == 5
+    assert delivered == [("A", DATAFORMAT2_DECODED)]
+    assert outbox.pending == 2
+    assert decode_frame(outbox.read(1)[0]) == ("B", DATAFORMAT2_DECODED)
+    outbox.close()
@@ -0,0 +1,96 @@
+import threading
+
+from lib.pipeline import Stage
+
+from tests.static import wait_until
+
+
+def test_stage_processes_items():
+    handled = []
+    stage = Stage("test", handled.append, depth=10, workers=2)
+    stage.start()
+
+    for i in range(5):
+        assert stage.submit(i)
+
+    assert wait_until(lambda: len(handled) == 5)
+    stage.stop()
+    assert sorted(handled) == list(range(5))
+    assert stage.stats()["processed"] == 5
+
+
+def test_stage_full():
+    stage = Stage("test", lambda item: None, depth=1)
+
+    assert stage.submit(1)
+    assert not stage.submit(2, block=False)
+    assert stage.qsize() == 1
+
+
+def test_stage_handler_failure():
+    def handler(item):
+        raise ValueError
+
+    stage = Stage("test", handler)
+    stage.start()
+    stage.submit(1)
+
+    assert wait_until(lambda: stage.stats()["failed"] == 1)
+    stage.stop()
+
+
+def test_stage_key_keeps_order():
+    handled: dict[str, list[int]] = {"A": [], "B": []}
+    lock = threading.Lock()
+
+    def handler(item):
+        key, value = item
+        with lock:
+            handled[key].append(value)
+
+    stage = Stage("test", handler, workers=4, key=lambda item: item[0])
+    stage.start()
+    for i in range(100):
+        stage.submit(("A", i))
+        stage.submit(("B", i))
+
+    stage.stop()
+    assert handled["A"] == list(range(100))
+    assert handled["B"] == list(range(100))
+
+
+def test_stage_batch_size():
+    batches = []
+    stage = Stage("test", batches.append, batch_size=10, batch_linger_ms=1000)
+
+    # Queued before the worker starts : first batch is full, the rest comes after the linger time
+    for i in range(15):
+        stage.submit(i)
+    stage.start()
+
+    assert wait_until(lambda: sum(len(batch) for batch in batches) == 15, timeout=3)
+    stage.stop()
+    assert batches[0] == list(range(10))
+    assert batches[1] == list(range(10, 15))
+    assert stage.stats()["processed"] == 15
+
+
+def test_stage_batch_linger():
+    batches = []
+    stage = Stage("test", batches.append, batch_size=100, batch_linger_ms=10)
+    stage.start()
+
+    stage.submit(1)
+    assert wait_until(lambda: batches == [[1]], timeout=1)
+    stage.stop()
+
+
+def test_stage_batch_stop_flushes():
+    batches = []
+    stage = Stage("test", batches.append, batch_size=100, batch_linger_ms=10000)
+    stage.start()
+
+    stage.submit(1)
+    stage.submit(2)
+    stage.stop()
+    assert batches == [[1, 2]]
@@ -0,0 +1,51 @@
+import json
+
+import lib.loriot as loriot
+import lib.ttn as ttn
+from lib.prefilter import UplinkPrefilter
+
+FRAGMENT_FPORTS = {138, 202}
+
+ttn_msg = json.load(open("payload/payload_ttn_fragment1.json"))
+loriot_msg = json.load(open("payload/payload_loriot_fragment1.json"))
+
+
+def ttn_payload(fport: int, indent: int | None = 4) -> bytes:
+    ttn_msg["uplink_message"]["f_port"] = fport
+    return json.dumps(ttn_msg, indent=indent).encode()
+
+
+def test_ttn_fport():
+    prefilter = UplinkPrefilter(ttn.FPORT_KEY, ttn.DEVEUI_KEY, FRAGMENT_FPORTS)
+
+    assert prefilter.wanted(ttn_payload(138))
+    assert prefilter.wanted(ttn_payload(202, indent=None))
+    assert not prefilter.wanted(ttn_payload(10))
+    assert not prefilter.wanted(ttn_payload(1, indent=None))
+
+
+def test_loriot_fport():
+    prefilter = UplinkPrefilter(loriot.FPORT_KEY, loriot.DEVEUI_KEY, FRAGMENT_FPORTS)
+
+    assert prefilter.wanted(json.dumps(loriot_msg).encode())
+    assert not prefilter.wanted(json.dumps({**loriot_msg, "port": 10}).encode())
+    assert prefilter.devEUI(json.dumps(loriot_msg).encode()) == "BCAF9100004DA780"
+
+
+def test_not_conclusive():
+    """Test : uplinks are kept for the full parsing as soon as the prefilter is not sure"""
+    prefilter = UplinkPrefilter(ttn.FPORT_KEY, ttn.DEVEUI_KEY, FRAGMENT_FPORTS)
+
+    # No fPort at all
+    assert prefilter.wanted(b'{"end_device_ids": {"dev_eui": "4200000000000000"}}')
+    # Another f_port key somewhere else in the message
+    assert prefilter.wanted(b'{"uplink_message": {"f_port": 10, "decoded_payload": {"f_port": 138}}}')
+    assert prefilter.wanted(b'{"uplink_message": {"f_port": 138, "decoded_payload": {"f_port": 10}}}')
+
+
+def test_deveui():
+    prefilter = UplinkPrefilter(ttn.FPORT_KEY, ttn.DEVEUI_KEY, FRAGMENT_FPORTS)
+
+    assert prefilter.devEUI(ttn_payload(138)) == "4200000000000000"
+    assert prefilter.devEUI(b'{"f_port": 138}') is None
+    assert prefilter.devEUI(b'{"dev_eui": "4200000000000000", "other": {"dev_eui": "4300000000000000"}}') is None
@@ -0,0 +1,26 @@
+import socket
+import subprocess
+import sys
+
+import lib.self_broker as self_broker
+
+
+def test_wait_ready_listening(monkeypatch):
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        monkeypatch.setattr(self_broker, "BROKER_PORT", server.getsockname()[1])
+
+        process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(5)"])
+        try:
+            assert self_broker.wait_ready(process, timeout=2)
+        finally:
+            process.kill()
+            process.wait()
+
+
+def test_wait_ready_exited():
+    """Broker exiting (port already used, bad config...) is reported without waiting for the timeout"""
+    process = subprocess.Popen([sys.executable, "-c", "exit(1)"])
+    process.wait()
+    assert not self_broker.wait_ready(process, timeout=60)